@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class TokenBucket:
+    """令牌桶限速：consume()在令牌不足时阻塞，rate为None表示不限速"""
+
+    def __init__(self, rate=None, burst_seconds=1.0):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+
+    def consume(self, nbytes):
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                capacity = self.rate * self.burst_seconds
+                self._tokens = min(capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= nbytes or nbytes > capacity and self._tokens >= capacity:
+                    self._tokens -= nbytes
+                    return
+                wait = (min(nbytes, capacity) - self._tokens) / self.rate
+            time.sleep(min(wait, 0.5))
+
+
+def _parse_clock(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def load_profiles(path="bandwidth.json"):
+    """读取分时段带宽配置，文件不存在时返回空列表
+
+    格式: {"profiles": [{"start": "09:00", "end": "18:00", "cap_mib": 2}, ...]}
+    cap_mib为该时段的总带宽上限（MiB/s），null表示不限速；时段可以跨越午夜。
+    """
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    profiles = []
+    for item in data.get("profiles", []):
+        cap = item.get("cap_mib")
+        profiles.append({
+            "start": _parse_clock(item["start"]),
+            "end": _parse_clock(item["end"]),
+            "cap": int(cap * 1024 * 1024) if cap else None,
+        })
+    return profiles
+
+
+class BandwidthGovernor:
+    """全局带宽控制：把总带宽上限分配给所有正在下载的任务
+
+    每个任务的份额按权重分配，接近完成的任务权重更高（最多3倍），让它们
+    尽快结束释放连接；实际速度明显低于份额的任务（受源站限制）只保留
+    略高于实际速度的份额，多余的部分分给其他任务。份额变化时通过apply
+    回调实时更新各任务的限速，无需重新开始下载。
+
+    yt-dlp的分片下载（DASH/HLS）在开始每个格式时复制一份参数，并且每个并发
+    分片各自按ratelimit限速，参数的实时修改对它们无效、总速度也会是份额的
+    若干倍。分片下载改由进度回调调用throttle_progress()，所有分片线程共用
+    本任务的令牌桶，份额变化立即生效。
+    """
+
+    REBALANCE_INTERVAL = 1.0
+    # 单个任务的最低份额（字节/秒）
+    MIN_SHARE = 32 * 1024
+    # 实际速度的平滑系数
+    RATE_SMOOTHING = 0.3
+    # 测得足够多次速度后才判断任务是否受源站限制
+    MIN_SAMPLES = 5
+
+    def __init__(self, cap=None, profiles=None, apply=None):
+        self.cap = cap
+        self.profiles = list(profiles or [])
+        self.apply = apply
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._last_rebalance = 0.0
+
+    def set_cap(self, cap):
+        """修改默认总带宽上限（字节/秒，None表示不限速），立即对运行中的任务生效"""
+        with self._lock:
+            self.cap = cap
+        self.rebalance(force=True)
+
+    def set_profiles(self, profiles):
+        with self._lock:
+            self.profiles = list(profiles)
+        self.rebalance(force=True)
+
+    def current_cap(self, now=None):
+        """当前生效的总带宽上限：匹配的时段配置优先，否则使用默认上限"""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for profile in self.profiles:
+            start, end = profile["start"], profile["end"]
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return profile["cap"]
+        return self.cap
+
+    def register(self, task):
+        with self._lock:
+            self._tasks[task.task_id] = {
+                "task": task, "downloaded": 0, "total": None, "rate": 0.0,
+                "samples": 0, "last_bytes": None, "last_time": None, "bucket": TokenBucket(),
+                "frag_file": None, "frag_bytes": 0,
+            }
+        self.rebalance(force=True)
+        return self.limit_for(task)
+
+    def unregister(self, task):
+        with self._lock:
+            self._tasks.pop(task.task_id, None)
+        self.rebalance(force=True)
+
+    def limit_for(self, task):
+        return task.rate_limit
+
+    def report(self, task, downloaded, total=None):
+        """下载回调中报告已下载的字节数，更新实际速度并按间隔重新分配"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._tasks.get(task.task_id)
+            if state is None or downloaded is None:
+                return
+            if state["last_bytes"] is not None and downloaded >= state["last_bytes"]:
+                elapsed = now - state["last_time"]
+                if elapsed >= 0.2:
+                    instant = (downloaded - state["last_bytes"]) / elapsed
+                    if state["samples"]:
+                        state["rate"] += (instant - state["rate"]) * self.RATE_SMOOTHING
+                    else:
+                        state["rate"] = instant
+                    state["samples"] += 1
+                    state["last_bytes"], state["last_time"] = downloaded, now
+            else:
+                state["last_bytes"], state["last_time"] = downloaded, now
+            state["downloaded"] = downloaded
+            state["total"] = total or state["total"]
+            task.rate = state["rate"]
+        self.rebalance()
+
+    def throttle(self, task, nbytes):
+        """自行读取数据的下载（如边下边转）在每次读取后调用，按任务份额限速"""
+        with self._lock:
+            state = self._tasks.get(task.task_id)
+        if state is not None:
+            state["bucket"].consume(nbytes)
+
+    def throttle_progress(self, task, d):
+        """分片下载的进度回调中调用：按本任务的份额阻塞回调所在的分片线程"""
+        if d.get("status") != "downloading" or not d.get("fragment_count"):
+            return
+        downloaded = d.get("downloaded_bytes") or 0
+        with self._lock:
+            state = self._tasks.get(task.task_id)
+            if state is None:
+                return
+            if state["frag_file"] != d.get("filename"):
+                # 新的格式，从当前位置开始计数
+                state["frag_file"], state["frag_bytes"] = d.get("filename"), downloaded
+                return
+            delta = downloaded - state["frag_bytes"]
+            if delta <= 0:
+                return
+            state["frag_bytes"] = downloaded
+        state["bucket"].consume(delta)
+
+    def rebalance(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_rebalance < self.REBALANCE_INTERVAL:
+                return
+            self._last_rebalance = now
+            cap = self.current_cap()
+            states = list(self._tasks.values())
+            shares = self._allocate(cap, states)
+            changed = []
+            for state in states:
+                limit = shares.get(state["task"].task_id)
+                state["bucket"].set_rate(limit)
+                if limit != state["task"].rate_limit:
+                    state["task"].rate_limit = limit
+                    changed.append((state["task"], limit))
+        if self.apply:
+            for task, limit in changed:
+                self.apply(task, limit)
+
+    def _allocate(self, cap, states):
+        # 调用方需持有锁，按权重注水式分配
+        if not cap or not states:
+            return {state["task"].task_id: None for state in states}
+        weights = {}
+        demands = {}
+        for state in states:
+            task_id = state["task"].task_id
+            progress = state["downloaded"] / state["total"] if state["total"] else 0.0
+            weights[task_id] = 1.0 + 2.0 * min(1.0, progress) ** 2
+            limit = state["task"].rate_limit
+            # 速度明显低于份额时，视为受源站限制，只需要略高于实际速度的带宽
+            if limit and state["samples"] >= self.MIN_SAMPLES and state["rate"] < limit * 0.7:
+                demands[task_id] = max(self.MIN_SHARE, state["rate"] * 1.25)
+
+        shares = {}
+        remaining = float(cap)
+        active = set(weights)
+        while active:
+            total_weight = sum(weights[task_id] for task_id in active)
+            limited = [task_id for task_id in active
+                       if task_id in demands and demands[task_id] < remaining * weights[task_id] / total_weight]
+            if not limited:
+                for task_id in active:
+                    shares[task_id] = remaining * weights[task_id] / total_weight
+                break
+            for task_id in limited:
+                shares[task_id] = demands[task_id]
+                remaining -= demands[task_id]
+                active.discard(task_id)
+        return {task_id: int(max(self.MIN_SHARE, share)) for task_id, share in shares.items()}
+
+    def snapshot(self):
+        """总上限和各任务的实际速度/份额"""
+        with self._lock:
+            return {
+                "cap": self.current_cap(),
+                "tasks": {
+                    task_id: {"rate": round(state["rate"]), "limit": state["task"].rate_limit}
+                    for task_id, state in self._tasks.items()
+                },
+            }
@@ -0,0 +1,250 @@
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from engine import DownloadEngine
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+_JOB_PATH_RE = re.compile(r"^/jobs/([\w-]+)$")
+
+# 写入Prometheus文本文件的间隔（秒）
+METRICS_FILE_INTERVAL = 15
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    """本地HTTP/JSON控制接口
+
+    POST   /jobs        提交任务 {"urls": [...], "options": {...}, "playlist": false}
+    GET    /jobs        所有任务的状态
+    GET    /jobs/<id>   单个任务的状态和各阶段的用时
+    DELETE /jobs/<id>   取消任务（?delete_partial=1 同时删除未完成文件）
+    GET    /metrics     调度器、转码池和各阶段用时的统计信息（?format=prometheus 返回Prometheus文本）
+    POST   /preflight   预检 {"urls": [...], "options": {...}}：总大小、所需空间、预计用时和放得下的地址
+    PUT    /bandwidth   调整总带宽上限 {"cap_mib": 5}（null表示不限速）
+    """
+
+    server_version = "yt-downloader-daemon/1.0"
+
+    @property
+    def engine(self):
+        return self.server.engine
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == "/jobs":
+            self._send(200, {"jobs": [task.snapshot() for task in self.engine.tasks()]})
+        elif parts.path == "/metrics":
+            if parse_qs(parts.query).get("format") == ["prometheus"]:
+                self._send_text(200, self.engine.prometheus_metrics())
+            else:
+                self._send(200, self.engine.metrics())
+        else:
+            match = _JOB_PATH_RE.match(parts.path)
+            task = self.engine.get_task(match.group(1)) if match else None
+            if task is None:
+                self._send(404, {"error": "任务不存在"})
+            else:
+                self._send(200, dict(task.snapshot(), phases=self.engine.phase_metrics.task_spans(task.task_id)))
+
+    def do_POST(self):
+        if self.path not in ("/jobs", "/preflight"):
+            self._send(404, {"error": "接口不存在"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send(400, {"error": "请求体不是有效的JSON"})
+            return
+        urls = body.get("urls") or ([body["url"]] if body.get("url") else [])
+        if not urls:
+            self._send(400, {"error": "缺少urls"})
+            return
+        try:
+            if self.path == "/preflight":
+                report = self.engine.preflight(urls, body.get("options"))
+                # fitting为可用空间内能完成的地址（小的优先），空间不足时客户端可只提交这些
+                self._send(200, dict(report.to_dict(), summary=report.summary(), fitting=report.fitting_urls()))
+                return
+            tasks = self.engine.submit(urls, body.get("options"), playlist=bool(body.get("playlist")))
+        except (ValueError, OSError) as e:
+            # 选项无效或保存目录不可用
+            self._send(400, {"error": str(e)})
+            return
+        self._send(202, {"jobs": [task.snapshot() for task in tasks], "playlist": bool(body.get("playlist"))})
+
+    def do_PUT(self):
+        if self.path != "/bandwidth":
+            self._send(404, {"error": "接口不存在"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            cap = body.get("cap_mib")
+            cap = int(float(cap) * 1024 * 1024) if cap else None
+        except (ValueError, TypeError, AttributeError):
+            self._send(400, {"error": "cap_mib必须是数字"})
+            return
+        self.engine.set_bandwidth_cap(cap)
+        self._send(200, self.engine.bandwidth.snapshot())
+
+    def do_DELETE(self):
+        parts = urlsplit(self.path)
+        match = _JOB_PATH_RE.match(parts.path)
+        if not match or self.engine.get_task(match.group(1)) is None:
+            self._send(404, {"error": "任务不存在"})
+            return
+        delete_partial = parse_qs(parts.query).get("delete_partial")
+        cancelled = self.engine.cancel(
+            match.group(1), delete_partial=delete_partial[0] in ("1", "true") if delete_partial else None
+        )
+        self._send(200, {"cancelled": cancelled, "job": self.engine.get_task(match.group(1)).snapshot()})
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, status, text):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class DownloadDaemon(ThreadingHTTPServer):
+    """常驻的无界面下载服务，所有提交者共用一个引擎（yt_dlp只加载一次）"""
+
+    daemon_threads = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, engine=None, logger=None, metrics_file=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.engine = engine or DownloadEngine(logger=self.logger)
+        # 定期写入的Prometheus文本文件（供node_exporter的textfile采集）
+        self.metrics_file = metrics_file
+        super().__init__((host, port), DaemonHandler)
+
+    def warmup(self):
+        """预先打开历史、探测ffmpeg并加载yt_dlp，第一个任务无需等待"""
+        for label, step in self.engine.warmup_steps():
+            try:
+                step()
+            except Exception as e:
+                self.logger.error(f"预热失败 ({label}): {str(e)}")
+
+    def pump_events(self, interval=1.0):
+        """把引擎事件总线中的消息转写到日志（无界面时代替窗口日志），并定期写入统计文件"""
+        last_write = 0.0
+        while True:
+            lines, _, _, _, dropped = self.engine.result_queue.drain()
+            if dropped:
+                self.logger.warning(f"省略了 {dropped} 条消息")
+            for tag, message in lines:
+                (self.logger.error if tag == "error" else self.logger.info)(message)
+            if self.metrics_file and time.monotonic() - last_write >= METRICS_FILE_INTERVAL:
+                last_write = time.monotonic()
+                try:
+                    self.engine.write_metrics(self.metrics_file)
+                except OSError as e:
+                    self.logger.error(f"写入统计文件失败: {str(e)}")
+            time.sleep(interval)
+
+
+class DaemonClient:
+    """守护进程的客户端，GUI和命令行可以通过它提交和查询任务"""
+
+    def __init__(self, base_url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def submit(self, urls, options=None, playlist=False):
+        return self._request("POST", "/jobs", {"urls": list(urls), "options": options or {}, "playlist": playlist})
+
+    def preflight(self, urls, options=None):
+        # 预检需要解析全部地址，耗时远长于其他接口
+        return self._request("POST", "/preflight", {"urls": list(urls), "options": options or {}}, timeout=600)
+
+    def jobs(self):
+        return self._request("GET", "/jobs")["jobs"]
+
+    def status(self, job_id):
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id, delete_partial=False):
+        return self._request("DELETE", f"/jobs/{job_id}" + ("?delete_partial=1" if delete_partial else ""))
+
+    def metrics(self):
+        return self._request("GET", "/metrics")
+
+    def set_bandwidth(self, cap_mib):
+        return self._request("PUT", "/bandwidth", {"cap_mib": cap_mib})
+
+    def _request(self, method, path, payload=None, timeout=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            request.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            detail = json.loads(e.read() or b"{}").get("error", e.reason)
+            raise RuntimeError(f"守护进程返回 {e.code}: {detail}") from None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="YouTube 下载器守护进程（本地HTTP/JSON接口）")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址，默认只监听本机")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--workers", type=int, default=3, help="并发下载任务数")
+    parser.add_argument("--per-host", type=int, default=2, help="单站点并发上限")
+    parser.add_argument("--bandwidth", type=float, default=None, help="总带宽上限（MiB/s），默认不限速")
+    parser.add_argument("--no-resume", action="store_true", help="启动时不恢复上次未完成的任务")
+    parser.add_argument("--metrics-file", default=None,
+                        help=f"每 {METRICS_FILE_INTERVAL} 秒把统计信息以Prometheus文本格式写入该文件")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = DownloadDaemon(args.host, args.port, metrics_file=args.metrics_file)
+    server.engine.set_limits(args.workers, args.per_host)
+    if args.bandwidth:
+        server.engine.set_bandwidth_cap(int(args.bandwidth * 1024 * 1024))
+    server.warmup()
+    jobs = server.engine.recoverable_jobs()
+    if jobs:
+        if args.no_resume:
+            server.engine.discard_jobs(jobs)
+        else:
+            server.engine.resume_jobs(jobs)
+    threading.Thread(target=server.pump_events, name="event-pump", daemon=True).start()
+    server.logger.info(f"守护进程已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.metrics_file:
+            server.engine.write_metrics(args.metrics_file)
+        server.engine.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import threading
+
+import url_canon
+
+
+def archive_key(extractor, video_id):
+    """归档条目的键，与yt-dlp --download-archive的行格式相同: "<提取器> <视频ID>" """
+    if not extractor or not video_id:
+        return None
+    return f"{extractor.lower()} {video_id}"
+
+
+def archive_key_for_url(url):
+    """不访问网络，从可识别的地址中解析出归档键，无法识别时返回None"""
+    result = url_canon.video_id(url)
+    return archive_key(*result) if result else None
+
+
+class DownloadArchive:
+    """已下载视频的索引
+
+    全部键常驻内存（集合查询为O(1)），磁盘上是只追加的文本文件，
+    每下载成功一个视频追加一行。文件格式与yt-dlp的下载归档兼容。
+    """
+
+    def __init__(self, path="download_archive.txt", logger=None):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._keys = set()
+        self.existed = os.path.exists(path)
+        if self.existed:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self._keys.add(line)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key is not None and key in self._keys
+
+    def contains(self, extractor, video_id):
+        return archive_key(extractor, video_id) in self
+
+    def add(self, extractor, video_id):
+        """记录一个已下载的视频，已存在时不重复写入"""
+        key = archive_key(extractor, video_id)
+        if key is None:
+            return False
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(key + "\n")
+        return True
+
+    def add_many(self, pairs):
+        """批量记录 (提取器, 视频ID)，返回新增的条数"""
+        with self._lock:
+            new_keys = []
+            for extractor, video_id in pairs:
+                key = archive_key(extractor, video_id)
+                if key is not None and key not in self._keys:
+                    self._keys.add(key)
+                    new_keys.append(key)
+            if new_keys:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(key + "\n" for key in new_keys))
+        return len(new_keys)
@@ -0,0 +1,993 @@
+import glob
+import itertools
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+
+from scheduler import DownloadScheduler, DownloadTask
+from metadata_cache import MetadataCache
+from event_bus import EventBus
+from history_store import HistoryStore
+from job_journal import JobJournal
+from bandwidth import BandwidthGovernor, load_profiles
+from fragment_tuner import FragmentTuner
+from format_select import FormatConstraints, select_format
+from preflight import ThroughputHistory, run_preflight
+from metrics import MetricsRegistry, PhaseTimer
+from download_archive import DownloadArchive, archive_key_for_url
+from url_canon import canonical_key
+from toolchain import probe_toolchain
+from process_worker import WorkerProcessPool, WorkerProcessError
+from playlist import FLAT_OPTIONS, MetadataPrefetcher, iter_playlist_entries
+from transcoder import (
+    StreamingTranscoder, TranscodeJob, TranscodePool, FFmpegProgress,
+    build_transcode_command, streaming_formats, read_progress,
+    format_progress, summarize_progress, describe_codec_args
+)
+
+
+def load_yt_dlp():
+    """按需导入yt_dlp，避免拖慢启动（首次导入后由sys.modules缓存）"""
+    import yt_dlp
+    return yt_dlp
+
+
+# 下载选项的默认值，提交任务时未指定的选项使用这些值
+DEFAULT_OPTIONS = {
+    "proxy": None,
+    "save_path": ".",
+    "format_id": "bv*+ba/b",
+    # 按限制条件（FormatConstraints.to_dict()）为每个视频自动选择格式，设置后忽略format_id
+    "format_constraints": None,
+    "download_subtitles": False,
+    # 分片并发数，"auto"表示按实测吞吐自动调整（只影响HLS/DASH分片格式，普通https格式是单连接下载）
+    "thread_count": 4,
+    "transcode": False,
+    "transcode_format": "mp4",
+    "stream_transcode": False,
+    "keep_original": True,
+    "skip_downloaded": True,
+    "delete_partial_on_cancel": False,
+    # 在独立的子进程中下载（可强制结束，不与界面争抢GIL）
+    "process_isolation": False,
+}
+
+
+class DownloadEngine:
+    """与界面无关的下载引擎
+
+    包含下载队列、调度器、转码池、元数据缓存、下载历史和下载归档。GUI、
+    守护进程和命令行共用同一个引擎；所有消息通过事件总线发出，由使用方
+    决定如何显示（GUI按帧率刷新，守护进程写入日志）。
+    """
+
+    def __init__(self, logger=None, result_queue=None, max_workers=3, per_host_limit=2):
+        self.logger = logger or logging.getLogger(__name__)
+        self.result_queue = result_queue if result_queue is not None else EventBus()
+
+        self.download_tasks = []
+        self.total_tasks = 0
+        self.abort_all_tasks = False
+        self._tasks_by_id = {}
+
+        # 任务日志：记录每个任务的选项和状态，重启后可恢复未完成的任务
+        self.journal = JobJournal("job_journal.db", logger=self.logger)
+        self._task_counter = itertools.count(self.journal.next_seq())
+        # 正在展开的播放列表数量
+        self._expanding = 0
+        self._expanding_lock = threading.Lock()
+
+        # 视频元数据缓存，获取信息、查询格式和下载共用
+        self.metadata_cache = MetadataCache("metadata_cache.db", logger=self.logger)
+
+        # 下载历史在启动预热阶段于后台打开
+        self.history_store = None
+        self._history_lock = threading.Lock()
+
+        # 已下载视频的索引，在提取信息之前跳过重复的视频
+        self.download_archive = None
+        self._archive_lock = threading.Lock()
+
+        # 下载调度器：固定大小的工作线程池，限制全局并发和单站点并发
+        self.scheduler = DownloadScheduler(
+            self._download,
+            max_workers=max_workers,
+            per_host_limit=per_host_limit,
+            logger=self.logger,
+            on_state_change=self.journal.update
+        )
+
+        # 全局带宽控制：总上限按权重分配给正在下载的任务，可随时调整
+        self.bandwidth = BandwidthGovernor(apply=self._apply_ratelimit)
+        try:
+            self.bandwidth.set_profiles(load_profiles("bandwidth.json"))
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.error(f"读取分时段带宽配置失败: {str(e)}")
+
+        # 自动分片并发：按站点和代理记住吞吐拐点处的并发数
+        self.fragment_tuner = FragmentTuner("fragment_tuning.json", logger=self.logger)
+
+        # 最近完成的下载的实测速度，用于批量预检估算用时
+        self.throughput_history = ThroughputHistory("throughput_history.json")
+
+        # 各处理阶段的用时统计，可导出为JSON快照或Prometheus文本
+        self.phase_metrics = MetricsRegistry()
+
+        # 独立进程下载模式使用的子进程，每个下载工作线程一个，按需启动
+        self.process_pool = WorkerProcessPool()
+
+        # 转码池：按CPU核数运行ffmpeg，与下载工作线程分离
+        self.transcode_pool = TranscodePool(self._run_transcode_job, logger=self.logger)
+
+        # 播放列表模式下，为即将开始的任务预取完整元数据
+        self.prefetcher = MetadataPrefetcher(
+            self.scheduler,
+            lambda task: self.extract_info_cached(task.url, task.options["proxy"]),
+            logger=self.logger
+        )
+
+    def submit(self, urls, options=None, playlist=False):
+        """提交一批地址，返回加入队列的任务列表
+
+        地址按规范视频ID去重；playlist为True时在后台展开播放列表/频道，
+        条目随展开陆续加入队列（返回值中不包含这些任务）。
+        """
+        options = dict(DEFAULT_OPTIONS, **(options or {}))
+        unique = self._unique_urls(urls)
+
+        # 上一批已全部结束时重新统计进度
+        if not self.is_downloading:
+            self.download_tasks = []
+        self.abort_all_tasks = False
+
+        if playlist:
+            # 播放列表在后台展开，发现条目后立即加入下载队列
+            for url in unique:
+                with self._expanding_lock:
+                    self._expanding += 1
+                threading.Thread(target=self._expand_playlist, args=(url, options), daemon=True).start()
+            self.prefetcher.start(lambda: self.is_downloading)
+            self.update_progress(self.overall_progress(), "正在展开播放列表...")
+            return []
+
+        tasks = []
+        skipped = 0
+        for url in unique:
+            if options["skip_downloaded"] and self._in_archive(archive_key_for_url(url)):
+                skipped += 1
+                continue
+            tasks.append(self._enqueue(url, options))
+            self.logger.info(f"添加下载任务: {url} (格式: {options['format_id']})")
+        if skipped:
+            self.result_queue.put(("info", f"跳过 {skipped} 个已下载的视频"))
+
+        self.update_progress(self.overall_progress(), "准备下载...")
+        return tasks
+
+    def preflight(self, urls, options=None):
+        """下载开始前并行解析所有地址的格式，估算总大小、所需空间和用时
+
+        阻塞直到全部解析完成，应在后台线程调用。解析结果写入元数据缓存，
+        之后提交的下载不会重复提取。
+        """
+        options = dict(DEFAULT_OPTIONS, **(options or {}))
+        constraints = options.get("format_constraints")
+        cap = self.bandwidth.current_cap()
+        workers = self.scheduler.max_workers
+        return run_preflight(
+            self._unique_urls(urls),
+            lambda url: self.extract_info_cached(url, options["proxy"]),
+            options["format_id"], options["save_path"],
+            constraints=FormatConstraints.from_dict(constraints) if constraints else None,
+            workers=workers,
+            # 没有实测记录时按总带宽上限平均分配估算
+            throughput=self.throughput_history.estimate() or (cap / workers if cap else None),
+            is_skipped=(lambda url: self._in_archive(archive_key_for_url(url))) if options["skip_downloaded"] else None,
+            extra_copies=1 if options["transcode"] and options["keep_original"] else 0,
+            total_cap=cap,
+        )
+
+    def expected_throughput(self, host=None, limit=None):
+        """单个下载的预计速度（字节/秒）：最近的实测速度，不超过分配的份额或总带宽上限
+
+        没有实测记录时使用份额或上限，都没有时返回None。
+        """
+        limit = limit or self.bandwidth.current_cap()
+        measured = self.throughput_history.estimate(host)
+        if measured and limit:
+            return min(measured, limit)
+        return measured or limit
+
+    def recoverable_jobs(self):
+        """上次运行中未完成（等待中或下载中）的任务"""
+        return self.journal.unfinished()
+
+    def resume_jobs(self, jobs):
+        """重新提交未完成的任务，下载中断的任务通过continuedl从.part文件继续"""
+        if not self.is_downloading:
+            self.download_tasks = []
+        self.abort_all_tasks = False
+        for job in jobs:
+            task = DownloadTask(job["task_id"], job["url"], dict(DEFAULT_OPTIONS, **job["options"]))
+            task.title = job["title"]
+            task.filename = job["filename"]
+            self._register(task)
+            self.journal.update(task)
+            self.scheduler.submit(task)
+        self.result_queue.put(("info", f"已恢复 {len(jobs)} 个未完成的任务"))
+        self.update_progress(self.overall_progress(), "继续未完成的下载...")
+
+    def discard_jobs(self, jobs):
+        """放弃恢复未完成的任务"""
+        self.journal.discard([job["task_id"] for job in jobs])
+
+    def set_limits(self, max_workers=None, per_host_limit=None):
+        """调整并发上限，对运行中的批次立即生效"""
+        self.scheduler.set_limits(max_workers, per_host_limit)
+
+    def set_bandwidth_cap(self, cap):
+        """设置总带宽上限（字节/秒，None表示不限速），正在下载的任务无需重新开始"""
+        self.bandwidth.set_cap(cap)
+
+    def get_task(self, task_id):
+        return self._tasks_by_id.get(task_id)
+
+    def tasks(self):
+        return list(self._tasks_by_id.values())
+
+    def cancel(self, task_id, delete_partial=None):
+        """取消单个任务，立即返回，不等待任务结束
+
+        delete_partial为None时按任务选项决定是否删除.part和分片文件；
+        保留时下次下载同一视频可以从断点继续。返回是否找到了仍可取消的任务。
+        """
+        task = self._tasks_by_id.get(task_id)
+        if task is None or task.status in ("done", "failed", "cancelled", "cancelling"):
+            return False
+        if delete_partial is None:
+            delete_partial = task.options.get("delete_partial_on_cancel", False)
+        if task.status == "pending":
+            task.cancel_token.cancel(delete_partial)
+            if self.scheduler.cancel(task_id):
+                if delete_partial:
+                    self._remove_partial_files(task)
+                return True
+        # 正在运行的任务先标记为取消中，工作线程真正结束后由调度器改为cancelled
+        task.status = "cancelling"
+        task.cancel_token.cancel(delete_partial)
+        return True
+
+    def stop_all(self, delete_partial=None):
+        """终止所有任务，包括仍在展开的播放列表（不阻塞调用方）"""
+        self.abort_all_tasks = True
+        self.logger.info("正在终止所有下载任务...")
+        self.result_queue.put(("info", "正在终止所有下载任务..."))
+
+        # 取消尚未开始的任务
+        cancelled = self.scheduler.cancel_pending()
+        for task in cancelled:
+            task.cancel_token.cancel(bool(delete_partial))
+        if cancelled:
+            self.logger.info(f"已取消 {len(cancelled)} 个等待中的任务")
+
+        # 通知正在运行的任务，各任务在下一次回调时自行结束
+        for task in self.scheduler.running_tasks():
+            self.cancel(task.task_id, delete_partial)
+
+        self.update_progress(0, "所有下载已终止")
+        self.result_queue.put(("info", "已通知所有下载任务终止"))
+
+    def metrics(self):
+        """调度器、转码池和当前批次的统计信息"""
+        return {
+            "scheduler": self.scheduler.metrics(),
+            "transcode": self.transcode_pool.metrics(),
+            "expanding_playlists": self._expanding,
+            "worker_processes": self.process_pool.alive_count(),
+            "bandwidth": self.bandwidth.snapshot(),
+            "fragment_tuning": self.fragment_tuner.snapshot(),
+            "phases": self.phase_metrics.snapshot(),
+            "tasks": len(self.download_tasks),
+            "finished": self.finished_count(),
+            "overall_progress": round(self.overall_progress(), 1),
+        }
+
+    def prometheus_metrics(self):
+        """Prometheus文本格式的统计：阶段用时直方图、计数器和队列的瞬时状态"""
+        return self.phase_metrics.prometheus_text(self._metric_gauges())
+
+    def write_metrics(self, path):
+        """把Prometheus文本写入文件（例如node_exporter的textfile目录）"""
+        self.phase_metrics.write_prometheus(path, self._metric_gauges())
+
+    def _metric_gauges(self):
+        scheduler = self.scheduler.metrics()
+        transcode = self.transcode_pool.metrics()
+        return {
+            "queue_depth": scheduler["queue_depth"],
+            "running_tasks": scheduler["running"],
+            "transcode_pending": transcode["pending"],
+            "transcode_running": transcode["running"],
+            "bandwidth_cap_bytes": self.bandwidth.current_cap(),
+            "worker_processes": self.process_pool.alive_count(),
+        }
+
+    def shutdown(self):
+        self.scheduler.shutdown()
+        self.process_pool.close()
+
+    def warmup_steps(self):
+        """启动预热步骤，可在后台线程中执行"""
+        return [
+            ("加载下载历史...", self.load_download_history),
+            ("加载下载归档...", self.load_download_archive),
+            ("整理元数据缓存...", self.metadata_cache.purge_expired),
+            ("检测 ffmpeg...", self._warmup_ffmpeg),
+            ("加载 yt-dlp 引擎...", load_yt_dlp),
+        ]
+
+    def _warmup_ffmpeg(self):
+        toolchain = probe_toolchain()
+        if toolchain.available:
+            self.result_queue.put(("info", f"媒体工具链: {toolchain.summary()}"))
+        else:
+            self.result_queue.put(("error", "未找到ffmpeg，合并格式、提取音频和转码将不可用"))
+
+    @property
+    def is_downloading(self):
+        """是否有等待中或运行中的下载任务（包括仍在展开的播放列表）"""
+        return self._expanding > 0 or not self.scheduler.is_idle()
+
+    def extract_info_cached(self, url, proxy):
+        """获取视频元数据，优先读取缓存，未命中时提取并写入缓存"""
+        info_dict = self.metadata_cache.get(url)
+        if info_dict is not None:
+            self.logger.info(f"使用缓存的视频信息: {url}")
+            return info_dict
+
+        yt_dlp = load_yt_dlp()
+        ydl_opts = {
+            'socket_timeout': 10,
+            'proxy': proxy,
+            'quiet': True
+        }
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info_dict = ydl.sanitize_info(ydl.extract_info(url, download=False), remove_private_keys=True)
+        self.metadata_cache.put(url, info_dict)
+        return info_dict
+
+    def _unique_urls(self, urls):
+        """去掉空白和重复的地址（按规范视频ID判断），保持原有顺序"""
+        unique = []
+        seen = set()
+        for url in urls:
+            url = url.strip()
+            key = canonical_key(url) or url
+            if url and key not in seen:
+                seen.add(key)
+                unique.append(url)
+        return unique
+
+    def _enqueue(self, url, options, title=None):
+        """创建下载任务，写入任务日志后提交到调度器"""
+        seq = next(self._task_counter)
+        task = DownloadTask(f"task_{seq}", url, options)
+        task.title = title
+        self._register(task)
+        self.journal.record(seq, task)
+        self.scheduler.submit(task)
+        return task
+
+    def _register(self, task):
+        self.download_tasks.append(task)
+        self._tasks_by_id[task.task_id] = task
+        self.total_tasks = len(self.download_tasks)
+
+    def _expand_playlist(self, url, options):
+        """扁平提取播放列表/频道的条目，边展开边加入下载队列（在后台线程中执行）"""
+        yt_dlp = load_yt_dlp()
+        ydl_opts = dict(FLAT_OPTIONS, socket_timeout=10, proxy=options["proxy"])
+        queued = set(canonical_key(task.url) or task.url
+                     for task in list(self.download_tasks) if task.status in ("pending", "running"))
+        seen_ids = set()
+        archive = self.load_download_archive() if options.get("skip_downloaded") else None
+        count = 0
+        skipped = 0
+        self.result_queue.put(("info", f"正在展开播放列表: {url}"))
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                for entry in iter_playlist_entries(ydl, url, should_stop=lambda: self.abort_all_tasks):
+                    if self.abort_all_tasks:
+                        break
+                    key = canonical_key(entry["url"]) or entry["url"]
+                    if (entry["id"] and entry["id"] in seen_ids) or key in queued:
+                        continue
+                    seen_ids.add(entry["id"])
+                    queued.add(key)
+                    if archive is not None and (archive_key_for_url(entry["url"]) in archive
+                                                or archive.contains(entry.get("ie_key"), entry["id"])):
+                        skipped += 1
+                        continue
+                    self._enqueue(entry["url"], options, title=entry.get("title"))
+                    count += 1
+                    if count == 1 or count % 100 == 0:
+                        self.result_queue.put(("info", f"已从播放列表加入 {count} 个视频..."))
+            if self.abort_all_tasks:
+                self.result_queue.put(("info", f"播放列表展开已终止，已加入 {count} 个视频"))
+            else:
+                self.result_queue.put(("success", f"播放列表展开完成: {url}，加入 {count} 个视频，跳过已下载 {skipped} 个"))
+        except Exception as e:
+            self.logger.error(f"展开播放列表失败: {str(e)}")
+            self.result_queue.put(("error", f"展开播放列表失败: {url} ({str(e)})"))
+        finally:
+            with self._expanding_lock:
+                self._expanding -= 1
+            self.update_progress(self.overall_progress(), f"已加入 {len(self.download_tasks)} 个任务")
+
+    def update_progress(self, percent, message):
+        """更新进度条和进度信息（可在任意线程调用，由界面刷新时统一显示）"""
+        self.result_queue.put(("overall", (percent, message)))
+
+    def overall_progress(self):
+        """根据各任务的独立进度计算整体进度"""
+        tasks = list(self.download_tasks)
+        if not tasks:
+            return 0
+        total = 0.0
+        for task in tasks:
+            if task.status in ("done", "failed", "cancelled"):
+                total += 100
+            else:
+                total += task.progress
+        return total / len(tasks)
+
+    def finished_count(self):
+        return sum(1 for task in list(self.download_tasks) if task.status in ("done", "failed", "cancelled"))
+
+    def _download(self, task):
+        """下载视频或音频的实际处理函数，由调度器的工作线程调用"""
+        url = task.url
+        opts = task.options
+        yt_dlp = load_yt_dlp()
+        save_path = opts["save_path"]
+        format_id = opts["format_id"]
+        
+        try:
+            # 已下载过的视频在任何网络请求之前跳过（同一视频可能在队列中出现多次）
+            if opts.get("skip_downloaded") and self._in_archive(archive_key_for_url(url), self.metadata_cache.get(url)):
+                task.progress = 100
+                task.status = "done"
+                self.result_queue.put(("info", f"已下载过，跳过: {task.title or url}"))
+                return
+
+            # 解析阶段从这里开始，到收到第一块数据为止
+            task.timer = PhaseTimer(self.phase_metrics, task.task_id)
+            task.timer.start("resolve")
+
+            constraints = opts.get("format_constraints")
+            if constraints:
+                format_id = self._resolve_format(task, FormatConstraints.from_dict(constraints)) or format_id
+
+            # 检查是否需要提取音频
+            is_audio = format_id.lower().startswith('audio') or format_id == 'bestaudio' or bool(constraints and constraints.get("audio_only"))
+
+            # 设置yt-dlp选项
+            # 检查ffmpeg是否可用（如果需要合并格式或提取音频），探测结果已缓存，不会每次启动进程
+            toolchain = probe_toolchain()
+            if is_audio and not toolchain.available:
+                raise RuntimeError("需要ffmpeg来提取音频，但未找到ffmpeg。请安装ffmpeg并确保其在系统PATH中。")
+            if '+' in format_id and not toolchain.can_merge():
+                # 无法合并时改用单文件的最佳格式
+                self.result_queue.put(("info", f"[{task.task_id}] 未找到ffmpeg，无法合并 {format_id}，改用单文件最佳格式 b"))
+                format_id = 'b'
+
+            if opts["thread_count"] == "auto":
+                # 测量会话在第一次出现分片进度时才创建，普通https下载不参与调整
+                concurrency = self.fragment_tuner.concurrency_for(task.host, opts["proxy"])
+            else:
+                concurrency = int(opts["thread_count"])
+
+            ydl_opts = {
+                'format': format_id,
+                'outtmpl': f"{save_path}/%(title)s.%(ext)s",
+                'noplaylist': True,
+                'continuedl': True,
+                'quiet': True,
+                'no_warnings': True,
+                'socket_timeout': 10,
+                'proxy': opts["proxy"],
+                'concurrent_fragment_downloads': concurrency,
+                'ratelimit': self.bandwidth.register(task),
+                'progress_hooks': [lambda d: self._download_hook(task, d)],
+                'postprocessor_hooks': [lambda d: self._postprocessor_hook(task, d)],
+                'logger': self.logger,
+                'writesubtitles': opts["download_subtitles"],
+                'writeautomaticsub': opts["download_subtitles"],
+                'subtitleslangs': ['en', 'zh-Hans', 'zh-Hant'],  # 下载多种语言字幕
+            }
+
+            # 如果是音频下载，添加音频处理选项
+            if is_audio:
+                ydl_opts['postprocessors'] = [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'mp3' if format_id == 'bestaudio' else 'best',
+                    'preferredquality': '192',
+                }]
+
+            self.logger.info(f"[{task.task_id}] 开始下载到: {save_path}")
+
+            # 更新进度条
+            self.update_progress(None, f"下载中 {self.finished_count() + 1}/{self.total_tasks}")
+
+            info_dict = None
+            streamed = False
+            if opts.get("process_isolation"):
+                # 独立进程模式：下载和后处理都在子进程中进行
+                info_dict = self._download_in_process(task, ydl_opts)
+                task.ydl = None
+            else:
+                # 每个任务使用独立的ydl实例
+                task.ydl = yt_dlp.YoutubeDL(ydl_opts)
+                # 注册后份额可能已经调整过
+                task.ydl.params['ratelimit'] = task.rate_limit
+            self._check_cancelled(task)
+
+            # 边下边转：转码与下载同时进行，不支持的格式回退到先下载后转码
+            if info_dict is None and opts["transcode"] and opts.get("stream_transcode"):
+                info_dict = self._stream_transcode(task)
+                streamed = info_dict is not None
+
+            # 开始下载，缓存命中时直接使用已提取的信息，跳过重新提取
+            cached_info = self.metadata_cache.get(url) if info_dict is None else None
+            if cached_info is not None:
+                self.logger.info(f"[{task.task_id}] 使用缓存的视频信息，跳过重新提取")
+                try:
+                    info_dict = task.ydl.process_ie_result(cached_info, download=True)
+                except yt_dlp.utils.DownloadError as e:
+                    if task.cancel_token.cancelled:
+                        raise
+                    # 签名地址可能已提前失效，删除缓存后重新提取
+                    self.logger.info(f"[{task.task_id}] 缓存的格式地址不可用，重新提取: {str(e)}")
+                    self.metadata_cache.invalidate(url)
+
+            if info_dict is None and not streamed:
+                info_dict = task.ydl.extract_info(url, download=True)
+                self.metadata_cache.put(url, task.ydl.sanitize_info(info_dict, remove_private_keys=True))
+
+            task.title = info_dict.get('title')
+
+            self._check_cancelled(task)
+
+            # 记入下载归档并保存下载历史
+            with task.timer.span("history"):
+                archive = self.load_download_archive()
+                if archive is not None:
+                    archive.add(info_dict.get('extractor_key'), info_dict.get('id'))
+                self.save_download_history(
+                    url, task.title, format_id, save_path,
+                    extractor=(info_dict.get('extractor_key') or '').lower() or None,
+                    video_id=info_dict.get('id')
+                )
+
+            # 如果启用了转码（且未边下边转），执行转码
+            if opts["transcode"] and not streamed:
+                transcode_format = opts["transcode_format"]
+                downloads = info_dict.get('requested_downloads') or [{}]
+                original_file = downloads[0].get('filepath') or f"{save_path}/{info_dict.get('title', 'video')}.{info_dict.get('ext', 'mp4')}"
+                base = os.path.splitext(original_file)[0]
+                transcoded_file = f"{base}.{transcode_format}"
+                codec_args = toolchain.codec_args_for(transcode_format, info_dict.get('vcodec'), info_dict.get('acodec'))
+
+                if transcoded_file == original_file and codec_args == ["-c:v", "copy", "-c:a", "copy"]:
+                    # 已经是目标容器且编码兼容（按限制条件选择格式时的常见情况），无需转码
+                    self.result_queue.put(("info", f"[{task.task_id}] 已是 {transcode_format} 格式，跳过转码"))
+                else:
+                    if transcoded_file == original_file:
+                        # 容器相同但需要重新编码，ffmpeg不能原地写入
+                        transcoded_file = f"{base}.transcoded.{transcode_format}"
+                    # 提交到转码池后立即返回，工作线程继续处理下一个下载
+                    self.result_queue.put(("info", f"加入转码队列: {original_file} -> {transcoded_file}"))
+                    job = TranscodeJob(
+                        original_file, transcoded_file,
+                        remove_input=not opts.get("keep_original", True),
+                        label=task.title,
+                        duration=info_dict.get('duration'),
+                        codec_args=codec_args,
+                        task_id=task.task_id
+                    )
+                    task.transcode_stats = job.stats
+                    self.transcode_pool.submit(job)
+
+            # 写入历史和提交转码都成功后才算完成，避免客户端看到 done -> failed
+            task.progress = 100
+            task.status = "done"
+            self.logger.info(f"下载完成: {task.title}")
+            self.result_queue.put(("success", f"下载完成: {task.title}"))
+            self.update_progress(None, f"完成 {self.finished_count()}/{self.total_tasks}")
+
+        except Exception as e:
+            if task.cancel_token.cancelled:
+                latency = time.monotonic() - task.cancel_token.requested_at
+                if task.cancel_token.delete_partial:
+                    self._remove_partial_files(task)
+                self.result_queue.put(("info", f"下载已取消: {task.title or url} (用时 {latency:.1f}s)"))
+                return
+            task.status = "failed"
+            task.error = str(e)
+            if task.tuning is not None and ('403' in str(e) or '429' in str(e)):
+                task.tuning.throttled()
+            self.logger.error(f"下载失败: {str(e)}")
+            self.update_progress(None, "下载失败")
+            error_msg = str(e)
+            if "ffmpeg" in error_msg.lower() or "FFmpeg" in error_msg:
+                self.result_queue.put(("error", f"下载失败: 需要ffmpeg但未安装。请安装ffmpeg并确保其在系统PATH中。"))
+            elif 'yt_dlp.utils.DownloadError' in str(type(e)) or 'Network' in error_msg or '403' in error_msg:
+                self.result_queue.put(("error", "连接 YouTube 失败，可能是网络限制或无代理所致。"))
+            else:
+                self.result_queue.put(("error", f"下载失败: {error_msg}"))
+        finally:
+            self.bandwidth.unregister(task)
+            if task.timer is not None:
+                task.timer.close("cancelled" if task.status == "cancelling" else task.status)
+                task.timer = None
+            task.ydl = None
+            task.process = None
+            self.result_queue.put(("progress", None, task.task_id))
+
+    def _resolve_format(self, task, constraints):
+        """按限制条件为任务选择格式，返回格式规格；没有可用格式时返回None"""
+        info = self.extract_info_cached(task.url, task.options["proxy"])
+        task.title = task.title or info.get('title')
+        choice = select_format(info, constraints, throughput=self.expected_throughput(task.host, task.rate_limit))
+        if choice is None:
+            return None
+        self.result_queue.put(("info", f"[{task.task_id}] 选择格式: {choice.describe()}"))
+        return choice.spec
+
+    def _download_in_process(self, task, ydl_opts):
+        """在当前工作线程专用的子进程中下载，返回视频信息；任务取消时结束子进程"""
+        # 回调和logger不能跨进程传递，由子进程通过管道回传进度
+        ydl_opts = {key: value for key, value in ydl_opts.items()
+                    if key not in ('progress_hooks', 'postprocessor_hooks', 'logger')}
+        ydl_opts['ratelimit'] = task.rate_limit
+        cached_info = self.metadata_cache.get(task.url)
+        if cached_info is not None:
+            self.logger.info(f"[{task.task_id}] 使用缓存的视频信息，跳过重新提取")
+
+        def on_progress(d):
+            if d.get('tmpfilename'):
+                task.partial_files.add(d['tmpfilename'])
+            self._report_progress(task, d)
+
+        task.process = self.process_pool.worker()
+        try:
+            result = task.process.run(
+                ydl_opts, task.url, cached_info,
+                on_progress=on_progress,
+                on_postprocess=task.timer.on_postprocess,
+                should_stop=lambda: task.cancel_token.cancelled,
+                logger=self.logger
+            )
+        except WorkerProcessError as e:
+            if e.type_name == "DownloadError":
+                raise load_yt_dlp().utils.DownloadError(str(e)) from None
+            raise
+        if result is None:
+            self._check_cancelled(task)
+            raise WorkerProcessError("WorkerNoResult", "下载子进程未返回结果就结束了")
+        info_dict, stale = result
+        if stale:
+            self.logger.info(f"[{task.task_id}] 缓存的格式地址不可用，已重新提取")
+        if stale or cached_info is None:
+            self.metadata_cache.put(task.url, info_dict)
+        return info_dict
+
+    def _stream_transcode(self, task):
+        """边下边转，成功返回视频信息；格式不支持时返回None，由调用方回退到普通下载"""
+        opts = task.options
+        info = self.metadata_cache.get(task.url)
+        if info is None:
+            info = task.ydl.sanitize_info(task.ydl.extract_info(task.url, download=False), remove_private_keys=True)
+            self.metadata_cache.put(task.url, info)
+
+        # 按用户的格式ID选择格式，但不下载
+        selected = task.ydl.process_ie_result(info, download=False)
+        if streaming_formats(selected, opts["proxy"]) is None:
+            self.result_queue.put(("info", f"[{task.task_id}] 所选格式不支持边下边转（分片格式，或合并格式使用了非HTTP代理），改为下载后转码"))
+            return None
+
+        base = os.path.splitext(task.ydl.prepare_filename(selected))[0]
+        output_file = f"{base}.{opts['transcode_format']}"
+        original_file = None
+        if opts.get("keep_original") and not selected.get('requested_formats'):
+            original_file = f"{base}.{selected.get('ext', 'mp4')}"
+            if original_file == output_file:
+                original_file = f"{base}.original.{selected.get('ext', 'mp4')}"
+
+        received = [0]
+
+        def progress(downloaded, total, speed):
+            received[0] = downloaded
+            self._report_progress(task, {
+                'status': 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                '_percent_str': f"{downloaded / total * 100:.1f}%" if total else '?',
+                '_speed_str': f"{speed / 1024 / 1024:.2f}MiB/s",
+                '_eta_str': f"{int((total - downloaded) / speed)}s" if total and speed else '?',
+            })
+
+        # 源编码与目标容器兼容时直接复制流，否则选用可用的最快编码器
+        codec_args = probe_toolchain().codec_args_for(opts['transcode_format'], selected.get('vcodec'), selected.get('acodec'))
+        task.transcode_stats["codec"] = describe_codec_args(codec_args)
+
+        def encode_progress(stats):
+            task.transcode_stats.update(stats)
+
+        self.result_queue.put(("info", f"[{task.task_id}] 边下边转: {output_file}"))
+
+        # 与转码池的任务一样记录transcode阶段（与下载阶段重叠）
+        task.timer.start("transcode")
+        return_code = None
+        try:
+            # 边下边转同样占用转码池的CPU配额，避免与池中的编码争抢CPU
+            with self.transcode_pool.cpu_slot() as threads:
+                transcoder = StreamingTranscoder(
+                    task.ydl, selected, output_file,
+                    original_file=original_file,
+                    progress_callback=progress,
+                    should_stop=lambda: task.cancel_token.cancelled,
+                    codec_args=codec_args,
+                    threads=threads,
+                    encode_callback=encode_progress,
+                    throttle=lambda nbytes: self.bandwidth.throttle(task, nbytes)
+                )
+                return_code = transcoder.run()
+        finally:
+            if return_code is None and task.cancel_token.cancelled:
+                status = "cancelled"
+            else:
+                status = "done" if return_code == 0 else "failed"
+            try:
+                size = os.path.getsize(output_file) if return_code == 0 else None
+            except OSError:
+                size = None
+            task.timer.end("transcode", size, status)
+        # 下载与编码同时结束
+        task.timer.on_progress({'status': 'finished', 'downloaded_bytes': received[0]})
+        if return_code is None:
+            self._check_cancelled(task)
+            return selected
+        if return_code != 0:
+            raise RuntimeError(f"边下边转失败，返回代码: {return_code}\n{transcoder.error_output()}")
+        self.result_queue.put(("success", f"转码完成: {output_file} ({self.describe_encode(task.transcode_stats)})"))
+        return selected
+
+    def _check_cancelled(self, task):
+        """任务已取消时抛出DownloadCancelled，yt-dlp会中止该任务的下载或后处理"""
+        if task.cancel_token.cancelled:
+            raise load_yt_dlp().utils.DownloadCancelled(f"任务 {task.task_id} 已取消")
+
+    def _download_hook(self, task, d):
+        """下载进度回调函数，每收到一块数据调用一次，取消在这里生效"""
+        self._check_cancelled(task)
+        if d.get('tmpfilename'):
+            task.partial_files.add(d['tmpfilename'])
+        self._report_progress(task, d)
+        # 分片下载不受ratelimit参数的实时调整影响，在回调中按份额限速
+        self.bandwidth.throttle_progress(task, d)
+
+    def _postprocessor_hook(self, task, d):
+        """后处理回调：取消在这里生效，同时记录合并和后处理的用时"""
+        self._check_cancelled(task)
+        if task.timer is not None:
+            task.timer.on_postprocess(d)
+
+    def _report_progress(self, task, d):
+        if task.timer is not None:
+            task.timer.on_progress(d)
+        if task.tuning is None and d.get('fragment_count') and task.options["thread_count"] == "auto":
+            task.tuning = self.fragment_tuner.session(
+                task.host, task.options["proxy"],
+                task.ydl.params.get('concurrent_fragment_downloads') if task.ydl is not None else None
+            )
+        if task.tuning is not None:
+            concurrency = task.tuning.observe(d)
+            # 新的并发数从同一任务的下一个格式开始生效（独立进程模式从下一个任务开始）
+            if concurrency is not None and task.ydl is not None:
+                task.ydl.params['concurrent_fragment_downloads'] = concurrency
+        if d['status'] == 'downloading':
+            percent = d.get('_percent_str', '?')
+            speed = d.get('_speed_str', '?')
+            eta = d.get('_eta_str', '?')
+            # 每个任务只保留最新的进度，整体进度在界面刷新时统一计算
+            self.result_queue.put(("progress", f"[{task.task_id}] 下载中: {percent} 速度: {speed} 剩余时间: {eta}", task.task_id))
+            # 记下目标文件，中断后的.part文件可以对应回任务
+            self.bandwidth.report(task, d.get('downloaded_bytes'), d.get('total_bytes') or d.get('total_bytes_estimate'))
+            if d.get('filename') and d['filename'] != task.filename:
+                task.filename = d['filename']
+                self.journal.update(task)
+            if '%' in percent:
+                try:
+                    task.progress = float(percent.strip().strip('%'))
+                except ValueError:
+                    pass
+        elif d['status'] == 'finished':
+            self.throughput_history.observe(task.host, d)
+            self.result_queue.put(("info", f"[{task.task_id}] 正在处理文件..."))
+
+    def _apply_ratelimit(self, task, ratelimit):
+        """带宽份额变化时更新任务的限速，普通下载在读取下一块数据时生效
+
+        分片下载的各分片使用开始时复制的参数，由throttle_progress()的令牌桶按新份额限速。
+        """
+        if task.ydl is not None:
+            task.ydl.params['ratelimit'] = ratelimit
+        elif task.process is not None:
+            task.process.set_ratelimit(ratelimit)
+
+    def _remove_partial_files(self, task):
+        """删除任务的.part临时文件、分片文件和续传记录，已完成的文件不受影响"""
+        removed = 0
+        candidates = set(task.partial_files)
+        if task.filename:
+            candidates.add(task.filename + ".part")
+        for partial in candidates:
+            paths = [partial, partial + ".ytdl"] + glob.glob(glob.escape(partial) + "-Frag*")
+            for path in paths:
+                if path.endswith((".part", ".ytdl")) or "-Frag" in path:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        self.logger.error(f"删除未完成文件失败 {path}: {str(e)}")
+        if removed:
+            self.result_queue.put(("info", f"[{task.task_id}] 已删除 {removed} 个未完成文件"))
+
+    def load_download_history(self):
+        """打开下载历史存储（首次打开时会导入旧版JSON历史）"""
+        with self._history_lock:
+            if self.history_store is None:
+                try:
+                    self.history_store = HistoryStore("download_history.db", "download_history.json", logger=self.logger)
+                except Exception as e:
+                    self.logger.error(f"加载下载历史失败: {str(e)}")
+        return self.history_store
+
+    def load_download_archive(self):
+        """打开下载归档，首次创建时从下载历史中导入已下载的视频"""
+        with self._archive_lock:
+            if self.download_archive is None:
+                try:
+                    archive = DownloadArchive("download_archive.txt", logger=self.logger)
+                    if not archive.existed:
+                        store = self.load_download_history()
+                        if store is not None:
+                            archive.add_many(store.downloaded_ids())
+                    self.download_archive = archive
+                except Exception as e:
+                    self.logger.error(f"加载下载归档失败: {str(e)}")
+        return self.download_archive
+
+    def _in_archive(self, key, info=None):
+        """根据地址解析出的键或已缓存的视频信息判断是否已下载过"""
+        archive = self.load_download_archive()
+        if archive is None:
+            return False
+        if key in archive:
+            return True
+        return info is not None and archive.contains(info.get('extractor_key'), info.get('id'))
+
+    def save_download_history(self, url, title, format_id, save_path, extractor=None, video_id=None):
+        """保存下载历史，每条记录只追加一行"""
+        try:
+            store = self.load_download_history()
+            if store is not None:
+                store.add(url, title, format_id, save_path, extractor=extractor, video_id=video_id)
+        except Exception as e:
+            self.logger.error(f"保存下载历史失败: {str(e)}")
+
+    def _run_transcode_job(self, job):
+        """转码池的执行函数"""
+        self.result_queue.put(("info", f"开始转码: {job.input_file} -> {job.output_file}"))
+        started = time.time()
+        ok = self.transcode_file(
+            job.input_file, job.output_file,
+            threads=job.threads, duration=job.duration, stats=job.stats, label=job.label,
+            codec_args=job.codec_args
+        )
+        finished = time.time()
+        status = "done" if ok else "failed"
+        try:
+            size = os.path.getsize(job.output_file) if ok else None
+        except OSError:
+            size = None
+        if job.task_id is not None:
+            self.phase_metrics.add_span(job.task_id, "transcode", started, finished, size, status)
+        self.phase_metrics.observe_phase("transcode", finished - started, size, status)
+        if ok and job.remove_input and os.path.exists(job.output_file):
+            try:
+                os.remove(job.input_file)
+            except OSError as e:
+                # 转码已经成功，原文件被占用（Windows）或已被移走时只给出提示
+                self.logger.warning(f"删除原文件失败: {job.input_file}: {str(e)}")
+        return ok
+
+    def transcode_file(self, input_file, output_file, threads=None, duration=None, stats=None, label=None,
+                       codec_args=None):
+        """转码文件，成功返回True；stats不为空时持续写入编码进度"""
+        try:
+            # 检查ffmpeg是否存在
+            if not self.check_ffmpeg():
+                self.result_queue.put(("error", "转码失败: 未找到ffmpeg。请确保ffmpeg已安装并添加到系统PATH中。"))
+                return False
+            
+            # 构建ffmpeg命令
+            cmd = build_transcode_command(input_file, output_file, codec_args=codec_args, threads=threads)
+            
+            # 执行转码
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+
+            # 在单独的线程中读取stderr（避免管道写满阻塞ffmpeg），保留最后几行用于错误提示
+            stderr_tail = deque(maxlen=30)
+
+            def drain_stderr():
+                for line in iter(process.stderr.readline, b""):
+                    stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+            stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+            stderr_thread.start()
+            
+            # 监控转码进度（ffmpeg -progress 输出到标准输出）
+            stats = stats if stats is not None else {}
+            stats["codec"] = describe_codec_args(codec_args)
+            label = label or os.path.basename(output_file)
+
+            progress_key = f"transcode:{output_file}"
+
+            def on_progress(snapshot):
+                stats.update(snapshot)
+                self.result_queue.put(("progress", f"[转码] {label}: {format_progress(snapshot)}", progress_key))
+
+            read_progress(process.stdout, FFmpegProgress(duration), on_progress)
+            
+            return_code = process.wait()
+            stderr_thread.join(timeout=1)
+            self.result_queue.put(("progress", None, progress_key))
+            
+            if return_code == 0:
+                self.result_queue.put(("success", f"转码完成: {output_file} ({self.describe_encode(stats)})"))
+                return True
+            self.result_queue.put(("error", f"转码失败，返回代码: {return_code}\n" + "\n".join(stderr_tail)))
+            return False
+        
+        except Exception as e:
+            self.result_queue.put(("error", f"转码过程中出错: {str(e)}"))
+            return False
+
+    def describe_encode(self, stats):
+        """编码设置和吞吐统计，用于比较不同预设和CRF的CPU开销"""
+        summary = summarize_progress(stats)
+        parts = [stats.get("codec") or describe_codec_args()]
+        if summary["avg_fps"] is not None:
+            parts.append(f"平均 {summary['avg_fps']:.1f}fps")
+        if summary["realtime_multiple"] is not None:
+            parts.append(f"{summary['realtime_multiple']:.2f}x 实时")
+        if summary["bytes_written"] is not None:
+            parts.append(f"输出 {summary['bytes_written'] / 1024 / 1024:.1f}MiB")
+        parts.append(f"用时 {summary['elapsed']:.1f}s")
+        return ", ".join(parts)
+
+    def check_ffmpeg(self):
+        """检查系统中是否安装了ffmpeg（使用缓存的工具链探测结果）"""
+        return probe_toolchain().available
@@ -0,0 +1,50 @@
+import threading
+from collections import deque
+
+
+class EventBus:
+    """工作线程与Tk主循环之间的事件总线
+
+    沿用原结果队列的put((类型, 内容))接口，工作线程只写入内存，从不访问Tk：
+    - info/error/success 日志行按顺序缓存（有上限，界面卡住时丢弃最旧的行）
+    - progress 按键（任务ID）只保留最新一条，内容为None表示清除
+    - overall 整体进度只保留最新一条
+    - call 需要在主线程执行的回调
+    界面按固定帧率调用drain()一次取走全部事件。
+    """
+
+    LOG_TAGS = ("info", "error", "success")
+
+    def __init__(self, max_lines=5000):
+        self._lock = threading.Lock()
+        self._lines = deque(maxlen=max_lines)
+        self._dropped = 0
+        self._progress = {}
+        self._overall = None
+        self._calls = []
+
+    def put(self, event):
+        kind = event[0]
+        with self._lock:
+            if kind in self.LOG_TAGS:
+                if len(self._lines) == self._lines.maxlen:
+                    self._dropped += 1
+                self._lines.append((kind, event[1]))
+            elif kind == "progress":
+                key = event[2] if len(event) > 2 else None
+                self._progress[key] = event[1]
+            elif kind == "overall":
+                self._overall = event[1]
+            elif kind == "call":
+                self._calls.append(event[1])
+
+    def drain(self):
+        """取走所有待处理事件: (日志行, 进度更新, 整体进度, 回调, 丢弃的行数)"""
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            progress, self._progress = self._progress, {}
+            overall, self._overall = self._overall, None
+            calls, self._calls = self._calls, []
+            dropped, self._dropped = self._dropped, 0
+        return lines, progress, overall, calls, dropped
@@ -0,0 +1,262 @@
+from toolchain import CONTAINER_CODECS, normalize_codec
+
+# 纯音频目标容器可直接封装的编码
+AUDIO_CONTAINER_CODECS = {
+    "m4a": {"aac"},
+    "mp3": {"mp3"},
+    "opus": {"opus"},
+    "ogg": {"opus", "vorbis"},
+    "webm": {"opus", "vorbis"},
+    "mka": None,
+}
+
+# 格式类型
+VIDEO_ONLY, AUDIO_ONLY, COMBINED = 0, 1, 2
+
+# 与视频搭配时保留的音频候选数（每个编码族的最佳音频，加上最小的音频）
+AUDIO_SHORTLIST = 4
+
+
+def estimate_size(fmt, duration):
+    """估算格式的字节数，返回 (字节数, 是否为估算值)，无法估算时字节数为None
+
+    依次使用 filesize、filesize_approx、码率×时长（tbr/vbr/abr，单位kbit/s）。
+    """
+    if fmt.get('filesize'):
+        return fmt['filesize'], False
+    if fmt.get('filesize_approx'):
+        return fmt['filesize_approx'], True
+    bitrate = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration), True
+    return None, True
+
+
+class FormatConstraints:
+    """格式选择的限制条件
+
+    max_bytes、max_height、deadline（秒）是硬性限制；vcodecs/acodecs是按顺序
+    的首选编码；container为目标容器，编码与之兼容的格式优先（合并或转码时
+    可以直接复制流）。deadline需要提供预计吞吐量才会生效。
+    """
+
+    def __init__(self, max_bytes=None, max_height=None, vcodecs=None, acodecs=None, container=None,
+                 deadline=None, audio_only=False):
+        self.max_bytes = max_bytes
+        self.max_height = max_height
+        self.vcodecs = [normalize_codec(codec) for codec in (vcodecs or [])]
+        self.acodecs = [normalize_codec(codec) for codec in (acodecs or [])]
+        self.container = container.lower() if container else None
+        self.deadline = deadline
+        self.audio_only = audio_only
+
+    @classmethod
+    def from_dict(cls, data):
+        """从下载选项中的字典创建（键名与构造参数相同）"""
+        return cls(**(data or {}))
+
+    def to_dict(self):
+        return {
+            "max_bytes": self.max_bytes, "max_height": self.max_height,
+            "vcodecs": self.vcodecs, "acodecs": self.acodecs, "container": self.container,
+            "deadline": self.deadline, "audio_only": self.audio_only,
+        }
+
+    def is_empty(self):
+        return not any((self.max_bytes, self.max_height, self.vcodecs, self.acodecs, self.container,
+                        self.deadline, self.audio_only))
+
+
+class FormatTable:
+    """格式列表的列式表示，一次遍历提取选择所需的字段"""
+
+    def __init__(self, info):
+        formats = info.get('formats') or [info]
+        duration = info.get('duration')
+        self.formats = []
+        self.kind = []
+        self.height = []
+        self.fps = []
+        self.bitrate = []
+        self.size = []
+        self.estimated = []
+        self.vcodec = []
+        self.acodec = []
+        for fmt in formats:
+            vcodec = normalize_codec(fmt.get('vcodec'))
+            acodec = normalize_codec(fmt.get('acodec'))
+            # 没有编码信息的格式（如部分直链）按音视频合一处理
+            if vcodec and not acodec and fmt.get('acodec') == 'none':
+                kind = VIDEO_ONLY
+            elif acodec and not vcodec and fmt.get('vcodec') == 'none':
+                kind = AUDIO_ONLY
+            elif fmt.get('vcodec') == 'none' and fmt.get('acodec') == 'none':
+                # 故事板、封面等
+                continue
+            else:
+                kind = COMBINED
+            size, estimated = estimate_size(fmt, duration)
+            self.formats.append(fmt)
+            self.kind.append(kind)
+            self.height.append(fmt.get('height') or 0)
+            self.fps.append(fmt.get('fps') or 0)
+            self.bitrate.append(fmt.get('tbr') or fmt.get('abr') or fmt.get('vbr') or 0)
+            self.size.append(size)
+            self.estimated.append(estimated)
+            self.vcodec.append(vcodec)
+            self.acodec.append(acodec)
+
+    def rows(self, kind):
+        return [row for row, value in enumerate(self.kind) if value == kind]
+
+
+class FormatChoice:
+    """选择结果：格式规格、预计大小和预计下载时间"""
+
+    def __init__(self, spec, formats, size, estimated, seconds, satisfied, compatible, deadline_evaluated=True):
+        self.spec = spec
+        self.formats = formats
+        self.size = size
+        self.estimated = estimated
+        self.seconds = seconds
+        # 是否满足全部硬性限制（不满足时返回的是最接近限制的格式）
+        self.satisfied = satisfied
+        # 编码是否与目标容器兼容
+        self.compatible = compatible
+        # 给出了时限但没有预计速度时无法判断，satisfied不包含时限
+        self.deadline_evaluated = deadline_evaluated
+
+    @property
+    def height(self):
+        return max((fmt.get('height') or 0) for fmt in self.formats)
+
+    def describe(self):
+        parts = [self.spec]
+        if self.height:
+            parts.append(f"{self.height}p")
+        if self.size:
+            parts.append(f"{'约 ' if self.estimated else ''}{self.size / 1024 / 1024:.1f}MiB")
+        else:
+            parts.append("大小未知")
+        if self.seconds is not None:
+            parts.append(f"预计 {self.seconds:.0f}s")
+        if not self.satisfied:
+            parts.append("不满足限制，已选最小的格式")
+        if not self.deadline_evaluated:
+            parts.append("没有速度估计，未检查时限")
+        return ", ".join(parts)
+
+    def to_dict(self):
+        return {
+            "spec": self.spec, "size": self.size, "estimated": self.estimated,
+            "seconds": round(self.seconds, 1) if self.seconds is not None else None,
+            "satisfied": self.satisfied, "compatible": self.compatible, "height": self.height,
+            "deadline_evaluated": self.deadline_evaluated,
+        }
+
+
+def _compatible(container, vcodec, acodec, audio_only):
+    if not container:
+        return True
+    if audio_only:
+        allowed = AUDIO_CONTAINER_CODECS.get(container, CONTAINER_CODECS.get(container, (None, None))[1])
+        return allowed is None or acodec in allowed
+    if container == "mkv":
+        return True
+    video_ok, audio_ok = CONTAINER_CODECS.get(container, (None, None))
+    if video_ok is None:
+        return False
+    return (vcodec is None or vcodec in video_ok) and (acodec is None or acodec in audio_ok)
+
+
+def _rank(preferences, codec):
+    # 首选编码列表中的位置，越小越好；不在列表中的排在最后
+    if not preferences:
+        return 0
+    return preferences.index(codec) if codec in preferences else len(preferences)
+
+
+def _audio_shortlist(table, rows):
+    """每个编码族中码率最高的音频，再加上最小的音频（预算紧张时使用）"""
+    best = {}
+    for row in rows:
+        codec = table.acodec[row]
+        if codec not in best or table.bitrate[row] > table.bitrate[best[codec]]:
+            best[codec] = row
+    shortlist = sorted(best.values(), key=lambda row: table.bitrate[row], reverse=True)[:AUDIO_SHORTLIST]
+    sized = [row for row in rows if table.size[row]]
+    if sized:
+        smallest = min(sized, key=lambda row: table.size[row])
+        if smallest not in shortlist:
+            shortlist.append(smallest)
+    return shortlist
+
+
+def select_format(info, constraints=None, throughput=None):
+    """按限制条件选择格式，返回FormatChoice；没有可用格式时返回None
+
+    所有候选（合一格式、视频+音频组合）在一次遍历中打分：先满足硬性限制，
+    再按容器兼容、分辨率、首选编码、帧率、码率排序，同等条件下选大小已知且更小的。
+    没有候选满足硬性限制时返回预计最小的候选，satisfied为False。
+    throughput为预计下载速度（字节/秒），用于预计下载时间和deadline限制；
+    没有throughput时无法检查deadline，结果的deadline_evaluated为False。
+    """
+    constraints = constraints or FormatConstraints()
+    table = FormatTable(info)
+    audios = table.rows(AUDIO_ONLY)
+
+    candidates = []
+    if constraints.audio_only:
+        candidates = [(None, row) for row in audios] or [(row, None) for row in table.rows(COMBINED)]
+    else:
+        candidates = [(row, None) for row in table.rows(COMBINED)]
+        shortlist = _audio_shortlist(table, audios)
+        candidates += [(video, audio) for video in table.rows(VIDEO_ONLY) for audio in shortlist]
+    if not candidates:
+        return None
+
+    best = None
+    smallest = None
+    for video, audio in candidates:
+        rows = [row for row in (video, audio) if row is not None]
+        sizes = [table.size[row] for row in rows]
+        size = sum(sizes) if None not in sizes else None
+        estimated = any(table.estimated[row] for row in rows)
+        vcodec = table.vcodec[video] if video is not None else None
+        acodec = table.acodec[audio] if audio is not None else (table.acodec[video] if video is not None else None)
+        height = table.height[video] if video is not None else 0
+        seconds = size / throughput if size and throughput else None
+
+        fits = True
+        if constraints.max_height and height > constraints.max_height:
+            fits = False
+        if constraints.max_bytes and (size is None or size > constraints.max_bytes):
+            fits = False
+        if constraints.deadline and throughput and (seconds is None or seconds > constraints.deadline):
+            fits = False
+        compatible = _compatible(constraints.container, vcodec, acodec, constraints.audio_only)
+
+        key = (
+            fits, compatible,
+            height if not constraints.audio_only else 0,
+            -_rank(constraints.vcodecs, vcodec),
+            -_rank(constraints.acodecs, acodec),
+            table.fps[video] if video is not None else 0,
+            sum(table.bitrate[row] for row in rows),
+            # 同等条件下选更小的，大小未知的排在已知大小的之后
+            size is not None, -(size or 0),
+        )
+        if best is None or key > best[0]:
+            best = (key, rows, size, estimated, seconds, fits, compatible)
+        if size is not None and (smallest is None or size < smallest[2]):
+            smallest = (key, rows, size, estimated, seconds, fits, compatible)
+
+    # 没有满足硬性限制的候选时，退而选择预计最小的格式
+    if not best[5] and smallest is not None:
+        best = smallest
+    _, rows, size, estimated, seconds, fits, compatible = best
+    formats = [table.formats[row] for row in rows]
+    # 没有格式ID（单一直链）时交给yt-dlp选择
+    spec = "+".join(fmt['format_id'] for fmt in formats) if all(fmt.get('format_id') for fmt in formats) else "b"
+    return FormatChoice(spec, formats, size, estimated, seconds, fits, compatible,
+                        deadline_evaluated=not (constraints.deadline and not throughput))
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+
+# 可选的分片并发数，自动模式沿这个序列逐级调整
+LADDER = (1, 2, 3, 4, 6, 8, 12, 16)
+# 没有历史记录时的起始并发数
+START = 2
+# 并发数增加一级后吞吐至少提升10%才值得，否则视为越过拐点，退回一级
+GAIN = 1.1
+# 在同一并发数稳定若干次后重新试探更高一级，适应网络变化
+REPROBE_AFTER = 8
+# 测量至少需要的数据量和时长，太短的下载不参与调整
+MIN_BYTES = 4 * 1024 * 1024
+MIN_SECONDS = 3.0
+# 同一并发数多次测量的平滑系数
+SMOOTHING = 0.5
+
+
+def tuning_key(host, proxy):
+    return f"{host or ''}|{proxy or ''}"
+
+
+class FragmentTuner:
+    """分片并发数的自动调整（爬山法）
+
+    每个分片格式下载完成后，用整体吞吐量评估当前的并发数：比低一级高出
+    明显时继续增加，提升不明显（越过拐点）或遇到限流（403/429）时退回一级。每个站点和
+    代理组合的测量结果保存在JSON文件中，下次启动直接从记住的并发数开始。
+
+    只对分片协议（HLS/DASH）有效：普通https格式（YouTube默认选择的格式大多如此）
+    是单个连接下载，concurrent_fragment_downloads对它没有作用，也不会产生测量。
+    """
+
+    def __init__(self, path="fragment_tuning.json", logger=None):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._states = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._states = json.load(f)
+            except (OSError, ValueError) as e:
+                if self.logger:
+                    self.logger.error(f"读取分片并发记录失败: {str(e)}")
+
+    def concurrency_for(self, host, proxy):
+        """该站点和代理组合当前应使用的分片并发数"""
+        with self._lock:
+            state = self._states.get(tuning_key(host, proxy))
+            return state["current"] if state else START
+
+    def session(self, host, proxy, concurrency=None):
+        """为单个任务创建测量会话，concurrency为该任务实际使用的并发数（默认为当前记录值）"""
+        return TuningSession(self, tuning_key(host, proxy), concurrency or self.concurrency_for(host, proxy))
+
+    def record(self, key, concurrency, throughput):
+        """记录一次测量（吞吐量为字节/秒，0表示被限流），返回下一次应使用的并发数"""
+        with self._lock:
+            state = self._states.setdefault(key, {"current": concurrency, "samples": {}, "stable": 0})
+            samples = state["samples"]
+            previous = samples.get(str(concurrency))
+            if previous is None or throughput == 0:
+                samples[str(concurrency)] = throughput
+            else:
+                samples[str(concurrency)] = previous + (throughput - previous) * SMOOTHING
+            state["current"] = self._choose(state, concurrency)
+            state["best"] = max(LADDER, key=lambda n: samples.get(str(n), -1))
+            state["updated"] = time.time()
+            result = state["current"]
+            self._save()
+        if result != concurrency and self.logger:
+            self.logger.info(f"分片并发数调整 ({key}): {concurrency} -> {result}")
+        return result
+
+    def _choose(self, state, concurrency):
+        # 调用方需持有锁
+        samples = state["samples"]
+        index = LADDER.index(concurrency) if concurrency in LADDER else LADDER.index(START)
+        lower = LADDER[index - 1] if index > 0 else None
+        higher = LADDER[index + 1] if index + 1 < len(LADDER) else None
+        current = samples[str(concurrency)]
+        lower_rate = samples.get(str(lower)) if lower else None
+
+        if current == 0:
+            # 被限流，立即退回一级
+            state["stable"] = 0
+            return lower or concurrency
+        if lower_rate is not None and current < lower_rate * GAIN:
+            state["stable"] = 0
+            return lower
+        if higher:
+            higher_rate = samples.get(str(higher))
+            if higher_rate is None or higher_rate >= current * GAIN:
+                state["stable"] = 0
+                return higher
+        state["stable"] = state.get("stable", 0) + 1
+        if higher and state["stable"] >= REPROBE_AFTER:
+            # 丢弃高一级的旧测量值，下一次重新试探
+            samples.pop(str(higher), None)
+            state["stable"] = 0
+        return concurrency
+
+    def _save(self):
+        # 调用方需持有锁，先写临时文件再替换，避免写到一半时中断损坏记录
+        if not self.path:
+            return
+        try:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self._states, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            if self.logger:
+                self.logger.error(f"保存分片并发记录失败: {str(e)}")
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {"current": state["current"], "best": state.get("best")}
+                    for key, state in self._states.items()}
+
+
+class TuningSession:
+    """单个任务的分片吞吐测量
+
+    observe()接收yt-dlp的进度字典，只统计分片下载（HLS/DASH，进度中带有
+    fragment_count），普通https下载直接忽略；每个格式
+    下载完成时记录一次测量，返回调整后的并发数，由调用方应用到同一任务的
+    下一个格式（例如视频之后的音频）。
+    """
+
+    def __init__(self, tuner, key, concurrency):
+        self.tuner = tuner
+        self.key = key
+        self.concurrency = concurrency
+        self._files = {}
+
+    def observe(self, d):
+        filename = d.get("filename")
+        if not filename:
+            return None
+        if d.get("status") == "downloading":
+            if d.get("fragment_count") and filename not in self._files:
+                self._files[filename] = (time.monotonic(), d.get("downloaded_bytes") or 0)
+            return None
+        if d.get("status") != "finished" or filename not in self._files:
+            return None
+        started, start_bytes = self._files.pop(filename)
+        elapsed = time.monotonic() - started
+        downloaded = (d.get("downloaded_bytes") or d.get("total_bytes") or 0) - start_bytes
+        if elapsed < MIN_SECONDS or downloaded < MIN_BYTES:
+            return None
+        self.concurrency = self.tuner.record(self.key, self.concurrency, downloaded / elapsed)
+        return self.concurrency
+
+    def throttled(self):
+        """下载因403/429等限流错误失败时调用，下次退回更低的并发数"""
+        self.concurrency = self.tuner.record(self.key, self.concurrency, 0)
+        return self.concurrency
@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import url_canon
+
+
+def _video_ids(url):
+    """可识别地址的 (提取器, 视频ID)，其他地址返回 (None, None)"""
+    return url_canon.video_id(url or "") or (None, None)
+
+
+class HistoryStore:
+    """基于SQLite的下载历史存储
+
+    每条下载记录只执行一次INSERT，不再整体重写文件，也没有条数上限。
+    URL、视频ID、时间和保存路径均建有索引，便于按需查询。
+    """
+
+    COLUMNS = ("id", "url", "extractor", "video_id", "title", "format_id", "save_path", "timestamp")
+    SORT_COLUMNS = ("timestamp", "title", "url", "format_id", "save_path")
+
+    def __init__(self, path="download_history.db", legacy_json="download_history.json", logger=None):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " url TEXT NOT NULL, extractor TEXT, video_id TEXT, title TEXT,"
+                " format_id TEXT, save_path TEXT, timestamp TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_url ON history(url)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_video_id ON history(video_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_save_path ON history(save_path)")
+            # 历史窗口按标题、格式排序时使用
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_title ON history(title)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_format_id ON history(format_id)")
+            # 早期版本导入旧版JSON时没有填写提取器和视频ID，补填一次
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                rows = self._conn.execute("SELECT id, url FROM history WHERE video_id IS NULL").fetchall()
+                self._conn.executemany(
+                    "UPDATE history SET extractor = ?, video_id = ? WHERE id = ?",
+                    [ids + (row_id,) for row_id, ids in ((row_id, _video_ids(url)) for row_id, url in rows) if ids[1]]
+                )
+                self._conn.execute("PRAGMA user_version = 1")
+
+        if legacy_json and os.path.exists(legacy_json):
+            self._migrate_json(legacy_json)
+
+    def add(self, url, title, format_id, save_path, extractor=None, video_id=None, timestamp=None):
+        """追加一条下载记录"""
+        timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO history (url, extractor, video_id, title, format_id, save_path, timestamp)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, extractor, video_id, title, format_id, save_path, timestamp)
+            )
+            return cursor.lastrowid
+
+    def count(self, search=None):
+        """返回记录数，search不为空时只统计标题、URL或保存路径包含该关键字的记录"""
+        where, params = self._search_clause(search)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+
+    def query(self, search=None, order_by="timestamp", descending=True, limit=100, offset=0):
+        """分页查询记录，过滤和排序都在数据库中完成"""
+        if order_by not in self.SORT_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {order_by}")
+        direction = "DESC" if descending else "ASC"
+        where, params = self._search_clause(search)
+        return self._query(
+            f"SELECT * FROM history{where} ORDER BY {order_by} {direction}, id {direction} LIMIT ? OFFSET ?",
+            params + (limit, offset)
+        )
+
+    def recent(self, limit=100, offset=0):
+        """按时间倒序返回记录"""
+        return self.query(limit=limit, offset=offset)
+
+    def find_by_url(self, url):
+        return self._query("SELECT * FROM history WHERE url = ? ORDER BY id DESC", (url,))
+
+    def find_by_video_id(self, video_id, extractor=None):
+        if extractor is None:
+            return self._query("SELECT * FROM history WHERE video_id = ? ORDER BY id DESC", (video_id,))
+        return self._query(
+            "SELECT * FROM history WHERE video_id = ? AND extractor = ? ORDER BY id DESC", (video_id, extractor)
+        )
+
+    def find(self, url):
+        """查询某个地址的下载记录，可识别的地址按视频ID匹配，能找到同一视频的其他地址形式"""
+        result = url_canon.video_id(url)
+        if result:
+            return self.find_by_video_id(result[1], extractor=result[0])
+        return self.find_by_url(url)
+
+    def find_by_save_path(self, save_path):
+        return self._query("SELECT * FROM history WHERE save_path = ? ORDER BY id DESC", (save_path,))
+
+    def downloaded_ids(self):
+        """返回所有记录过的 (提取器, 视频ID)，用于重建下载归档"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT DISTINCT extractor, video_id FROM history"
+                " WHERE extractor IS NOT NULL AND video_id IS NOT NULL"
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _search_clause(search):
+        if not search:
+            return "", ()
+        pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return (
+            " WHERE title LIKE ? ESCAPE '\\' OR url LIKE ? ESCAPE '\\' OR save_path LIKE ? ESCAPE '\\'",
+            (pattern, pattern, pattern)
+        )
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def _migrate_json(self, legacy_json):
+        """导入旧版download_history.json，完成后重命名原文件"""
+        try:
+            with open(legacy_json, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT INTO history (url, extractor, video_id, title, format_id, save_path, timestamp)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(e.get("url", ""),) + _video_ids(e.get("url")) + (
+                        e.get("title"), e.get("format_id"), e.get("save_path"),
+                        e.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    ) for e in entries]
+                )
+            os.replace(legacy_json, legacy_json + ".migrated")
+            if self.logger:
+                self.logger.info(f"已导入旧版下载历史 {len(entries)} 条")
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"导入旧版下载历史失败: {str(e)}")
@@ -0,0 +1,93 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class JobJournal:
+    """下载任务日志，程序关闭或崩溃后可以恢复未完成的任务
+
+    每个任务入队时写入一行（地址、格式和全部下载选项），之后每次状态变化
+    只执行一次UPDATE。使用WAL模式，崩溃时最多丢失最后一次状态更新，
+    恢复时这类任务仍按未完成处理。
+    """
+
+    UNFINISHED = ("pending", "running")
+    # 已结束的任务保留的天数
+    KEEP_DAYS = 7
+
+    def __init__(self, path="job_journal.db", logger=None):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " seq INTEGER PRIMARY KEY, task_id TEXT NOT NULL UNIQUE, url TEXT NOT NULL,"
+                " format_id TEXT, options TEXT NOT NULL, status TEXT NOT NULL, title TEXT,"
+                " filename TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+            # 上次退出时仍在取消中的任务：用户已要求取消，不再恢复
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE status = 'cancelling'", (time.time(),)
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('pending', 'running') AND updated_at < ?",
+                (time.time() - self.KEEP_DAYS * 86400,)
+            )
+
+    def next_seq(self):
+        """下一个可用的任务序号，保证重启后任务ID不与日志中的重复"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(seq) FROM jobs").fetchone()
+        return (row[0] or 0) + 1
+
+    def record(self, seq, task):
+        """记录新入队的任务"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (seq, task_id, url, format_id, options, status, title,"
+                " filename, error, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (seq, task.task_id, task.url, task.options.get("format_id"),
+                 json.dumps(task.options, ensure_ascii=False), task.status, task.title,
+                 task.filename, task.error, task.created_at, now)
+            )
+
+    def update(self, task):
+        """同步任务的状态、标题、目标文件和错误信息"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, title = ?, filename = ?, error = ?, updated_at = ?"
+                " WHERE task_id = ?",
+                (task.status, task.title, task.filename, task.error, time.time(), task.task_id)
+            )
+
+    def unfinished(self):
+        """返回上次运行中未完成的任务，按入队顺序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, task_id, url, options, status, title, filename FROM jobs"
+                " WHERE status IN ('pending', 'running') ORDER BY seq"
+            ).fetchall()
+        return [
+            {"seq": seq, "task_id": task_id, "url": url, "options": json.loads(options),
+             "status": status, "title": title, "filename": filename}
+            for seq, task_id, url, options, status, title, filename in rows
+        ]
+
+    def discard(self, task_ids):
+        """放弃恢复这些任务，标记为已取消"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE task_id = ?",
+                [(time.time(), task_id) for task_id in task_ids]
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,172 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import url_canon
+
+# 签名格式地址中的过期时间，例如 ...&expire=1700000000&... 或 .../expire/1700000000/...
+_EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d{9,11})")
+
+
+def cache_key(info):
+    """根据提取结果生成规范的缓存键: 提取器:视频ID"""
+    extractor = info.get('extractor_key') or info.get('extractor') or 'generic'
+    return f"{extractor.lower()}:{info.get('id')}"
+
+
+def _signed_url_expiry(info):
+    """返回info中所有签名格式地址里最早的过期时间，没有则返回None"""
+    earliest = None
+    formats = list(info.get('formats') or [])
+    formats += list(info.get('requested_formats') or [])
+    formats.append(info)
+    for f in formats:
+        for field in ('url', 'manifest_url', 'fragment_base_url'):
+            value = f.get(field)
+            if not value or not isinstance(value, str):
+                continue
+            match = _EXPIRE_RE.search(value)
+            if match:
+                expire = int(match.group(1))
+                if earliest is None or expire < earliest:
+                    earliest = expire
+    return earliest
+
+
+class MetadataCache:
+    """持久化的extract_info元数据缓存
+
+    以规范视频ID为键，数据经zlib压缩后存入SQLite。过期时间取签名格式地址的
+    expire参数（预留一定余量），没有签名地址时使用默认TTL；超过容量时按最近
+    访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, path="metadata_cache.db", max_entries=500, default_ttl=6 * 3600,
+                 expiry_margin=600, logger=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.expiry_margin = expiry_margin
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, data BLOB NOT NULL, created REAL NOT NULL,"
+                " expires REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS aliases (url TEXT PRIMARY KEY, key TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_aliases_key ON aliases(key)")
+
+    def get(self, url):
+        """按URL查询缓存，未命中或已过期时返回None
+
+        可识别的地址（如youtu.be、shorts、带时间参数的watch地址）直接按规范视频ID
+        查询，同一视频的不同地址共用一个条目；其他地址按记录过的别名查询。
+        """
+        now = time.time()
+        canonical = self._canonical_key(url)
+        with self._lock:
+            row = None
+            if canonical:
+                row = self._conn.execute(
+                    "SELECT key, data, expires FROM entries WHERE key = ?", (canonical,)
+                ).fetchone()
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT e.key, e.data, e.expires FROM aliases a JOIN entries e ON a.key = e.key"
+                    " WHERE a.url = ?", (url,)
+                ).fetchone()
+            if row is None:
+                return None
+            key, data, expires = row
+            if expires <= now:
+                self._delete_key(key)
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        try:
+            return json.loads(zlib.decompress(data).decode('utf-8'))
+        except (zlib.error, ValueError) as e:
+            if self.logger:
+                self.logger.error(f"读取元数据缓存失败: {str(e)}")
+            self.invalidate(url)
+            return None
+
+    def put(self, url, info):
+        """写入提取结果，info需为可序列化为JSON的字典（见YoutubeDL.sanitize_info）"""
+        if not info or not info.get('id'):
+            return None
+        key = cache_key(info)
+        now = time.time()
+        expires = now + self.default_ttl
+        signed_expiry = _signed_url_expiry(info)
+        if signed_expiry is not None:
+            expires = min(expires, signed_expiry - self.expiry_margin)
+        if expires <= now:
+            return None
+
+        data = zlib.compress(json.dumps(info, ensure_ascii=False).encode('utf-8'), 6)
+        aliases = {url}
+        for field in ('webpage_url', 'original_url'):
+            if info.get(field):
+                aliases.add(info[field])
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, data, created, expires, last_access)"
+                " VALUES (?, ?, ?, ?, ?)", (key, data, now, expires, now)
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO aliases (url, key) VALUES (?, ?)",
+                [(alias, key) for alias in aliases]
+            )
+            self._evict()
+        return key
+
+    def invalidate(self, url):
+        """删除URL对应的缓存条目（例如签名地址提前失效时）"""
+        canonical = self._canonical_key(url)
+        with self._lock:
+            row = self._conn.execute("SELECT key FROM aliases WHERE url = ?", (url,)).fetchone()
+            if row:
+                self._delete_key(row[0])
+            if canonical:
+                self._delete_key(canonical)
+
+    def purge_expired(self):
+        """清理所有已过期的条目"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+            self._conn.execute("DELETE FROM aliases WHERE key NOT IN (SELECT key FROM entries)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _canonical_key(url):
+        result = url_canon.video_id(url)
+        return f"{result[0]}:{result[1]}" if result else None
+
+    def _delete_key(self, key):
+        # 调用方需持有锁
+        with self._conn:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM aliases WHERE key = ?", (key,))
+
+    def _evict(self):
+        # 调用方需持有锁，按最近访问时间淘汰超出容量的条目
+        self._conn.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries"
+            " ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+        )
+        self._conn.execute("DELETE FROM aliases WHERE key NOT IN (SELECT key FROM entries)")
@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# 阶段用时直方图的桶（秒）和数据量直方图的桶（字节）
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+BYTES_BUCKETS = tuple(mib * 1024 * 1024 for mib in (1, 10, 50, 100, 250, 500, 1024, 4096))
+
+# 每个阶段保留最近若干次的用时，用于在JSON快照中计算p50/p95
+RECENT_SAMPLES = 1000
+# 保留明细（各阶段的起止时间）的最近任务数
+KEEP_TASKS = 500
+# 单独计时的后处理器，其余后处理器都计入postprocess阶段
+POSTPROCESS_PHASES = {"Merger": "merge", "MoveFiles": "move"}
+
+
+class Histogram:
+    """固定分桶的直方图，与Prometheus的histogram类型对应"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """按阶段汇总的任务计时：计数器、直方图和最近任务的阶段明细
+
+    阶段包括 resolve（解析）、download、merge、postprocess、move（移动到保存目录）、
+    transcode 和 history（写入历史）。
+
+    snapshot()返回JSON可序列化的字典；prometheus_text()输出Prometheus文本格式，
+    可由守护进程的/metrics接口返回，或写入node_exporter的textfile目录。
+    """
+
+    def __init__(self, namespace="ytdl"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._durations = {}
+        self._bytes = {}
+        self._recent = {}
+        self._spans = OrderedDict()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_span(self, task_id, phase, started, finished, nbytes=None, status="ok"):
+        """记录任务的一段阶段明细（time.time()时间戳）"""
+        with self._lock:
+            spans = self._spans.setdefault(task_id, [])
+            spans.append({
+                "phase": phase, "start": round(started, 3), "end": round(finished, 3),
+                "seconds": round(finished - started, 3), "bytes": nbytes, "status": status,
+            })
+            self._spans.move_to_end(task_id)
+            while len(self._spans) > KEEP_TASKS:
+                self._spans.popitem(last=False)
+
+    def observe_phase(self, phase, seconds, nbytes=None, status="ok"):
+        """一个任务在某阶段的总用时（同一任务同一阶段只记录一次）"""
+        with self._lock:
+            if phase not in self._durations:
+                self._durations[phase] = Histogram(DURATION_BUCKETS)
+                self._recent[phase] = deque(maxlen=RECENT_SAMPLES)
+            self._durations[phase].observe(seconds)
+            self._recent[phase].append(seconds)
+            if nbytes:
+                self._bytes.setdefault(phase, Histogram(BYTES_BUCKETS)).observe(nbytes)
+        self.inc("phase_total", phase=phase, status=status)
+
+    def task_spans(self, task_id):
+        with self._lock:
+            return list(self._spans.get(task_id, []))
+
+    def snapshot(self):
+        with self._lock:
+            phases = {}
+            for phase, histogram in self._durations.items():
+                recent = list(self._recent[phase])
+                size = self._bytes.get(phase)
+                phases[phase] = {
+                    "count": histogram.count,
+                    "seconds": round(histogram.sum, 3),
+                    "p50": _percentile(recent, 0.5),
+                    "p95": _percentile(recent, 0.95),
+                    "bytes": int(size.sum) if size else 0,
+                }
+            counters = {name + _labels(labels): value for (name, labels), value in self._counters.items()}
+        return {"phases": phases, "counters": counters}
+
+    def prometheus_text(self, gauges=None):
+        """Prometheus文本格式；gauges为额外的瞬时指标 {名称: 值}"""
+        ns = self.namespace
+        lines = []
+        with self._lock:
+            by_name = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                by_name.setdefault(name, []).append((labels, value))
+            for name, values in by_name.items():
+                lines.append(f"# TYPE {ns}_{name} counter")
+                lines.extend(f"{ns}_{name}{_labels(labels)} {value}" for labels, value in values)
+            for metric, histograms in (("phase_duration_seconds", self._durations), ("phase_bytes", self._bytes)):
+                if not histograms:
+                    continue
+                lines.append(f"# TYPE {ns}_{metric} histogram")
+                for phase, histogram in sorted(histograms.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{ns}_{metric}_bucket{{phase="{phase}",le="{bound}"}} {count}')
+                    lines.append(f'{ns}_{metric}_bucket{{phase="{phase}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{ns}_{metric}_sum{{phase="{phase}"}} {histogram.sum}')
+                    lines.append(f'{ns}_{metric}_count{{phase="{phase}"}} {histogram.count}')
+        for name, value in (gauges or {}).items():
+            if value is None:
+                continue
+            lines.append(f"# TYPE {ns}_{name} gauge")
+            lines.append(f"{ns}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, gauges=None):
+        """写入Prometheus文本文件，先写临时文件再替换，采集方不会读到半个文件"""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text(gauges))
+        os.replace(temp_path, path)
+
+
+class PhaseTimer:
+    """单个任务的阶段计时，由yt-dlp的进度回调和后处理回调驱动
+
+    下载阶段从第一次收到数据开始，到最后一个格式下载完成为止（视频和音频
+    分开下载时算作一段）；合并（Merger）、移动文件（MoveFiles）和其他后处理
+    （如FFmpegFixup*）分别计时。close()时把各阶段的总用时记入直方图。
+    """
+
+    def __init__(self, registry, task_id):
+        self.registry = registry
+        self.task_id = task_id
+        self._open = {}
+        self._totals = {}
+        self._bytes = {}
+        # 已完成格式的字节数和最后一个格式的完成时间，下载阶段结束时一并记录
+        self._download_bytes = 0
+        self._download_end = None
+        self._lock = threading.Lock()
+
+    def start(self, phase):
+        with self._lock:
+            self._open.setdefault(phase, time.time())
+
+    def end(self, phase, nbytes=None, status="ok", finished=None):
+        with self._lock:
+            started = self._open.pop(phase, None)
+            if started is None:
+                return
+            finished = finished or time.time()
+            self._totals[phase] = self._totals.get(phase, 0.0) + (finished - started)
+            if nbytes:
+                self._bytes[phase] = self._bytes.get(phase, 0) + nbytes
+        self.registry.add_span(self.task_id, phase, started, finished, nbytes, status)
+
+    @contextmanager
+    def span(self, phase):
+        self.start(phase)
+        status = "error"
+        try:
+            yield
+            status = "ok"
+        finally:
+            self.end(phase, status=status)
+
+    def on_progress(self, d):
+        status = d.get("status")
+        if status == "downloading":
+            if "download" not in self._open:
+                self.end("resolve")
+                self.start("download")
+            self._download_end = None
+        elif status == "finished":
+            # 可能还有下一个格式，先记下结束时间
+            self._download_end = time.time()
+            nbytes = d.get("total_bytes") or d.get("downloaded_bytes")
+            if nbytes:
+                with self._lock:
+                    self._download_bytes += nbytes
+
+    def on_postprocess(self, d):
+        # 移动文件只是把临时文件移到保存目录，不计入后处理，否则会被误认为后处理耗时
+        phase = POSTPROCESS_PHASES.get(d.get("postprocessor"), "postprocess")
+        if d.get("status") == "started":
+            self._finish_download()
+            self.start(phase)
+        elif d.get("status") == "finished":
+            self.end(phase)
+
+    def close(self, status):
+        """任务结束：结束仍在进行的阶段，把各阶段总用时记入直方图"""
+        self._finish_download(status)
+        for phase in list(self._open):
+            self.end(phase, status=status)
+        with self._lock:
+            totals = dict(self._totals)
+            sizes = dict(self._bytes)
+        for phase, seconds in totals.items():
+            self.registry.observe_phase(phase, seconds, sizes.get(phase), status)
+        self.registry.inc("tasks_total", status=status)
+        if sizes.get("download"):
+            self.registry.inc("downloaded_bytes_total", sizes["download"])
+
+    def _finish_download(self, status="ok"):
+        if "download" not in self._open:
+            return
+        with self._lock:
+            nbytes = self._download_bytes or None
+            self._download_bytes = 0
+        self.end("download", nbytes, status, finished=self._download_end)
@@ -0,0 +1,117 @@
+import threading
+import time
+
+# 播放列表/频道的快速展开：使用extract_flat只获取条目列表，不解析每个视频
+FLAT_OPTIONS = {
+    'extract_flat': 'in_playlist',
+    'lazy_playlist': True,
+    'skip_download': True,
+    'quiet': True,
+    'no_warnings': True,
+}
+
+# 展开后仍是列表的条目（例如频道下的“视频”“Shorts”标签页）需要继续展开
+_NESTED_TYPES = ('playlist', 'multi_video')
+_NESTED_IE_SUFFIXES = ('Tab', 'Playlist', 'Channel')
+
+
+def entry_url(entry):
+    """返回扁平条目对应的视频地址"""
+    url = entry.get('webpage_url') or entry.get('url')
+    if url and '://' not in url and entry.get('ie_key') == 'Youtube':
+        url = f"https://www.youtube.com/watch?v={url}"
+    return url
+
+
+def _is_nested(entry):
+    if entry.get('_type') in _NESTED_TYPES:
+        return True
+    ie_key = entry.get('ie_key') or ''
+    return ie_key.endswith(_NESTED_IE_SUFFIXES)
+
+
+def iter_playlist_entries(ydl, url, should_stop=None, max_depth=3):
+    """逐条产出播放列表中的视频条目（扁平信息），边获取边返回
+
+    ydl应使用FLAT_OPTIONS创建。url本身是单个视频时只产出它自己。每个条目包含
+    url、id、title和ie_key（提取器名称，用于对照下载归档）。
+    """
+    should_stop = should_stop or (lambda: False)
+    result = ydl.extract_info(url, download=False, process=False)
+    if result is None:
+        return
+
+    if result.get('_type') == 'url' and max_depth > 0 and _is_nested(result):
+        yield from iter_playlist_entries(ydl, result['url'], should_stop, max_depth - 1)
+        return
+
+    if result.get('_type') not in _NESTED_TYPES:
+        yield {'url': result.get('webpage_url') or url, 'id': result.get('id'), 'title': result.get('title'),
+               'ie_key': result.get('extractor_key') or result.get('ie_key')}
+        return
+
+    # process=False时entries是按页获取的生成器，第一页到达后即可开始产出
+    for entry in result.get('entries') or []:
+        if should_stop():
+            return
+        if not entry:
+            continue
+        if _is_nested(entry) and max_depth > 0:
+            nested_url = entry_url(entry)
+            if nested_url:
+                yield from iter_playlist_entries(ydl, nested_url, should_stop, max_depth - 1)
+            continue
+        video_url = entry_url(entry)
+        if video_url:
+            yield {'url': video_url, 'id': entry.get('id'), 'title': entry.get('title'), 'ie_key': entry.get('ie_key')}
+
+
+class MetadataPrefetcher:
+    """按需并行预取即将开始的任务的完整元数据
+
+    只查看调度器等待队列前端的若干任务，工作线程取到任务时元数据已在缓存中；
+    队列后部的条目在轮到之前不会解析，避免签名地址在开始下载前就过期。
+    """
+
+    def __init__(self, scheduler, fetch, workers=2, ahead=8, logger=None):
+        self.scheduler = scheduler
+        self.fetch = fetch
+        self.workers = workers
+        self.ahead = ahead
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._slots = threading.Semaphore(workers)
+        self._thread = None
+
+    def start(self, should_run):
+        """启动预取线程，should_run()返回False后线程退出"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, args=(should_run,), name="metadata-prefetch", daemon=True)
+            self._thread.start()
+
+    def _loop(self, should_run):
+        while should_run():
+            for task in self.scheduler.pending_tasks(self.ahead):
+                with self._lock:
+                    if task.task_id in self._seen:
+                        continue
+                if not self._slots.acquire(blocking=False):
+                    break
+                with self._lock:
+                    self._seen.add(task.task_id)
+                threading.Thread(target=self._prefetch, args=(task,), daemon=True).start()
+            time.sleep(0.5)
+
+    def _prefetch(self, task):
+        try:
+            if task.status == "pending":
+                self.fetch(task)
+        except Exception as e:
+            # 预取失败不影响下载，工作线程会重新提取
+            if self.logger:
+                self.logger.warning(f"预取元数据失败 {task.url}: {str(e)}")
+        finally:
+            self._slots.release()
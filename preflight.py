@@ -0,0 +1,266 @@
+import heapq
+import json
+import os
+import shutil
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from format_select import FormatConstraints, estimate_size, select_format
+
+# 同时解析格式的线程数
+RESOLVE_WORKERS = 8
+# 空间估算的安全余量
+SPACE_MARGIN = 0.05
+# 下载期间的临时空间（相对于文件大小）：合并前音视频文件与输出文件并存；
+# 分片格式的分片文件在追加到.part文件之前单独存放
+MERGE_OVERHEAD = 1.0
+FRAGMENT_OVERHEAD = 0.25
+# 参与速度估算的最小下载量，太小的文件主要受请求延迟影响
+MIN_SAMPLE_BYTES = 1024 * 1024
+
+
+class ThroughputHistory:
+    """最近完成的下载的实测速度（单个任务），保存在JSON文件中供下次估算使用"""
+
+    def __init__(self, path="throughput_history.json", keep=50):
+        self.path = path
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._samples = []
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._samples = json.load(f)[-keep:]
+            except (OSError, ValueError):
+                self._samples = []
+
+    def observe(self, host, d):
+        """从yt-dlp的finished进度回调中记录一次速度"""
+        if d.get("status") != "finished":
+            return
+        size = d.get("total_bytes") or d.get("downloaded_bytes")
+        elapsed = d.get("elapsed")
+        if size and elapsed and size >= MIN_SAMPLE_BYTES:
+            self.add(host, size / elapsed)
+
+    def add(self, host, rate):
+        with self._lock:
+            self._samples.append({"host": host, "rate": rate, "time": time.time()})
+            self._samples = self._samples[-self.keep:]
+            samples = list(self._samples)
+        if self.path:
+            try:
+                temp_path = self.path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(samples, f)
+                os.replace(temp_path, self.path)
+            except OSError:
+                pass
+
+    def estimate(self, host=None):
+        """单个任务的预计速度（字节/秒，最近样本的中位数），优先使用同一站点的样本"""
+        with self._lock:
+            rates = [s["rate"] for s in self._samples if host and s["host"] == host]
+            if len(rates) < 3:
+                rates = [s["rate"] for s in self._samples]
+        return statistics.median(rates) if rates else None
+
+
+def predict_download(info, format_id, constraints=None, throughput=None):
+    """预计下载的格式和字节数，返回 (格式规格, 字节数, 是否含估算值, 是否需要合并, 是否为分片格式)
+
+    给出限制条件时与下载时一样按限制选择；格式ID都能在格式列表中找到时
+    （如137+140）直接累加；其他选择表达式（如bv*+ba/b）按无限制的最佳格式估算。
+    """
+    formats = {fmt.get('format_id'): fmt for fmt in info.get('formats') or [info]}
+    parts = format_id.split("+") if format_id else []
+    if constraints is None and parts and all(part in formats for part in parts):
+        chosen = [formats[part] for part in parts]
+        sizes = [estimate_size(fmt, info.get('duration')) for fmt in chosen]
+        size = sum(s for s, _ in sizes) if all(s is not None for s, _ in sizes) else None
+        estimated = any(e for _, e in sizes)
+        spec = format_id
+    else:
+        if constraints is None:
+            constraints = FormatConstraints(audio_only=format_id in ('bestaudio', 'ba') or format_id.startswith('audio'))
+        choice = select_format(info, constraints, throughput=throughput)
+        if choice is None:
+            return format_id, None, True, False, False
+        chosen, size, estimated, spec = choice.formats, choice.size, choice.estimated, choice.spec
+    fragmented = any(fmt.get('fragments') or 'dash' in (fmt.get('protocol') or '') or 'm3u8' in (fmt.get('protocol') or '')
+                     for fmt in chosen)
+    return spec, size, estimated, len(chosen) > 1, fragmented
+
+
+class PreflightItem:
+    """单个地址的预检结果"""
+
+    def __init__(self, url):
+        self.url = url
+        self.title = None
+        self.spec = None
+        self.size = None
+        self.estimated = False
+        self.merge = False
+        self.fragmented = False
+        self.skipped = False
+        self.error = None
+
+    @property
+    def overhead(self):
+        """下载期间额外占用的临时空间（字节）"""
+        if not self.size:
+            return 0
+        ratio = max(MERGE_OVERHEAD if self.merge else 0, FRAGMENT_OVERHEAD if self.fragmented else 0)
+        return int(self.size * ratio)
+
+    def to_dict(self):
+        return {
+            "url": self.url, "title": self.title, "spec": self.spec, "size": self.size,
+            "estimated": self.estimated, "merge": self.merge, "fragmented": self.fragmented,
+            "skipped": self.skipped, "error": self.error,
+        }
+
+
+def _existing_parent(path):
+    """path本身或最近的已存在的上级目录"""
+    path = os.path.abspath(path or ".")
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class PreflightReport:
+    """整批任务的预检结果：总大小、所需空间、可用空间和预计时间"""
+
+    def __init__(self, items, save_path, workers, throughput, extra_copies=0, total_cap=None):
+        self.items = items
+        self.save_path = save_path
+        self.workers = max(1, workers)
+        # 单个任务的预计速度（字节/秒）
+        self.throughput = throughput
+        # 总带宽上限（字节/秒），并发任务的速度之和不会超过它
+        self.total_cap = total_cap
+        # 转码并保留原文件等情况下每个文件额外写入的副本数
+        self.extra_copies = extra_copies
+        # 保存目录可能还没有创建（下载时才创建），按最近的已存在的上级目录计算
+        self.free_bytes = shutil.disk_usage(_existing_parent(save_path)).free
+
+    @property
+    def pending(self):
+        return [item for item in self.items if not item.skipped and not item.error]
+
+    @property
+    def total_bytes(self):
+        return sum(item.size or 0 for item in self.pending)
+
+    @property
+    def unknown_count(self):
+        return sum(1 for item in self.pending if not item.size)
+
+    @property
+    def required_bytes(self):
+        """最终文件加上同时进行的任务中最大的临时开销"""
+        return int((self.total_bytes * (1 + self.extra_copies) + self._peak_overhead()) * (1 + SPACE_MARGIN))
+
+    def _peak_overhead(self):
+        # 最坏情况：临时开销最大的几个任务同时进行
+        overheads = sorted((item.overhead for item in self.pending), reverse=True)
+        return sum(overheads[:self.workers])
+
+    @property
+    def enough_space(self):
+        return self.required_bytes <= self.free_bytes
+
+    @property
+    def seconds(self):
+        """预计总用时：并发任务的速度之和按最近实测的单任务速度估算"""
+        if not self.throughput:
+            return None
+        rate = self.throughput * min(self.workers, max(1, len(self.pending)))
+        if self.total_cap:
+            rate = min(rate, self.total_cap)
+        return self.total_bytes / rate
+
+    def fitting_urls(self):
+        """可用空间内能完成的地址，小的优先（尽量多完成任务）"""
+        budget = self.free_bytes / (1 + SPACE_MARGIN)
+        items = sorted(self.pending, key=lambda item: item.size or 0)
+        urls = []
+        used = 0
+        # 已选任务中临时开销最大的几个（最小堆），它们可能同时进行
+        peaks = []
+        for item in items:
+            candidate = list(peaks)
+            heapq.heappush(candidate, item.overhead)
+            if len(candidate) > self.workers:
+                heapq.heappop(candidate)
+            need = used + (item.size or 0) * (1 + self.extra_copies)
+            if need + sum(candidate) > budget:
+                break
+            used, peaks = need, candidate
+            urls.append(item.url)
+        return urls
+
+    def summary(self):
+        parts = [
+            f"{len(self.pending)} 个视频",
+            f"共 {self.total_bytes / 1024 ** 3:.2f}GiB" + (f"（{self.unknown_count} 个大小未知）" if self.unknown_count else ""),
+            f"需要 {self.required_bytes / 1024 ** 3:.2f}GiB，可用 {self.free_bytes / 1024 ** 3:.2f}GiB",
+        ]
+        if self.seconds is not None:
+            hours, rest = divmod(int(self.seconds), 3600)
+            parts.append(f"预计用时 {hours}小时{rest // 60}分" if hours else f"预计用时 {rest // 60}分{rest % 60}秒")
+        skipped = sum(1 for item in self.items if item.skipped)
+        failed = sum(1 for item in self.items if item.error)
+        if skipped:
+            parts.append(f"跳过已下载 {skipped} 个")
+        if failed:
+            parts.append(f"{failed} 个解析失败")
+        return "，".join(parts)
+
+    def to_dict(self):
+        return {
+            "total_bytes": self.total_bytes, "unknown": self.unknown_count,
+            "required_bytes": self.required_bytes, "free_bytes": self.free_bytes,
+            "enough_space": self.enough_space,
+            "seconds": round(self.seconds) if self.seconds is not None else None,
+            "items": [item.to_dict() for item in self.items],
+        }
+
+
+def run_preflight(urls, resolve, format_id, save_path, constraints=None, workers=1, throughput=None,
+                  is_skipped=None, extra_copies=0, total_cap=None, should_stop=None):
+    """并行解析所有地址的格式并汇总，任何下载开始之前调用
+
+    resolve(url)返回视频信息（调用方通常使用元数据缓存，下载时无需重新提取）；
+    is_skipped(url)为True的地址（已下载过）不计入。
+    """
+    should_stop = should_stop or (lambda: False)
+
+    def check(url):
+        item = PreflightItem(url)
+        if should_stop():
+            item.error = "已取消"
+            return item
+        if is_skipped and is_skipped(url):
+            item.skipped = True
+            return item
+        try:
+            info = resolve(url)
+            item.title = info.get('title')
+            item.spec, item.size, item.estimated, item.merge, item.fragmented = predict_download(
+                info, format_id, constraints, throughput
+            )
+        except Exception as e:
+            item.error = str(e)
+        return item
+
+    with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as executor:
+        items = list(executor.map(check, urls))
+    return PreflightReport(items, save_path, workers, throughput, extra_copies=extra_copies, total_cap=total_cap)
@@ -0,0 +1,264 @@
+import multiprocessing
+import threading
+import time
+
+from bandwidth import TokenBucket
+
+# 子进程回传的进度字段（进度字典中的info_dict等大对象不回传）
+PROGRESS_FIELDS = (
+    "status", "downloaded_bytes", "total_bytes", "total_bytes_estimate", "speed", "eta",
+    "elapsed", "filename", "tmpfilename", "fragment_index", "fragment_count",
+    "_percent_str", "_speed_str", "_eta_str",
+)
+# 子进程中进度消息的最小间隔（秒），状态变化（如finished）总是立即发送
+PROGRESS_INTERVAL = 0.1
+
+
+class _PipeLogger:
+    """子进程中的yt-dlp logger，把日志通过管道交给父进程的logger"""
+
+    def __init__(self, send):
+        self._send = send
+
+    def debug(self, msg):
+        # yt-dlp把普通的屏幕输出也交给debug，其中下载进度行由进度消息代替
+        if not msg.startswith("[download]"):
+            self._send(("log", ("debug", msg)))
+
+    def info(self, msg):
+        self._send(("log", ("info", msg)))
+
+    def warning(self, msg):
+        self._send(("log", ("warning", msg)))
+
+    def error(self, msg):
+        self._send(("log", ("error", msg)))
+
+
+def _worker_main(conn):
+    """子进程入口：循环接收下载任务，yt_dlp在进程内只导入一次"""
+    import yt_dlp
+
+    # 分片下载时回调可能来自多个线程，管道读写和分片计数共用一把锁
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            conn.send(message)
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        if job[0] == "ratelimit":
+            # 上一个任务结束后才到达的限速调整，忽略
+            continue
+        ydl_opts, url, info = job
+        last_sent = [0.0]
+        current = {}
+        # 分片下载的限速（与父进程中BandwidthGovernor.throttle_progress相同）
+        bucket = TokenBucket(ydl_opts.get("ratelimit"))
+        fragments = {"file": None, "bytes": 0}
+
+        def throttle_fragments(d):
+            downloaded = d.get("downloaded_bytes") or 0
+            with lock:
+                if fragments["file"] != d.get("filename"):
+                    fragments["file"], fragments["bytes"] = d.get("filename"), downloaded
+                    return
+                delta = downloaded - fragments["bytes"]
+                fragments["bytes"] = max(downloaded, fragments["bytes"])
+            if delta > 0:
+                bucket.consume(delta)
+
+        def progress_hook(d):
+            # 下载期间父进程发来的限速调整，直接修改下载器共用的参数
+            with lock:
+                while conn.poll():
+                    kind, value = conn.recv()
+                    if kind == "ratelimit":
+                        bucket.set_rate(value)
+                        if current.get("ydl") is not None:
+                            current["ydl"].params["ratelimit"] = value
+            if d.get("status") == "downloading" and d.get("fragment_count"):
+                throttle_fragments(d)
+            now = time.monotonic()
+            if d.get("status") == "downloading" and now - last_sent[0] < PROGRESS_INTERVAL:
+                return
+            last_sent[0] = now
+            send(("progress", {key: d.get(key) for key in PROGRESS_FIELDS if key in d}))
+
+        def postprocessor_hook(d):
+            send(("postprocess", {"status": d.get("status"), "postprocessor": d.get("postprocessor")}))
+
+        # 子进程与父进程共用控制台，不能输出进度条（会破坏命令行的JSON输出），日志经管道转交
+        ydl_opts = dict(
+            ydl_opts, quiet=True, noprogress=True, logger=_PipeLogger(send),
+            progress_hooks=[progress_hook], postprocessor_hooks=[postprocessor_hook]
+        )
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                current["ydl"] = ydl
+                result = None
+                stale = False
+                if info is not None:
+                    try:
+                        result = ydl.process_ie_result(info, download=True)
+                    except yt_dlp.utils.DownloadError:
+                        # 缓存的签名地址已失效，重新提取
+                        stale = True
+                if result is None:
+                    result = ydl.extract_info(url, download=True)
+                send(("done", {"info": ydl.sanitize_info(result, remove_private_keys=True), "stale": stale}))
+        except Exception as e:
+            send(("error", {"type": type(e).__name__, "message": str(e)}))
+
+
+class WorkerProcessError(RuntimeError):
+    """子进程中的下载失败，type为原异常的类名"""
+
+    def __init__(self, type_name, message):
+        super().__init__(message)
+        self.type_name = type_name
+
+
+class WorkerProcess:
+    """常驻的下载子进程
+
+    下载在独立的解释器中运行，提取和解密签名等CPU密集的工作不再与界面线程
+    争抢GIL，多个子进程可以利用多核。进度通过管道回传；任务取消或子进程
+    长时间无响应时直接结束子进程，下次使用时重新启动。
+    """
+
+    def __init__(self, stall_timeout=180):
+        self.stall_timeout = stall_timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._process = None
+        self._conn = None
+        self._process_exitcode = None
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def run(self, ydl_opts, url, info=None, on_progress=None, on_postprocess=None, should_stop=None, logger=None):
+        """在子进程中下载，返回 (视频信息, 缓存是否失效)；取消时返回None
+
+        ydl_opts中不能包含回调和logger等无法跨进程传递的对象；子进程中yt-dlp的
+        日志转交给logger。
+        """
+        should_stop = should_stop or (lambda: False)
+        self._ensure_started()
+        self._conn.send((ydl_opts, url, info))
+        last_message = time.monotonic()
+        # 合并、转换等后处理期间没有进度消息，放宽无响应的判定时间
+        timeout = self.stall_timeout
+        while True:
+            if should_stop():
+                self.kill()
+                return None
+            if not self._conn.poll(0.2):
+                if not self._process.is_alive():
+                    self._reset()
+                    raise WorkerProcessError("WorkerCrashed", f"下载子进程意外退出 (退出码 {self._process_exitcode})")
+                if time.monotonic() - last_message > timeout:
+                    self.kill()
+                    raise WorkerProcessError("WorkerStalled", f"下载子进程 {timeout} 秒无响应，已强制结束")
+                continue
+            try:
+                kind, payload = self._conn.recv()
+            except (EOFError, OSError):
+                self._reset()
+                raise WorkerProcessError("WorkerCrashed", "下载子进程意外退出")
+            last_message = time.monotonic()
+            if kind == "progress" and on_progress:
+                on_progress(payload)
+            elif kind == "log":
+                if logger is not None:
+                    level, message = payload
+                    getattr(logger, level)(message)
+            elif kind == "postprocess":
+                timeout = self.stall_timeout * (10 if payload["status"] == "started" else 1)
+                if on_postprocess:
+                    on_postprocess(payload)
+            elif kind == "done":
+                return payload["info"], payload["stale"]
+            elif kind == "error":
+                raise WorkerProcessError(payload["type"], payload["message"])
+
+    def set_ratelimit(self, ratelimit):
+        """调整正在进行的下载的限速（字节/秒，None表示不限速），子进程在下一次进度回调时生效"""
+        if self.alive:
+            try:
+                self._conn.send(("ratelimit", ratelimit))
+            except OSError:
+                pass
+
+    def kill(self):
+        """强制结束子进程（下载中断，.part文件保留在磁盘上）"""
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(2)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+        self._reset()
+
+    def close(self):
+        if self.alive:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+            self._process.join(2)
+        self.kill()
+
+    def _ensure_started(self):
+        if self.alive:
+            return
+        self._reset()
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_worker_main, args=(child_conn,), name="download-process", daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+    def _reset(self):
+        self._process_exitcode = self._process.exitcode if self._process is not None else None
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._process = None
+
+
+class WorkerProcessPool:
+    """每个下载工作线程对应一个常驻子进程，子进程数随并发数变化"""
+
+    def __init__(self, stall_timeout=180):
+        self.stall_timeout = stall_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def worker(self):
+        """返回当前线程专用的子进程"""
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            worker = WorkerProcess(self.stall_timeout)
+            self._local.worker = worker
+            with self._lock:
+                self._workers.append(worker)
+        return worker
+
+    def alive_count(self):
+        with self._lock:
+            return sum(1 for worker in self._workers if worker.alive)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,291 @@
+import threading
+import time
+from collections import deque, Counter
+from urllib.parse import urlparse
+
+
+class CancelToken:
+    """单个任务的取消标记
+
+    取消只设置标记，不等待任务结束；下载回调和后处理回调检查标记后
+    中止该任务，其他任务不受影响。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.delete_partial = False
+        self.requested_at = None
+
+    def cancel(self, delete_partial=False):
+        self.delete_partial = delete_partial
+        self.requested_at = time.monotonic()
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class DownloadTask:
+    """单个下载任务，保存该任务独立的状态"""
+
+    def __init__(self, task_id, url, options):
+        self.task_id = task_id
+        self.url = url
+        self.host = (urlparse(url).hostname or "").lower()
+        self.options = dict(options)
+
+        # 任务状态: pending / running / cancelling / done / failed / cancelled
+        # cancelling表示已请求取消、工作线程尚未结束
+        self.status = "pending"
+        self.progress = 0.0
+        self.title = None
+        self.filename = None
+        self.error = None
+        self.ydl = None
+        self.transcode_stats = {}
+        self.cancel_token = CancelToken()
+        # 下载过程中出现的临时文件（.part），取消时可选择删除
+        self.partial_files = set()
+        # 实际下载速度和带宽控制分配的限速（字节/秒，None表示不限速）
+        self.rate = 0.0
+        self.rate_limit = None
+        # 独立进程模式下执行该任务的子进程
+        self.process = None
+        # 自动分片并发模式下的吞吐测量
+        self.tuning = None
+        # 各处理阶段（解析、下载、合并、后处理、写历史）的计时
+        self.timer = None
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._started_monotonic = None
+
+    def snapshot(self):
+        """返回任务状态的字典副本"""
+        return {
+            "task_id": self.task_id,
+            "url": self.url,
+            "host": self.host,
+            "status": self.status,
+            "progress": self.progress,
+            "title": self.title,
+            "filename": self.filename,
+            "error": self.error,
+            "rate": round(self.rate),
+            "rate_limit": self.rate_limit,
+            "transcode_stats": dict(self.transcode_stats),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class DownloadScheduler:
+    """有界工作线程池调度器，支持全局并发上限和单站点并发上限"""
+
+    def __init__(self, worker, max_workers=3, per_host_limit=2, logger=None, on_state_change=None):
+        self.worker = worker
+        self.logger = logger
+        # 任务状态变化（开始、结束、取消）时在锁外调用，用于持久化任务状态
+        self.on_state_change = on_state_change
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._running = {}
+        self._host_active = Counter()
+        self._workers = []
+        self._shutdown = False
+
+        # 统计信息
+        self._started_at = time.monotonic()
+        self._busy_seconds = 0.0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+
+        self._ensure_workers()
+
+    def submit(self, task):
+        """提交任务到等待队列"""
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("调度器已关闭")
+            task.status = "pending"
+            self._pending.append(task)
+            self._cond.notify_all()
+        return task
+
+    def set_limits(self, max_workers=None, per_host_limit=None):
+        """动态调整并发上限，缩小时多余的工作线程会在空闲后退出"""
+        with self._cond:
+            if max_workers is not None:
+                self.max_workers = max(1, int(max_workers))
+            if per_host_limit is not None:
+                self.per_host_limit = max(1, int(per_host_limit))
+            self._ensure_workers()
+            self._cond.notify_all()
+
+    def cancel_pending(self):
+        """取消所有尚未开始的任务，返回被取消的任务列表"""
+        with self._cond:
+            cancelled = list(self._pending)
+            self._pending.clear()
+            for task in cancelled:
+                task.status = "cancelled"
+                task.finished_at = time.time()
+            self._cancelled += len(cancelled)
+        for task in cancelled:
+            self._notify(task)
+        return cancelled
+
+    def cancel(self, task_id):
+        """取消一个尚未开始的任务，任务已开始或不存在时返回False"""
+        with self._cond:
+            for task in self._pending:
+                if task.task_id == task_id:
+                    self._pending.remove(task)
+                    task.status = "cancelled"
+                    task.finished_at = time.time()
+                    self._cancelled += 1
+                    break
+            else:
+                return False
+        self._notify(task)
+        return True
+
+    def pending_tasks(self, limit=None):
+        """返回等待队列前端的任务（按出队顺序）"""
+        with self._cond:
+            tasks = list(self._pending)
+        return tasks if limit is None else tasks[:limit]
+
+    def running_tasks(self):
+        """返回正在运行的任务列表"""
+        with self._cond:
+            return list(self._running.values())
+
+    def is_idle(self):
+        """没有等待和运行中的任务"""
+        with self._cond:
+            return not self._pending and not self._running
+
+    def metrics(self):
+        """返回队列深度、工作线程利用率等指标"""
+        with self._cond:
+            now = time.monotonic()
+            busy = self._busy_seconds + sum(
+                now - task._started_monotonic for task in self._running.values()
+            )
+            elapsed = max(now - self._started_at, 1e-6)
+            capacity = elapsed * self.max_workers
+            return {
+                "queue_depth": len(self._pending),
+                "running": len(self._running),
+                "max_workers": self.max_workers,
+                "per_host_limit": self.per_host_limit,
+                "utilization": len(self._running) / self.max_workers,
+                "avg_utilization": min(1.0, busy / capacity),
+                "hosts": dict(self._host_active),
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+            }
+
+    def shutdown(self):
+        """停止调度器，不再接收新任务"""
+        with self._cond:
+            self._shutdown = True
+            self._pending.clear()
+            self._cond.notify_all()
+
+    def _ensure_workers(self):
+        # 调用方需持有锁
+        self._workers = [t for t in self._workers if t.is_alive()]
+        while len(self._workers) < self.max_workers:
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f"download-worker-{len(self._workers) + 1}",
+                daemon=True,
+            )
+            self._workers.append(thread)
+            thread.start()
+
+    def _next_task(self):
+        # 调用方需持有锁，跳过已达到单站点上限的任务
+        for task in self._pending:
+            if self._host_active[task.host] < self.per_host_limit:
+                self._pending.remove(task)
+                return task
+        return None
+
+    def _worker_loop(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                task = None
+                while not self._shutdown:
+                    # 并发上限缩小时，多余的线程退出
+                    if len(self._workers) > self.max_workers:
+                        self._workers.remove(me)
+                        return
+                    if len(self._running) < self.max_workers:
+                        task = self._next_task()
+                        if task is not None:
+                            break
+                    self._cond.wait()
+                if self._shutdown:
+                    if me in self._workers:
+                        self._workers.remove(me)
+                    return
+
+                task.status = "running"
+                task.started_at = time.time()
+                task._started_monotonic = time.monotonic()
+                self._running[task.task_id] = task
+                self._host_active[task.host] += 1
+
+            self._notify(task)
+            try:
+                self.worker(task)
+                if task.status == "running":
+                    task.status = "done"
+            except Exception as e:
+                task.status = "failed"
+                task.error = str(e)
+                if self.logger:
+                    self.logger.error(f"任务 {task.task_id} 执行出错: {str(e)}")
+            finally:
+                with self._cond:
+                    task.finished_at = time.time()
+                    self._busy_seconds += time.monotonic() - task._started_monotonic
+                    self._running.pop(task.task_id, None)
+                    self._host_active[task.host] -= 1
+                    if self._host_active[task.host] <= 0:
+                        del self._host_active[task.host]
+                    # 工作线程已结束、站点配额已释放，取消到此才算完成
+                    if task.status == "cancelling":
+                        task.status = "cancelled"
+                    if task.status == "done":
+                        self._completed += 1
+                    elif task.status == "cancelled":
+                        self._cancelled += 1
+                    else:
+                        self._failed += 1
+                    self._cond.notify_all()
+                self._notify(task)
+
+    def _notify(self, task):
+        if self.on_state_change is None:
+            return
+        try:
+            self.on_state_change(task)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"记录任务 {task.task_id} 状态失败: {str(e)}")
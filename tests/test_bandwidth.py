@@ -0,0 +1,79 @@
+import time
+from datetime import datetime
+
+from bandwidth import BandwidthGovernor, TokenBucket
+from scheduler import DownloadTask
+
+
+class RecordingBucket:
+    def __init__(self):
+        self.consumed = []
+
+    def set_rate(self, rate):
+        pass
+
+    def consume(self, nbytes):
+        self.consumed.append(nbytes)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(1_000_000)
+    start = time.monotonic()
+    for _ in range(10):
+        bucket.consume(50_000)
+    elapsed = time.monotonic() - start
+    # 桶初始为空，500KB按1MB/s约需0.5秒
+    assert 0.4 <= elapsed < 1.0
+
+
+def test_token_bucket_without_rate_does_not_block():
+    bucket = TokenBucket()
+    start = time.monotonic()
+    bucket.consume(10 ** 9)
+    assert time.monotonic() - start < 0.05
+
+
+def test_shares_follow_cap_and_apply_callback():
+    applied = []
+    governor = BandwidthGovernor(cap=2_000_000, apply=lambda task, limit: applied.append((task.task_id, limit)))
+    first = DownloadTask("t1", "https://a.example/1", {})
+    second = DownloadTask("t2", "https://b.example/2", {})
+    assert governor.register(first) == 2_000_000
+    governor.register(second)
+    assert first.rate_limit == second.rate_limit == 1_000_000
+    governor.set_cap(None)
+    assert first.rate_limit is None and second.rate_limit is None
+    assert sorted(applied[-2:]) == [("t1", None), ("t2", None)]
+
+
+def test_throttle_progress_consumes_fragment_deltas():
+    governor = BandwidthGovernor(cap=1_000_000)
+    task = DownloadTask("t1", "https://a.example/1", {})
+    governor.register(task)
+    bucket = RecordingBucket()
+    governor._tasks["t1"]["bucket"] = bucket
+
+    def progress(filename, downloaded, status="downloading", fragment_count=10):
+        governor.throttle_progress(task, {
+            "status": status, "filename": filename, "downloaded_bytes": downloaded,
+            "fragment_count": fragment_count,
+        })
+
+    progress("video.mp4", 1000)   # 新的格式，只记录起点
+    progress("video.mp4", 4000)
+    progress("video.mp4", 3500)   # 并发分片的回调可能乱序，不重复计数
+    progress("video.mp4", 6000)
+    progress("audio.m4a", 500)    # 换到下一个格式，重新计数
+    progress("audio.m4a", 1500)
+    progress("audio.m4a", 9000, fragment_count=None)  # 非分片下载由ratelimit限速
+    progress("audio.m4a", 9000, status="finished")
+    assert bucket.consumed == [3000, 2000, 1000]
+
+
+def test_profiles_override_default_cap_across_midnight():
+    profiles = [{"start": 22 * 60, "end": 6 * 60, "cap": None}, {"start": 9 * 60, "end": 18 * 60, "cap": 1024}]
+    governor = BandwidthGovernor(cap=4096, profiles=profiles)
+    assert governor.current_cap(datetime(2024, 1, 1, 23, 30)) is None
+    assert governor.current_cap(datetime(2024, 1, 1, 3, 0)) is None
+    assert governor.current_cap(datetime(2024, 1, 1, 10, 0)) == 1024
+    assert governor.current_cap(datetime(2024, 1, 1, 20, 0)) == 4096
@@ -0,0 +1,78 @@
+import io
+import json
+
+import pytest
+
+import daemon
+import yt_downloader_upgraded as cli
+
+
+class FakeClient:
+    instances = []
+
+    def __init__(self, base_url):
+        self.calls = []
+        self.ticks = 0
+        FakeClient.instances.append(self)
+
+    def submit(self, urls, options=None, playlist=False):
+        self.calls.append("submit")
+        self.urls = list(urls)
+        return {"jobs": [{"task_id": f"task_{i}", "url": url} for i, url in enumerate(urls, 1)]}
+
+    def preflight(self, urls, options=None):
+        self.calls.append("preflight")
+        return {
+            "total_bytes": 300, "unknown": 0, "required_bytes": 330, "free_bytes": 200,
+            "enough_space": False, "seconds": None, "summary": "空间不足",
+            "items": [{"url": url, "skipped": False, "error": None} for url in urls],
+            "fitting": urls[:1],
+        }
+
+    def jobs(self):
+        self.calls.append("jobs")
+        self.ticks += 1
+        status = "running" if self.ticks == 1 else "done"
+        return [{
+            "task_id": f"task_{i}", "url": url, "status": status, "progress": 50 if status == "running" else 100,
+            "title": url, "error": None, "created_at": 0.0, "started_at": 1.0, "finished_at": 2.0,
+        } for i, url in enumerate(self.urls, 1)]
+
+    def status(self, job_id):
+        raise AssertionError("不应逐个查询任务")
+
+    def metrics(self):
+        return {"phases": {}}
+
+
+def _run(tmp_path, monkeypatch, *extra):
+    FakeClient.instances.clear()
+    monkeypatch.setattr(daemon, "DaemonClient", FakeClient)
+    source = tmp_path / "urls.txt"
+    source.write_text("https://example.com/a\nhttps://example.com/b\n", encoding="utf-8")
+    out = io.StringIO()
+    monkeypatch.setattr(cli.sys, "stdout", out)
+    code = cli.batch_main([str(source), "--daemon", "http://127.0.0.1:1", "--progress-interval", "0", *extra])
+    return code, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_remote_batch_polls_job_list_once_per_tick(tmp_path, monkeypatch):
+    code, events = _run(tmp_path, monkeypatch)
+    client = FakeClient.instances[0]
+    assert code == 0
+    assert client.calls == ["submit", "jobs", "jobs"]
+    assert [event["event"] for event in events].count("done") == 2
+
+
+def test_remote_batch_forwards_preflight(tmp_path, monkeypatch):
+    code, events = _run(tmp_path, monkeypatch, "--preflight", "--on-low-space", "fit")
+    client = FakeClient.instances[0]
+    assert code == 0
+    assert client.calls[:2] == ["preflight", "submit"]
+    assert client.urls == ["https://example.com/a"]
+    assert {"event": "preflight_fit", "kept": 1, "dropped": 1}.items() <= events[1].items()
+
+
+def test_remote_batch_rejects_local_concurrency_options(tmp_path, monkeypatch):
+    with pytest.raises(SystemExit):
+        _run(tmp_path, monkeypatch, "--jobs", "8")
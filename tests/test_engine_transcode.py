@@ -0,0 +1,30 @@
+import sys
+
+import engine
+
+
+def _engine(tmp_path, monkeypatch, script):
+    monkeypatch.chdir(tmp_path)
+    eng = engine.DownloadEngine()
+    monkeypatch.setattr(eng, "check_ffmpeg", lambda: True)
+    monkeypatch.setattr(engine, "build_transcode_command",
+                        lambda *args, **kwargs: [sys.executable, "-c", script])
+    return eng
+
+
+def _messages(eng, tag):
+    lines = eng.result_queue.drain()[0]
+    return [message for line_tag, message in lines if line_tag == tag]
+
+
+def test_failed_transcode_reports_ffmpeg_stderr(tmp_path, monkeypatch):
+    script = "import sys; sys.stderr.write('Unknown encoder libfoo\\n'); sys.exit(1)"
+    eng = _engine(tmp_path, monkeypatch, script)
+    try:
+        assert eng.transcode_file("in.mp4", "out.mkv") is False
+        errors = _messages(eng, "error")
+    finally:
+        eng.shutdown()
+    assert len(errors) == 1
+    assert "返回代码: 1" in errors[0]
+    assert "Unknown encoder libfoo" in errors[0]
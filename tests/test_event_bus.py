@@ -0,0 +1,32 @@
+from event_bus import EventBus
+
+
+def test_progress_is_coalesced_per_key():
+    bus = EventBus()
+    bus.put(("progress", "10%", "task_1"))
+    bus.put(("progress", "50%", "task_1"))
+    bus.put(("progress", "5%", "task_2"))
+    bus.put(("progress", None, "task_2"))
+    bus.put(("progress", "总进度"))
+    bus.put(("overall", (10, "下载中")))
+    bus.put(("overall", (20, "下载中")))
+
+    lines, progress, overall, calls, dropped = bus.drain()
+    assert progress == {"task_1": "50%", "task_2": None, None: "总进度"}
+    assert overall == (20, "下载中")
+    assert (lines, calls, dropped) == ([], [], 0)
+    # 取走后清空
+    assert bus.drain() == ([], {}, None, [], 0)
+
+
+def test_log_lines_keep_order_and_drop_oldest():
+    bus = EventBus(max_lines=3)
+    for i in range(5):
+        bus.put(("info" if i % 2 else "error", f"第{i}行"))
+    callback = object()
+    bus.put(("call", callback))
+
+    lines, _, _, calls, dropped = bus.drain()
+    assert lines == [("error", "第2行"), ("info", "第3行"), ("error", "第4行")]
+    assert calls == [callback]
+    assert dropped == 2
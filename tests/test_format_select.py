@@ -0,0 +1,84 @@
+from format_select import FormatConstraints, estimate_size, select_format
+
+MIB = 1024 * 1024
+
+
+def _video(format_id, height, vcodec, size, fps=30, tbr=1000):
+    return {"format_id": format_id, "height": height, "vcodec": vcodec, "acodec": "none",
+            "filesize": size, "fps": fps, "tbr": tbr}
+
+
+def _audio(format_id, acodec, size, abr=128):
+    return {"format_id": format_id, "vcodec": "none", "acodec": acodec, "filesize": size, "abr": abr}
+
+
+INFO = {
+    "duration": 600,
+    "formats": [
+        {"format_id": "sb0", "vcodec": "none", "acodec": "none"},
+        _audio("140", "mp4a.40.2", 10 * MIB),
+        _audio("251", "opus", 9 * MIB, abr=160),
+        _video("136", 720, "avc1.4d401f", 50 * MIB),
+        _video("247", 720, "vp9", 40 * MIB),
+        _video("137", 1080, "avc1.640028", 120 * MIB),
+        _video("248", 1080, "vp9", 100 * MIB),
+    ],
+}
+
+
+def test_highest_resolution_wins_then_codec_and_size():
+    choice = select_format(INFO)
+    assert choice.height == 1080
+    # 分辨率、帧率相同时码率相同，选更小的组合
+    assert choice.spec == "248+251"
+    assert choice.satisfied and choice.deadline_evaluated
+
+
+def test_container_compatibility_ranks_before_resolution():
+    choice = select_format(INFO, FormatConstraints(container="mp4", max_height=720))
+    assert choice.spec == "136+140"
+    assert choice.compatible
+
+
+def test_codec_preference_order():
+    choice = select_format(INFO, FormatConstraints(vcodecs=["h264", "vp9"]))
+    assert choice.spec.startswith("137+")
+
+
+def test_size_limit_and_fallback_to_smallest():
+    choice = select_format(INFO, FormatConstraints(max_bytes=60 * MIB))
+    assert choice.height == 720
+    assert choice.size <= 60 * MIB
+
+    choice = select_format(INFO, FormatConstraints(max_bytes=10 * MIB))
+    assert not choice.satisfied
+    assert choice.spec == "247+251"
+
+
+def test_deadline_needs_throughput():
+    constraints = FormatConstraints(deadline=60)
+    choice = select_format(INFO, constraints, throughput=1 * MIB)
+    assert choice.spec == "247+251"
+    assert choice.seconds == 49
+    assert choice.satisfied and choice.deadline_evaluated
+
+    choice = select_format(INFO, constraints)
+    assert choice.height == 1080
+    assert not choice.deadline_evaluated
+    assert "未检查时限" in choice.describe()
+
+
+def test_unknown_size_ranks_after_known_size():
+    info = {"formats": [
+        {"format_id": "a", "height": 720, "vcodec": "avc1", "acodec": "mp4a", "tbr": 1000},
+        {"format_id": "b", "height": 720, "vcodec": "avc1", "acodec": "mp4a", "tbr": 1000, "filesize": 80 * MIB},
+    ]}
+    assert select_format(info).spec == "b"
+
+
+def test_audio_only_and_size_estimates():
+    choice = select_format(INFO, FormatConstraints(audio_only=True, container="m4a"))
+    assert choice.spec == "140"
+    assert estimate_size({"filesize_approx": 5}, 10) == (5, True)
+    assert estimate_size({"vbr": 800, "abr": 200}, 8) == (1_000_000, True)
+    assert estimate_size({}, None) == (None, True)
@@ -0,0 +1,45 @@
+import time
+
+from fragment_tuner import MIN_BYTES, START, FragmentTuner, tuning_key
+
+MIB = 1024 * 1024
+
+
+def test_climbs_until_gain_stops_then_steps_back(tmp_path):
+    tuner = FragmentTuner(str(tmp_path / "tuning.json"))
+    key = tuning_key("a.example", None)
+    assert tuner.concurrency_for("a.example", None) == START == 2
+    assert tuner.record(key, 2, 10 * MIB) == 3
+    assert tuner.record(key, 3, 12 * MIB) == 4
+    # 提升不到10%，越过拐点，退回一级
+    assert tuner.record(key, 4, 12.5 * MIB) == 3
+    assert tuner.snapshot()[key] == {"current": 3, "best": 4}
+
+    # 记录保存到文件，下次启动从记住的并发数开始
+    assert FragmentTuner(str(tmp_path / "tuning.json")).concurrency_for("a.example", None) == 3
+
+
+def test_throttling_steps_down_immediately(tmp_path):
+    tuner = FragmentTuner(str(tmp_path / "tuning.json"))
+    session = tuner.session("a.example", "socks5://127.0.0.1:1080", 6)
+    assert session.throttled() == 4
+    assert tuner.concurrency_for("a.example", "socks5://127.0.0.1:1080") == 4
+    assert tuner.concurrency_for("a.example", None) == START
+
+
+def test_session_measures_only_fragmented_downloads(tmp_path):
+    tuner = FragmentTuner(str(tmp_path / "tuning.json"))
+    session = tuner.session("a.example", None)
+
+    # 普通https下载没有fragment_count，不产生测量
+    session.observe({"status": "downloading", "filename": "plain.mp4", "downloaded_bytes": 0})
+    assert session.observe({"status": "finished", "filename": "plain.mp4", "downloaded_bytes": 50 * MIB}) is None
+
+    session.observe({"status": "downloading", "filename": "video.mp4", "downloaded_bytes": 0, "fragment_count": 100})
+    # 太短的下载不参与调整
+    assert session.observe({"status": "finished", "filename": "video.mp4", "downloaded_bytes": MIN_BYTES - 1}) is None
+
+    session.observe({"status": "downloading", "filename": "audio.m4a", "downloaded_bytes": 0, "fragment_count": 10})
+    session._files["audio.m4a"] = (time.monotonic() - 5, 0)
+    assert session.observe({"status": "finished", "filename": "audio.m4a", "downloaded_bytes": 20 * MIB}) == 3
+    assert tuner.concurrency_for("a.example", None) == 3
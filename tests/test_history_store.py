@@ -0,0 +1,24 @@
+import json
+
+from history_store import HistoryStore
+
+
+def test_migrated_json_history_is_found_by_video_id(tmp_path):
+    legacy = tmp_path / "download_history.json"
+    legacy.write_text(json.dumps([
+        {"url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ", "title": "旧记录", "format_id": "best",
+         "save_path": "/tmp", "timestamp": "2024-01-01 00:00:00"},
+        {"url": "https://example.com/video.mp4", "title": "直链", "format_id": "best",
+         "save_path": "/tmp", "timestamp": "2024-01-02 00:00:00"},
+    ]), encoding="utf-8")
+
+    store = HistoryStore(str(tmp_path / "history.db"), str(legacy))
+    try:
+        # 同一视频的其他地址形式也能找到
+        found = store.find("https://youtu.be/dQw4w9WgXcQ?t=30")
+        assert [entry["title"] for entry in found] == ["旧记录"]
+        assert store.downloaded_ids() == [("youtube", "dQw4w9WgXcQ")]
+        assert [entry["title"] for entry in store.find("https://example.com/video.mp4")] == ["直链"]
+    finally:
+        store.close()
+    assert (tmp_path / "download_history.json.migrated").exists()
@@ -0,0 +1,36 @@
+import types
+
+from job_journal import JobJournal
+
+
+def _task(task_id, status):
+    return types.SimpleNamespace(
+        task_id=task_id, url=f"https://example.com/{task_id}", options={"format_id": "best"},
+        status=status, title=None, filename=None, error=None, created_at=0.0,
+    )
+
+
+def test_unfinished_jobs_are_recovered_in_order(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.db"))
+    for seq, status in enumerate(("running", "done", "pending"), 1):
+        journal.record(seq, _task(f"task_{seq}", status))
+    assert journal.next_seq() == 4
+    assert [job["task_id"] for job in journal.unfinished()] == ["task_1", "task_3"]
+    journal.discard(["task_1"])
+    assert [job["task_id"] for job in journal.unfinished()] == ["task_3"]
+    journal.close()
+
+
+def test_cancelling_jobs_become_cancelled_on_restart(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = JobJournal(path)
+    journal.record(1, _task("task_1", "cancelling"))
+    journal.close()
+
+    journal = JobJournal(path)
+    try:
+        assert journal.unfinished() == []
+        status = journal._conn.execute("SELECT status FROM jobs WHERE task_id = 'task_1'").fetchone()[0]
+        assert status == "cancelled"
+    finally:
+        journal.close()
@@ -0,0 +1,62 @@
+import time
+
+from metadata_cache import MetadataCache
+
+
+def _info(video_id, **extra):
+    info = {"id": video_id, "extractor_key": "Youtube", "title": video_id,
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}"}
+    info.update(extra)
+    return info
+
+
+def test_different_url_forms_share_one_entry(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache.db"))
+    try:
+        assert cache.put("https://youtu.be/dQw4w9WgXcQ", _info("dQw4w9WgXcQ")) == "youtube:dQw4w9WgXcQ"
+        assert cache.get("https://www.youtube.com/shorts/dQw4w9WgXcQ")["title"] == "dQw4w9WgXcQ"
+        cache.invalidate("https://m.youtube.com/watch?v=dQw4w9WgXcQ")
+        assert cache.get("https://youtu.be/dQw4w9WgXcQ") is None
+    finally:
+        cache.close()
+
+
+def test_generic_urls_are_found_by_alias(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache.db"))
+    try:
+        cache.put("https://example.com/v/1", {"id": "1", "extractor_key": "Generic"})
+        assert cache.get("https://example.com/v/1")["id"] == "1"
+        assert cache.get("https://example.com/v/2") is None
+    finally:
+        cache.close()
+
+
+def test_signed_url_expiry_limits_lifetime(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache.db"), expiry_margin=600)
+    now = int(time.time())
+    try:
+        # 签名地址即将过期（不足预留的余量），不写入缓存
+        expiring = _info("aaaaaaaaaaa", formats=[{"url": f"https://cdn.example/v?expire={now + 300}&sig=x"}])
+        assert cache.put("https://youtu.be/aaaaaaaaaaa", expiring) is None
+        valid = _info("bbbbbbbbbbb", formats=[{"url": f"https://cdn.example/expire/{now + 3600}/v"}])
+        assert cache.put("https://youtu.be/bbbbbbbbbbb", valid) is not None
+        assert cache.get("https://youtu.be/bbbbbbbbbbb") is not None
+    finally:
+        cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache.db"), max_entries=2)
+    try:
+        cache.put("https://youtu.be/aaaaaaaaaaa", _info("aaaaaaaaaaa"))
+        time.sleep(0.01)
+        cache.put("https://youtu.be/bbbbbbbbbbb", _info("bbbbbbbbbbb"))
+        time.sleep(0.01)
+        assert cache.get("https://youtu.be/aaaaaaaaaaa") is not None
+        time.sleep(0.01)
+        cache.put("https://youtu.be/ccccccccccc", _info("ccccccccccc"))
+        assert cache.get("https://youtu.be/bbbbbbbbbbb") is None
+        assert cache.get("https://youtu.be/aaaaaaaaaaa") is not None
+        assert cache.get("https://youtu.be/ccccccccccc") is not None
+    finally:
+        cache.close()
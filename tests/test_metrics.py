@@ -0,0 +1,29 @@
+from metrics import MetricsRegistry, PhaseTimer
+
+
+def _run(timer, postprocessors):
+    timer.start("resolve")
+    timer.on_progress({"status": "downloading", "downloaded_bytes": 512})
+    timer.on_progress({"status": "finished", "total_bytes": 1024})
+    for name in postprocessors:
+        timer.on_postprocess({"status": "started", "postprocessor": name})
+        timer.on_postprocess({"status": "finished", "postprocessor": name})
+    timer.close("ok")
+
+
+def test_move_files_is_not_counted_as_postprocess():
+    registry = MetricsRegistry()
+    _run(PhaseTimer(registry, "t1"), ["Merger", "MoveFiles"])
+    phases = registry.snapshot()["phases"]
+    assert set(phases) == {"resolve", "download", "merge", "move"}
+    assert phases["download"]["bytes"] == 1024
+    assert [span["phase"] for span in registry.task_spans("t1")] == ["resolve", "download", "merge", "move"]
+
+
+def test_fixups_are_counted_as_postprocess():
+    registry = MetricsRegistry()
+    _run(PhaseTimer(registry, "t2"), ["FFmpegFixupM3u8", "MoveFiles"])
+    phases = registry.snapshot()["phases"]
+    assert phases["postprocess"]["count"] == 1
+    assert phases["move"]["count"] == 1
+    assert "merge" not in phases
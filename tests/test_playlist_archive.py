@@ -0,0 +1,40 @@
+import types
+
+import engine
+
+
+class FakeYoutubeDL:
+    ENTRIES = [
+        {'_type': 'url', 'ie_key': 'Youtube', 'id': 'aaaaaaaaaaa', 'url': 'aaaaaaaaaaa', 'title': '已下载'},
+        {'_type': 'url', 'ie_key': 'Youtube', 'id': 'bbbbbbbbbbb', 'url': 'bbbbbbbbbbb', 'title': '未下载'},
+        {'_type': 'url', 'ie_key': 'ExampleSite', 'id': 'xyz', 'url': 'https://example.com/v/xyz', 'title': '其他站点'},
+    ]
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, url, download=False, process=True):
+        return {'_type': 'playlist', 'id': 'PL', 'entries': iter(self.ENTRIES)}
+
+
+def test_expand_playlist_skips_archived_entries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "download_archive.txt").write_text("youtube aaaaaaaaaaa\nexamplesite xyz\n", encoding="utf-8")
+    monkeypatch.setattr(engine, "load_yt_dlp", lambda: types.SimpleNamespace(YoutubeDL=FakeYoutubeDL))
+
+    eng = engine.DownloadEngine()
+    queued = []
+    monkeypatch.setattr(eng, "_enqueue", lambda url, options, title=None: queued.append(url))
+    eng._expanding = 1
+    try:
+        eng._expand_playlist("https://www.youtube.com/playlist?list=PL", dict(engine.DEFAULT_OPTIONS))
+    finally:
+        eng.shutdown()
+
+    assert queued == ["https://www.youtube.com/watch?v=bbbbbbbbbbb"]
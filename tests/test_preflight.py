@@ -0,0 +1,7 @@
+from preflight import PreflightReport
+
+
+def test_report_for_missing_save_path_uses_existing_parent(tmp_path):
+    # 保存目录在下载时才创建，预检时还不存在
+    report = PreflightReport([], str(tmp_path / "新目录" / "子目录"), workers=1, throughput=None)
+    assert report.free_bytes > 0
@@ -0,0 +1,144 @@
+import time
+
+import pytest
+
+from process_worker import WorkerProcess, WorkerProcessError
+
+
+class FakeConn:
+    def __init__(self, messages=()):
+        self.messages = list(messages)
+        self.sent = []
+        self.closed = False
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def poll(self, timeout=0):
+        if self.messages:
+            return True
+        time.sleep(min(timeout, 0.01))
+        return False
+
+    def recv(self):
+        message = self.messages.pop(0)
+        if isinstance(message, BaseException):
+            raise message
+        return message
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProcess:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.exitcode = None if alive else 1
+        self.terminated = False
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.terminated = True
+        self.alive = False
+        self.exitcode = -15
+
+    def join(self, timeout=None):
+        pass
+
+    def kill(self):
+        self.alive = False
+
+
+def _worker(monkeypatch, messages=(), alive=True, stall_timeout=180):
+    worker = WorkerProcess(stall_timeout=stall_timeout)
+    process, conn = FakeProcess(alive), FakeConn(messages)
+
+    def ensure_started():
+        worker._process, worker._conn = process, conn
+
+    monkeypatch.setattr(worker, "_ensure_started", ensure_started)
+    return worker, process, conn
+
+
+def test_run_returns_result_and_forwards_messages(monkeypatch):
+    logs, progress = [], []
+
+    class Logger:
+        def warning(self, msg):
+            logs.append(msg)
+
+    worker, _, conn = _worker(monkeypatch, [
+        ("progress", {"status": "downloading", "downloaded_bytes": 10}),
+        ("log", ("warning", "子进程警告")),
+        ("done", {"info": {"id": "x"}, "stale": False}),
+    ])
+    result = worker.run({}, "https://example.com/v", on_progress=progress.append, logger=Logger())
+    assert result == ({"id": "x"}, False)
+    assert progress == [{"status": "downloading", "downloaded_bytes": 10}]
+    assert logs == ["子进程警告"]
+    assert conn.sent == [({}, "https://example.com/v", None)]
+
+
+def test_cancel_kills_process_and_returns_none(monkeypatch):
+    worker, process, _ = _worker(monkeypatch)
+    assert worker.run({}, "u", should_stop=lambda: True) is None
+    assert process.terminated
+    assert not worker.alive
+
+
+def test_crashed_process_raises(monkeypatch):
+    worker, _, _ = _worker(monkeypatch, alive=False)
+    with pytest.raises(WorkerProcessError) as excinfo:
+        worker.run({}, "u")
+    assert excinfo.value.type_name == "WorkerCrashed"
+
+
+def test_closed_pipe_raises_crash(monkeypatch):
+    worker, _, _ = _worker(monkeypatch, [EOFError()])
+    with pytest.raises(WorkerProcessError) as excinfo:
+        worker.run({}, "u")
+    assert excinfo.value.type_name == "WorkerCrashed"
+
+
+def test_stalled_process_is_killed(monkeypatch):
+    worker, process, _ = _worker(monkeypatch, stall_timeout=0.05)
+    with pytest.raises(WorkerProcessError) as excinfo:
+        worker.run({}, "u")
+    assert excinfo.value.type_name == "WorkerStalled"
+    assert process.terminated
+
+
+def test_child_error_is_raised_with_type(monkeypatch):
+    worker, _, _ = _worker(monkeypatch, [("error", {"type": "DownloadError", "message": "403"})])
+    with pytest.raises(WorkerProcessError) as excinfo:
+        worker.run({}, "u")
+    assert excinfo.value.type_name == "DownloadError"
+    assert str(excinfo.value) == "403"
+
+
+def test_engine_reports_worker_exit_without_result(tmp_path, monkeypatch):
+    import types
+
+    import engine
+    from scheduler import CancelToken
+
+    monkeypatch.chdir(tmp_path)
+    eng = engine.DownloadEngine()
+
+    class NoResultWorker:
+        def run(self, *args, **kwargs):
+            return None
+
+    monkeypatch.setattr(eng.process_pool, "worker", NoResultWorker)
+    task = types.SimpleNamespace(
+        task_id=1, url="u", rate_limit=None, cancel_token=CancelToken(), partial_files=set(),
+        timer=types.SimpleNamespace(on_postprocess=None), process=None,
+    )
+    try:
+        with pytest.raises(WorkerProcessError) as excinfo:
+            eng._download_in_process(task, {})
+    finally:
+        eng.shutdown()
+    assert excinfo.value.type_name == "WorkerNoResult"
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from scheduler import DownloadScheduler, DownloadTask
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+class BlockingWorker:
+    """每个任务等待放行，记录各站点同时运行的最大任务数"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+
+    def __call__(self, task):
+        with self.lock:
+            self.active[task.host] = self.active.get(task.host, 0) + 1
+            self.peak[task.host] = max(self.peak.get(task.host, 0), self.active[task.host])
+        self.release.wait(5)
+        with self.lock:
+            self.active[task.host] -= 1
+
+
+def test_per_host_limit_lets_other_hosts_run():
+    worker = BlockingWorker()
+    scheduler = DownloadScheduler(worker, max_workers=3, per_host_limit=1)
+    tasks = [scheduler.submit(DownloadTask(f"a{i}", f"https://a.example/{i}", {})) for i in range(3)]
+    tasks.append(scheduler.submit(DownloadTask("b0", "https://b.example/0", {})))
+    try:
+        # a站点只能运行一个，b站点的任务不需要排在a站点的任务之后
+        assert _wait_until(lambda: len(scheduler.running_tasks()) == 2)
+        assert sorted(task.host for task in scheduler.running_tasks()) == ["a.example", "b.example"]
+        assert len(scheduler.pending_tasks()) == 2
+        worker.release.set()
+        assert _wait_until(scheduler.is_idle)
+    finally:
+        scheduler.shutdown()
+    assert worker.peak == {"a.example": 1, "b.example": 1}
+    assert all(task.status == "done" for task in tasks)
+    assert scheduler.metrics()["completed"] == 4
+
+
+def test_cancelling_becomes_cancelled_when_worker_exits():
+    worker = BlockingWorker()
+    scheduler = DownloadScheduler(worker, max_workers=1, per_host_limit=1)
+    running = scheduler.submit(DownloadTask("t1", "https://a.example/1", {}))
+    waiting = scheduler.submit(DownloadTask("t2", "https://a.example/2", {}))
+    try:
+        assert _wait_until(lambda: running.status == "running")
+        # 已开始的任务不能从等待队列中取消
+        assert scheduler.cancel("t1") is False
+        assert scheduler.cancel("t2") is True
+        assert waiting.status == "cancelled"
+
+        # 引擎取消运行中的任务时先标记为cancelling，工作线程结束后才算取消完成
+        running.status = "cancelling"
+        assert scheduler.metrics()["hosts"] == {"a.example": 1}
+        worker.release.set()
+        assert _wait_until(scheduler.is_idle)
+    finally:
+        scheduler.shutdown()
+    assert running.status == "cancelled"
+    metrics = scheduler.metrics()
+    assert metrics["hosts"] == {}
+    assert metrics["cancelled"] == 2
+    assert metrics["failed"] == 0
+
+
+def test_worker_exception_marks_task_failed():
+    def worker(task):
+        raise ValueError("boom")
+
+    scheduler = DownloadScheduler(worker, max_workers=1)
+    task = scheduler.submit(DownloadTask("t1", "https://a.example/1", {}))
+    try:
+        assert _wait_until(scheduler.is_idle)
+    finally:
+        scheduler.shutdown()
+    assert task.status == "failed"
+    assert task.error == "boom"
+    assert scheduler.metrics()["failed"] == 1
@@ -0,0 +1,55 @@
+import io
+
+from transcoder import FFmpegProgress, format_progress, read_progress, summarize_progress
+
+BLOCK = """frame=240
+fps=48.0
+total_size=1048576
+out_time_us=10000000
+out_time=00:00:10.000000
+speed=2.5x
+progress=continue
+"""
+
+
+def test_progress_blocks_become_snapshots():
+    parser = FFmpegProgress(duration=40)
+    snapshots = [stats for stats in map(parser.feed, BLOCK.splitlines()) if stats is not None]
+    assert len(snapshots) == 1
+    stats = snapshots[0]
+    assert stats["frame"] == 240
+    assert stats["fps"] == 48.0
+    assert stats["speed"] == 2.5
+    assert stats["total_size"] == 1048576
+    assert stats["out_time"] == 10.0
+    assert stats["percent"] == 25.0
+    assert stats["eta"] == 12.0
+    assert not stats["finished"]
+    assert format_progress(stats) == "25.0% 48.0fps 2.50x 已写入 1.0MiB 剩余 12s"
+
+
+def test_end_block_keeps_previous_values():
+    parser = FFmpegProgress(duration=40)
+    for line in BLOCK.splitlines():
+        parser.feed(line)
+    # 结束块中的N/A等无效值沿用上一次的值
+    for line in ("fps=N/A", "speed=N/A", "out_time_us=N/A", "progress=end"):
+        stats = parser.feed(line)
+    assert stats["finished"]
+    assert stats["percent"] == 100.0
+    assert stats["eta"] == 0.0
+    assert stats["fps"] == 48.0
+    assert stats["out_time"] == 10.0
+
+    summary = summarize_progress(dict(stats, elapsed=5.0))
+    assert summary["avg_fps"] == 48.0
+    assert summary["realtime_multiple"] == 2.0
+    assert summary["bytes_written"] == 1048576
+
+
+def test_read_progress_without_duration():
+    received = []
+    read_progress(io.BytesIO(BLOCK.encode("utf-8")), FFmpegProgress(), received.append)
+    assert len(received) == 1
+    assert received[0]["percent"] is None
+    assert received[0]["eta"] is None
@@ -0,0 +1,40 @@
+import pytest
+
+from url_canon import canonical_key, canonicalize, video_id
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "http://youtube.com/watch?v=dQw4w9WgXcQ",
+    "youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ?t=30",
+    "https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ&t=30",
+    "https://WWW.YouTube.com/watch?v=dQw4w9WgXcQ",
+    "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+    "https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ",
+    "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ",
+    "https://www.youtube.com/live/dQw4w9WgXcQ?si=abc",
+    "https://www.youtube.com/v/dQw4w9WgXcQ",
+])
+def test_youtube_forms_map_to_the_same_video(url):
+    assert canonicalize(url) == ("youtube", "dQw4w9WgXcQ")
+    assert video_id(url) == ("youtube", "dQw4w9WgXcQ")
+
+
+def test_video_id_is_case_sensitive_and_exactly_eleven_chars():
+    assert canonicalize("https://youtu.be/DQW4W9WGXCQ") == ("youtube", "DQW4W9WGXCQ")
+    # 超过11个字符的不是视频ID，按通用地址处理
+    assert canonicalize("https://youtu.be/dQw4w9WgXcQx")[0] == "generic"
+
+
+def test_generic_urls_are_normalised():
+    assert canonicalize("https://www.Vimeo.com/76979871/") == ("generic", "vimeo.com/76979871")
+    assert canonicalize("https://m.example.com/v?id=1#t=5") == ("generic", "example.com/v?id=1")
+    assert video_id("https://vimeo.com/76979871") is None
+
+
+def test_keys_and_unparseable_input():
+    assert canonical_key("  https://youtu.be/dQw4w9WgXcQ\n") == "youtube:dQw4w9WgXcQ"
+    assert canonical_key("https://vimeo.com/76979871/") == "generic:vimeo.com/76979871"
+    assert canonicalize("not a url") is None
+    assert canonical_key("ftp://example.com/file") is None
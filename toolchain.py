@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+# 不同容器可直接封装（无需重新编码）的编码
+CONTAINER_CODECS = {
+    "mp4": ({"h264", "hevc", "av1"}, {"aac", "mp3"}),
+    "mov": ({"h264", "hevc"}, {"aac", "mp3"}),
+    "webm": ({"vp8", "vp9", "av1"}, {"opus", "vorbis"}),
+    "avi": ({"h264", "mpeg4"}, {"mp3"}),
+}
+
+# 需要重新编码时，各容器按顺序选用第一个可用的编码器
+CONTAINER_ENCODERS = {
+    "mp4": (["libx264", "libopenh264", "mpeg4"], ["aac", "libfdk_aac", "libmp3lame"]),
+    "mov": (["libx264", "libopenh264", "mpeg4"], ["aac", "libfdk_aac"]),
+    "mkv": (["libx264", "libopenh264", "mpeg4"], ["aac", "libopus", "libvorbis"]),
+    "webm": (["libvpx-vp9", "libvpx", "libaom-av1"], ["libopus", "libvorbis"]),
+    "avi": (["libx264", "mpeg4"], ["libmp3lame", "aac"]),
+}
+
+# 各编码器的速度/质量参数
+ENCODER_ARGS = {
+    "libx264": ["-preset", "medium", "-crf", "23"],
+    "libvpx-vp9": ["-deadline", "good", "-cpu-used", "4", "-row-mt", "1", "-crf", "32", "-b:v", "0"],
+    "libvpx": ["-deadline", "good", "-cpu-used", "4", "-crf", "10", "-b:v", "1M"],
+    "libaom-av1": ["-cpu-used", "6", "-crf", "32", "-b:v", "0"],
+    "mpeg4": ["-q:v", "5"],
+}
+
+_CODEC_PREFIXES = (
+    ("avc", "h264"), ("h264", "h264"), ("hev", "hevc"), ("hvc", "hevc"), ("h265", "hevc"),
+    ("vp09", "vp9"), ("vp9", "vp9"), ("vp8", "vp8"), ("av01", "av1"), ("av1", "av1"),
+    ("mp4v", "mpeg4"), ("mp4a", "aac"), ("aac", "aac"), ("opus", "opus"),
+    ("vorbis", "vorbis"), ("mp3", "mp3"),
+)
+
+_VERSION_RE = re.compile(r"version\s+(\S+)")
+_ENCODER_RE = re.compile(r"^\s*([VAS])[\w.]{5}\s+(\S+)")
+_MUXER_RE = re.compile(r"^\s*D?E\s+(\S+)")
+
+
+def normalize_codec(codec):
+    """把yt-dlp的编码字符串（如avc1.64001F、mp4a.40.2）归一化为编码族名"""
+    if not codec or codec == "none":
+        return None
+    codec = codec.lower()
+    for prefix, name in _CODEC_PREFIXES:
+        if codec.startswith(prefix):
+            return name
+    return codec.split(".")[0]
+
+
+class Toolchain:
+    """ffmpeg/ffprobe的能力探测结果"""
+
+    def __init__(self, data):
+        self.data = data
+        self.ffmpeg = data.get("ffmpeg")
+        self.ffprobe = data.get("ffprobe")
+        self.ffmpeg_version = data.get("ffmpeg_version")
+        self.ffprobe_version = data.get("ffprobe_version")
+        self.video_encoders = set(data.get("video_encoders", []))
+        self.audio_encoders = set(data.get("audio_encoders", []))
+        self.muxers = set(data.get("muxers", []))
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    def has_encoder(self, name):
+        return name in self.video_encoders or name in self.audio_encoders
+
+    def can_merge(self):
+        """是否可以合并视频和音频（bv*+ba这类格式需要ffmpeg）"""
+        return self.available
+
+    def codec_args_for(self, container, vcodec=None, acodec=None):
+        """为目标容器选择最快的转码路径：编码兼容时直接复制流，否则选用可用的编码器"""
+        container = (container or "mp4").lower()
+        video_ok, audio_ok = CONTAINER_CODECS.get(container, (None, None))
+        vcodec = normalize_codec(vcodec)
+        acodec = normalize_codec(acodec)
+
+        args = []
+        if vcodec and (container == "mkv" or (video_ok and vcodec in video_ok)):
+            args += ["-c:v", "copy"]
+        else:
+            encoder = self._first_available(CONTAINER_ENCODERS.get(container, CONTAINER_ENCODERS["mp4"])[0])
+            if encoder:
+                args += ["-c:v", encoder] + ENCODER_ARGS.get(encoder, [])
+        if acodec and (container == "mkv" or (audio_ok and acodec in audio_ok)):
+            args += ["-c:a", "copy"]
+        else:
+            encoder = self._first_available(CONTAINER_ENCODERS.get(container, CONTAINER_ENCODERS["mp4"])[1])
+            if encoder:
+                args += ["-c:a", encoder]
+        return args
+
+    def _first_available(self, candidates):
+        for name in candidates:
+            if self.has_encoder(name):
+                return name
+        # 未能读取编码器列表时（例如旧版本ffmpeg），按首选项尝试
+        return candidates[0] if not (self.video_encoders or self.audio_encoders) else None
+
+    def summary(self):
+        if not self.available:
+            return "未找到ffmpeg"
+        parts = [f"ffmpeg {self.ffmpeg_version or '?'}"]
+        parts.append(f"ffprobe {self.ffprobe_version or '?'}" if self.ffprobe else "无ffprobe")
+        parts.append(f"{len(self.video_encoders)} 个视频编码器, {len(self.audio_encoders)} 个音频编码器")
+        return ", ".join(parts)
+
+
+_lock = threading.Lock()
+_cached = None
+
+
+def _fingerprint():
+    """PATH及ffmpeg/ffprobe可执行文件的修改时间，任一变化时重新探测"""
+    fingerprint = {"path": os.environ.get("PATH", "")}
+    for tool in ("ffmpeg", "ffprobe"):
+        location = shutil.which(tool)
+        fingerprint[tool] = location
+        try:
+            fingerprint[f"{tool}_mtime"] = os.path.getmtime(location) if location else None
+        except OSError:
+            fingerprint[f"{tool}_mtime"] = None
+    return fingerprint
+
+
+def _run(cmd):
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=15)
+        return result.stdout.decode("utf-8", "replace")
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _probe(fingerprint):
+    data = {"fingerprint": fingerprint, "ffmpeg": fingerprint["ffmpeg"], "ffprobe": fingerprint["ffprobe"]}
+    if fingerprint["ffmpeg"]:
+        match = _VERSION_RE.search(_run([fingerprint["ffmpeg"], "-hide_banner", "-version"]))
+        data["ffmpeg_version"] = match.group(1) if match else None
+
+        video, audio = [], []
+        for line in _run([fingerprint["ffmpeg"], "-hide_banner", "-encoders"]).splitlines():
+            match = _ENCODER_RE.match(line)
+            if match and match.group(2) != "=":
+                (video if match.group(1) == "V" else audio if match.group(1) == "A" else []).append(match.group(2))
+        data["video_encoders"] = video
+        data["audio_encoders"] = audio
+
+        muxers = []
+        for line in _run([fingerprint["ffmpeg"], "-hide_banner", "-muxers"]).splitlines():
+            match = _MUXER_RE.match(line)
+            if match and match.group(1) != "=":
+                muxers.extend(match.group(1).split(","))
+        data["muxers"] = muxers
+    if fingerprint["ffprobe"]:
+        match = _VERSION_RE.search(_run([fingerprint["ffprobe"], "-hide_banner", "-version"]))
+        data["ffprobe_version"] = match.group(1) if match else None
+    return data
+
+
+def probe_toolchain(cache_path="toolchain_cache.json", force=False):
+    """返回ffmpeg工具链的能力信息
+
+    结果缓存在内存和磁盘中，只有PATH或可执行文件的修改时间变化时才重新启动
+    ffmpeg进程探测。
+    """
+    global _cached
+    fingerprint = _fingerprint()
+    with _lock:
+        if not force and _cached is not None and _cached.data.get("fingerprint") == fingerprint:
+            return _cached
+
+        data = None
+        if not force and cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("fingerprint") != fingerprint:
+                    data = None
+            except (OSError, ValueError):
+                data = None
+
+        if data is None:
+            data = _probe(fingerprint)
+            if cache_path:
+                try:
+                    with open(cache_path, "w", encoding="utf-8") as f:
+                        json.dump(data, f, ensure_ascii=False)
+                except OSError:
+                    pass
+
+        _cached = Toolchain(data)
+        return _cached
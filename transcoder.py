@@ -0,0 +1,477 @@
+import itertools
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 默认的转码参数：x264视频 + AAC音频
+DEFAULT_CODEC_ARGS = [
+    "-c:v", "libx264",  # 使用x264编码
+    "-preset", "medium",  # 编码速度预设
+    "-crf", "23",        # 质量控制
+    "-c:a", "aac",       # 音频编码
+    "-strict", "experimental",
+]
+
+# 可以直接按字节流读取的协议，分片协议（DASH/HLS）需回退到先下载后转码
+STREAMABLE_PROTOCOLS = ("http", "https")
+
+# 合并格式的第二路通过额外的管道写入ffmpeg（pipe:N），与主格式一样经过yt-dlp的
+# 网络层（代理、Cookie）和带宽限速；Windows不支持向子进程传递额外的文件描述符，
+# 只能由ffmpeg直接读取签名地址
+SECOND_INPUT_PIPE = os.name == "posix"
+
+
+# 让ffmpeg把机器可读的进度写到标准输出
+PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats"]
+
+
+def build_transcode_command(input_file, output_file, codec_args=None, threads=None):
+    """构建普通（先下载后转码）模式的ffmpeg命令"""
+    cmd = ["ffmpeg"] + PROGRESS_ARGS + ["-i", input_file] + list(codec_args or DEFAULT_CODEC_ARGS)
+    if threads:
+        cmd += ["-threads", str(threads)]
+    return cmd + ["-y", output_file]
+
+
+def streaming_formats(info, proxy=None):
+    """返回可边下边转的格式列表（单个渐进式格式，或视频+音频两个格式），不支持时返回None
+
+    第二路由ffmpeg直接读取时只能使用HTTP代理（-http_proxy），其他代理（如SOCKS）不支持合并格式。
+    """
+    formats = info.get('requested_formats') or [info]
+    if len(formats) > 2:
+        return None
+    if len(formats) == 2 and not SECOND_INPUT_PIPE and proxy and not proxy.startswith(("http://", "https://")):
+        return None
+    for f in formats:
+        if not f.get('url') or (f.get('protocol') or 'https') not in STREAMABLE_PROTOCOLS:
+            return None
+    return formats
+
+
+def describe_codec_args(codec_args=None):
+    """从编码参数中提取编码器、预设和CRF，便于比较不同设置的开销"""
+    args = list(codec_args or DEFAULT_CODEC_ARGS)
+    parts = []
+    for flag, name in (("-c:v", "vcodec"), ("-preset", "preset"), ("-crf", "crf")):
+        if flag in args and args.index(flag) + 1 < len(args):
+            parts.append(f"{name}={args[args.index(flag) + 1]}")
+    return " ".join(parts)
+
+
+def summarize_progress(stats):
+    """转码结束后的吞吐统计：平均帧率、相对实时的速度倍数、输出大小和用时"""
+    elapsed = stats.get("elapsed") or 0
+    summary = {
+        "elapsed": elapsed,
+        "avg_fps": stats["frame"] / elapsed if stats.get("frame") and elapsed else None,
+        "realtime_multiple": stats["out_time"] / elapsed if stats.get("out_time") and elapsed else None,
+        "bytes_written": stats.get("total_size"),
+    }
+    return summary
+
+
+class FFmpegProgress:
+    """解析ffmpeg -progress输出的key=value块
+
+    每收到一个progress=continue/end行返回一次进度快照，包含百分比、编码帧率、
+    相对实时的速度倍数、已写入字节数和预计剩余时间。
+    """
+
+    def __init__(self, duration=None):
+        self.duration = duration
+        self.started = time.monotonic()
+        self.snapshot = {}
+        self._block = {}
+
+    def feed(self, line):
+        line = line.strip()
+        if "=" not in line:
+            return None
+        key, _, value = line.partition("=")
+        self._block[key] = value
+        if key != "progress":
+            return None
+        block, self._block = self._block, {}
+        self.snapshot = self._parse(block)
+        return self.snapshot
+
+    def _parse(self, block):
+        elapsed = time.monotonic() - self.started
+        out_time = None
+        # out_time_us和out_time_ms的单位都是微秒
+        for key in ("out_time_us", "out_time_ms"):
+            value = block.get(key, "")
+            if value.lstrip("-").isdigit():
+                out_time = max(0, int(value)) / 1_000_000
+                break
+        speed = block.get("speed", "").rstrip("x").strip()
+        speed = float(speed) if speed.replace(".", "", 1).isdigit() else None
+        fps = block.get("fps", "")
+        fps = float(fps) if fps.replace(".", "", 1).isdigit() else None
+        total_size = block.get("total_size", "")
+        total_size = int(total_size) if total_size.isdigit() else None
+
+        percent = None
+        eta = None
+        if self.duration and out_time is not None:
+            percent = min(100.0, out_time / self.duration * 100)
+            if speed:
+                eta = max(0.0, (self.duration - out_time) / speed)
+        # 某些块（例如结束块）可能缺少部分字段，沿用上一次的值
+        previous = self.snapshot
+        if out_time is None:
+            out_time = previous.get("out_time")
+        if speed is None:
+            speed = previous.get("speed")
+        if fps is None:
+            fps = previous.get("fps")
+        if total_size is None:
+            total_size = previous.get("total_size")
+        frame = int(block["frame"]) if block.get("frame", "").isdigit() else previous.get("frame")
+
+        finished = block.get("progress") == "end"
+        if finished:
+            percent = 100.0
+            eta = 0.0
+        return {
+            "out_time": out_time,
+            "percent": percent,
+            "fps": fps,
+            "speed": speed,
+            "total_size": total_size,
+            "frame": frame,
+            "eta": eta,
+            "elapsed": elapsed,
+            "finished": finished,
+        }
+
+
+def format_progress(stats):
+    """把进度快照格式化为一行文字"""
+    parts = []
+    if stats.get("percent") is not None:
+        parts.append(f"{stats['percent']:.1f}%")
+    if stats.get("fps") is not None:
+        parts.append(f"{stats['fps']:.1f}fps")
+    if stats.get("speed") is not None:
+        parts.append(f"{stats['speed']:.2f}x")
+    if stats.get("total_size") is not None:
+        parts.append(f"已写入 {stats['total_size'] / 1024 / 1024:.1f}MiB")
+    if stats.get("eta") is not None:
+        parts.append(f"剩余 {int(stats['eta'])}s")
+    return " ".join(parts)
+
+
+def read_progress(stream, parser, callback=None):
+    """逐行读取ffmpeg的进度输出并回调"""
+    for line in iter(stream.readline, b""):
+        stats = parser.feed(line.decode("utf-8", "replace"))
+        if stats is not None and callback:
+            callback(stats)
+
+
+def _headers_arg(headers):
+    return "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+
+
+class StreamingTranscoder:
+    """边下载边转码
+
+    主格式的字节在下载的同时写入ffmpeg的标准输入；合并格式的第二路（音频）
+    由另一个线程写入额外的管道（不支持时由ffmpeg通过同一代理直接读取签名地址）。
+    这样转码与网络传输重叠进行，原始文件可以选择完全不写入磁盘（仅单个渐进式
+    格式支持同时保留原始文件）。
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, ydl, info, output_file, original_file=None, codec_args=None,
+                 progress_callback=None, should_stop=None, threads=None, encode_callback=None, throttle=None):
+        self.ydl = ydl
+        self.info = info
+        self.output_file = output_file
+        self.original_file = original_file
+        self.codec_args = list(codec_args or DEFAULT_CODEC_ARGS)
+        self.progress_callback = progress_callback
+        self.should_stop = should_stop or (lambda: False)
+        self.threads = threads
+        self.encode_callback = encode_callback
+        # 每读取一块数据后调用throttle(字节数)，用于全局带宽限速
+        self.throttle = throttle
+        self.encode_progress = FFmpegProgress(info.get('duration'))
+        self.proxy = ydl.params.get('proxy')
+        self.formats = streaming_formats(info, self.proxy)
+        if self.formats is None:
+            raise ValueError("所选格式不支持边下边转")
+        self._stderr_tail = deque(maxlen=30)
+        # 第二路管道在子进程中的读端
+        self._second_fd = None
+
+    def build_command(self):
+        cmd = ["ffmpeg", "-hide_banner"] + PROGRESS_ARGS + ["-i", "pipe:0"]
+        if len(self.formats) == 2:
+            if self._second_fd is not None:
+                cmd += ["-i", f"pipe:{self._second_fd}"]
+            else:
+                second = self.formats[1]
+                headers = _headers_arg(second.get('http_headers'))
+                if headers:
+                    cmd += ["-headers", headers]
+                if self.proxy:
+                    cmd += ["-http_proxy", self.proxy]
+                cmd += ["-i", second['url']]
+            cmd += ["-map", "0", "-map", "1"]
+        cmd += self.codec_args
+        if self.threads:
+            cmd += ["-threads", str(self.threads)]
+        return cmd + ["-y", self.output_file]
+
+    def run(self):
+        """执行边下边转，返回ffmpeg退出码；被取消时返回None"""
+        second_writer = None
+        if len(self.formats) == 2 and SECOND_INPUT_PIPE:
+            self._second_fd, second_writer = os.pipe()
+        try:
+            process = subprocess.Popen(
+                self.build_command(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=(self._second_fd,) if second_writer is not None else (),
+            )
+        except Exception:
+            if second_writer is not None:
+                os.close(second_writer)
+            raise
+        finally:
+            if self._second_fd is not None:
+                os.close(self._second_fd)
+                self._second_fd = None
+        stderr_thread = threading.Thread(target=self._drain_stderr, args=(process.stderr,), daemon=True)
+        stderr_thread.start()
+        progress_thread = threading.Thread(
+            target=read_progress, args=(process.stdout, self.encode_progress, self.encode_callback), daemon=True
+        )
+        progress_thread.start()
+
+        second_thread = None
+        second_errors = []
+        if second_writer is not None:
+            second_thread = threading.Thread(
+                target=self._pump_second, args=(open(second_writer, "wb"), second_errors), daemon=True
+            )
+            second_thread.start()
+
+        original = open(self.original_file, "wb") if self.original_file and len(self.formats) == 1 else None
+        try:
+            self._pump(self.formats[0], process.stdin, original)
+        except BrokenPipeError:
+            # ffmpeg提前退出，错误原因见stderr
+            pass
+        except Exception:
+            process.kill()
+            raise
+        finally:
+            if original:
+                original.close()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            if second_thread is not None:
+                # ffmpeg退出或被结束后第二路写入会因管道断开而结束
+                second_thread.join()
+
+        if second_errors and not self.should_stop():
+            process.kill()
+            process.wait()
+            self._remove_partial()
+            raise second_errors[0]
+
+        if self.should_stop():
+            process.kill()
+            process.wait()
+            self._remove_partial()
+            return None
+
+        return_code = process.wait()
+        stderr_thread.join(timeout=1)
+        progress_thread.join(timeout=1)
+        if return_code != 0:
+            self._remove_partial()
+        return return_code
+
+    def error_output(self):
+        """ffmpeg最后输出的若干行，用于错误提示"""
+        return "\n".join(self._stderr_tail)
+
+    def _pump_second(self, sink, errors):
+        """在单独的线程中把第二路写入额外的管道，ffmpeg交替读取两路输入"""
+        try:
+            with sink:
+                self._pump(self.formats[1], sink, None, report=False)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            errors.append(e)
+
+    def _pump(self, fmt, sink, original, report=True):
+        """分块读取格式地址并写入ffmpeg，report为False时不回调下载进度"""
+        from yt_dlp.networking import Request
+
+        total = fmt.get('filesize') or fmt.get('filesize_approx')
+        chunk_size = (fmt.get('downloader_options') or {}).get('http_chunk_size')
+        headers = dict(fmt.get('http_headers') or {})
+        downloaded = 0
+        start = time.monotonic()
+
+        while True:
+            request_headers = dict(headers)
+            if chunk_size:
+                # 按区间分段请求，与yt-dlp对YouTube的处理方式一致，避免限速
+                request_headers['Range'] = f"bytes={downloaded}-{downloaded + chunk_size - 1}"
+            response = self.ydl.urlopen(Request(fmt['url'], headers=request_headers))
+            received = 0
+            # 服务器忽略Range时会返回完整内容
+            partial = getattr(response, 'status', 206) == 206
+            with response:
+                if not total:
+                    length = response.headers.get('Content-Range', '').rpartition('/')[2]
+                    total = int(length) if length.isdigit() else None
+                while True:
+                    if self.should_stop():
+                        return
+                    data = response.read(self.CHUNK_SIZE)
+                    if not data:
+                        break
+                    sink.write(data)
+                    if original:
+                        original.write(data)
+                    downloaded += len(data)
+                    received += len(data)
+                    if self.throttle:
+                        self.throttle(len(data))
+                    if report and self.progress_callback:
+                        elapsed = max(time.monotonic() - start, 1e-6)
+                        self.progress_callback(downloaded, total, downloaded / elapsed)
+            if not chunk_size or not partial or received < chunk_size or (total and downloaded >= total):
+                break
+
+    def _drain_stderr(self, stream):
+        for line in iter(stream.readline, b""):
+            self._stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+    def _remove_partial(self):
+        try:
+            if os.path.exists(self.output_file):
+                os.remove(self.output_file)
+        except OSError:
+            pass
+
+
+class TranscodeJob:
+    """一个待执行的转码任务，priority越小越先执行"""
+
+    def __init__(self, input_file, output_file, priority=None, remove_input=False, label=None, duration=None,
+                 codec_args=None, task_id=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.duration = duration
+        self.codec_args = codec_args
+        self.remove_input = remove_input
+        self.label = label or os.path.basename(input_file)
+        # 所属的下载任务，用于记录转码阶段的用时
+        self.task_id = task_id
+        if priority is None:
+            # 默认小文件优先，缩短整体的平均完成时间
+            try:
+                priority = os.path.getsize(input_file)
+            except OSError:
+                priority = 0
+        self.priority = priority
+        self.threads = None
+        self.status = "pending"
+        self.stats = {}
+
+
+class TranscodePool:
+    """与下载线程解耦的转码池
+
+    工作线程数按CPU核数确定，每个ffmpeg通过-threads限制线程数，避免多个编码
+    同时抢占CPU。等待队列有上限，队列满时submit会阻塞调用方（下载线程），
+    形成背压。边下边转的编码也通过cpu_slot()占用同一份CPU配额。
+    """
+
+    def __init__(self, runner, workers=None, threads_per_job=None, max_pending=None, logger=None):
+        cpu_count = os.cpu_count() or 2
+        self.workers = workers or max(1, cpu_count // 4)
+        self.threads_per_job = threads_per_job or max(1, cpu_count // self.workers)
+        self.max_pending = max_pending or self.workers * 4
+        self.runner = runner
+        self.logger = logger
+
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._backlog = threading.BoundedSemaphore(self.max_pending)
+        self._cpu_slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+
+        for i in range(self.workers):
+            threading.Thread(target=self._worker_loop, name=f"transcode-worker-{i + 1}", daemon=True).start()
+
+    def submit(self, job, block=True, timeout=None):
+        """提交转码任务；等待队列已满时阻塞，超时返回False"""
+        if not self._backlog.acquire(blocking=block, timeout=timeout):
+            return False
+        job.threads = self.threads_per_job
+        self._queue.put((job.priority, next(self._seq), job))
+        return True
+
+    @contextmanager
+    def cpu_slot(self):
+        """占用一份编码CPU配额，用于转码池之外的ffmpeg编码"""
+        with self._cpu_slots:
+            yield self.threads_per_job
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "threads_per_job": self.threads_per_job,
+                "pending": self._queue.qsize(),
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+
+    def _worker_loop(self):
+        while True:
+            _, _, job = self._queue.get()
+            try:
+                with self._cpu_slots:
+                    with self._lock:
+                        self._running += 1
+                    job.status = "running"
+                    ok = self.runner(job)
+                job.status = "done" if ok else "failed"
+            except Exception as e:
+                job.status = "failed"
+                if self.logger:
+                    self.logger.error(f"转码任务出错 ({job.label}): {str(e)}")
+            finally:
+                with self._lock:
+                    self._running = max(0, self._running - 1)
+                    if job.status == "done":
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+                self._backlog.release()
+                self._queue.task_done()
@@ -0,0 +1,76 @@
+import re
+import sys
+import time
+
+# YouTube的各种地址形式: watch?v=、youtu.be、shorts、embed、live、v，
+# 以及m./music./www.子域名和youtube-nocookie.com。主机名不区分大小写，视频ID区分。
+_YOUTUBE_RE = re.compile(
+    r"(?i:(?:https?://)?(?:(?:www|m|music)\.)?"
+    r"(?:youtube(?:-nocookie)?\.com/(?:watch/?\?(?:[^#]*?&)?v=|shorts/|embed/|live/|v/|e/)|youtu\.be/))"
+    r"([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])"
+)
+
+# 其他站点: 主机名转小写、去掉www./m.前缀和片段，作为通用键
+_GENERIC_RE = re.compile(r"(?i:https?://(?:www\.|m\.)?)([^/?#]+)([^#]*)")
+
+
+def canonicalize(url):
+    """不访问网络，把地址映射为 (提取器, 视频ID)
+
+    可识别的YouTube地址返回 ("youtube", 视频ID)；其他http(s)地址返回
+    ("generic", 规范化地址)；无法解析时返回None。
+    """
+    match = _YOUTUBE_RE.match(url)
+    if match:
+        return "youtube", match.group(1)
+    match = _GENERIC_RE.match(url)
+    if match:
+        host, rest = match.groups()
+        if rest.endswith("/"):
+            rest = rest[:-1]
+        return "generic", host.lower() + rest
+    return None
+
+
+def canonical_key(url):
+    """返回 "提取器:视频ID" 形式的键（与元数据缓存的键相同），无法解析时返回None"""
+    result = canonicalize(url.strip())
+    if result is None:
+        return None
+    return f"{result[0]}:{result[1]}"
+
+
+def video_id(url):
+    """返回可识别站点的 (提取器, 视频ID)，通用地址返回None"""
+    result = canonicalize(url.strip())
+    if result is None or result[0] == "generic":
+        return None
+    return result
+
+
+def _bench(count=100000):
+    samples = [
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://youtu.be/dQw4w9WgXcQ?t=30",
+        "https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ&t=30",
+        "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+        "https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ",
+        "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ",
+        "https://www.youtube.com/live/dQw4w9WgXcQ?si=abc",
+        "https://vimeo.com/76979871/",
+    ]
+    urls = [samples[i % len(samples)] for i in range(count)]
+    start = time.perf_counter()
+    for url in urls:
+        canonicalize(url)
+    elapsed = time.perf_counter() - start
+    print(f"{count} 个地址耗时 {elapsed * 1000:.1f} ms，{count / elapsed:,.0f} 个/秒")
+    return count / elapsed
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        _bench()
+    else:
+        for arg in sys.argv[1:]:
+            print(arg, "->", canonicalize(arg))
@@ -1,21 +1,34 @@
-import yt_dlp
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import sys
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext, filedialog
 import threading
-import queue
 import logging
+import logging.handlers
+import multiprocessing
 from urllib.parse import urlparse
 import os
 from datetime import datetime
 import json
 import subprocess
 import platform
-import matplotlib.pyplot as plt
-import numpy as np
-from PIL import Image
+from event_bus import EventBus
+from engine import DownloadEngine
+from format_select import FormatConstraints, estimate_size, select_format
+
 
 class YouTubeDownloaderApp:
+    # 界面刷新间隔（毫秒），事件总线中的进度和日志按此帧率合并显示
+    UI_FRAME_MS = 100
+    # 进度区域最多显示的任务数
+    MAX_PROGRESS_LINES = 6
+    # 任务列表显示运行中的任务和队列前端的等待任务
+    TASK_LIST_PENDING = 20
+    # 预计用时超过该值（秒）时开始下载前先确认
+    PREFLIGHT_CONFIRM_SECONDS = 3600
+
     def __init__(self, root):
         self.root = root
         self.root.title("YouTube 下载器 V1")
@@ -37,30 +50,38 @@ class YouTubeDownloaderApp:
         self.style.configure('TCombobox', font=('SimHei', 10))
 
         # 初始化变量
-        self.download_queue = queue.Queue()
-        self.result_queue = queue.Queue()
-        
-        self.download_tasks = []
-        self.current_task_index = 0
-        self.total_tasks = 0
-        self.abort_all_tasks = False
-
-        self.video_info = {}
+        self.result_queue = EventBus()
+        self._task_progress = {}
 
         self.setup_logging()
 
+        # 下载引擎：队列、调度器、转码池、缓存和历史都在引擎中，界面只负责显示
+        self.engine = DownloadEngine(logger=self.logger, result_queue=self.result_queue)
+
         self.create_widgets()
-        
-        self.load_download_history()
-        
-        self.processing_thread = threading.Thread(target=self.process_queue, daemon=True)
-        self.processing_thread.start()
+        self.apply_concurrency_limits()
 
-        self.root.after(100, self.process_results)
-        
-        self.ydl_instance = None
-        self.is_downloading = False
-        self.download_threads = {}
+        self.root.after(self.UI_FRAME_MS, self.process_results)
+        self.root.after(500, self.refresh_queue_status)
+
+    def warmup_steps(self):
+        """启动预热步骤，在后台线程中执行，不访问Tk控件"""
+        return self.engine.warmup_steps()
+
+    @property
+    def is_downloading(self):
+        """是否有等待中或运行中的下载任务（包括仍在展开的播放列表）"""
+        return self.engine.is_downloading
+
+    def offer_recovery(self):
+        """启动后检查上次未完成的任务，询问是否继续"""
+        jobs = self.engine.recoverable_jobs()
+        if not jobs:
+            return
+        if messagebox.askyesno("恢复下载", f"发现上次未完成的 {len(jobs)} 个下载任务，是否继续下载？\n（已下载的部分会从断点继续）"):
+            self.engine.resume_jobs(jobs)
+        else:
+            self.engine.discard_jobs(jobs)
 
     def setup_logging(self):
         """配置日志系统，将日志输出到GUI"""
@@ -76,8 +97,6 @@ class YouTubeDownloaderApp:
             def emit(self, record):
                 self.log_queue.put((record.levelname, self.format(record)))
         
-        # 创建日志队列
-        self.result_queue = queue.Queue()
         # 创建日志处理器，将日志输出到GUI
         self.log_handler = QueueHandler(self.result_queue)
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -145,22 +164,81 @@ class YouTubeDownloaderApp:
         ttk.Entry(options_frame, textvariable=self.format_id_var, width=15).grid(row=0, column=1, sticky=tk.W, pady=5, padx=5)
         ttk.Button(options_frame, text="查询格式", command=self.query_formats).grid(row=0, column=2, padx=5)
         
-        # 第二行：下载字幕、线程数、下载后转码
+        # 第二行：并发任务数、单站点并发上限
         sub_frame = ttk.Frame(options_frame)
-        sub_frame.grid(row=1, column=0, columnspan=3, sticky=tk.W, pady=5)
+        sub_frame.grid(row=1, column=0, columnspan=8, sticky=tk.W, pady=5)
+
+        ttk.Label(sub_frame, text="并发任务:").pack(side=tk.LEFT)
+        self.concurrency_var = tk.StringVar(value="3")
+        concurrency_box = ttk.Combobox(sub_frame, textvariable=self.concurrency_var, values=["1", "2", "3", "4", "6", "8"], width=5)
+        concurrency_box.pack(side=tk.LEFT, padx=5)
+        concurrency_box.bind("<<ComboboxSelected>>", self.apply_concurrency_limits)
+
+        ttk.Label(sub_frame, text="单站点上限:").pack(side=tk.LEFT, padx=(15, 0))
+        self.per_host_var = tk.StringVar(value="2")
+        per_host_box = ttk.Combobox(sub_frame, textvariable=self.per_host_var, values=["1", "2", "3", "4", "8"], width=5)
+        per_host_box.pack(side=tk.LEFT, padx=5)
+        per_host_box.bind("<<ComboboxSelected>>", self.apply_concurrency_limits)
+
+        ttk.Label(sub_frame, text="总带宽(MiB/s):").pack(side=tk.LEFT, padx=(15, 0))
+        self.bandwidth_var = tk.StringVar(value="不限")
+        bandwidth_box = ttk.Combobox(sub_frame, textvariable=self.bandwidth_var, values=["不限", "1", "2", "5", "10", "20", "50"], width=6)
+        bandwidth_box.pack(side=tk.LEFT, padx=5)
+        bandwidth_box.bind("<<ComboboxSelected>>", self.apply_bandwidth_cap)
+        bandwidth_box.bind("<Return>", self.apply_bandwidth_cap)
+
+        self.process_isolation_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(sub_frame, text="独立进程下载（可强制结束卡住的任务）", variable=self.process_isolation_var).pack(side=tk.LEFT, padx=(15, 0))
 
         self.subtitle_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(options_frame, text="下载字幕", variable=self.subtitle_var).grid(row=0, column=3, sticky=tk.W, pady=5, padx=5)
 
         ttk.Label(options_frame, text="线程数:").grid(row=0, column=4, sticky=tk.W, pady=5)
         self.threads_var = tk.StringVar(value="4")
-        ttk.Combobox(options_frame, textvariable=self.threads_var, values=["1", "2", "4", "8", "16"], width=5).grid(row=0, column=5, sticky=tk.W, pady=5, padx=5)
+        ttk.Combobox(options_frame, textvariable=self.threads_var, values=["自动", "1", "2", "4", "8", "16"], width=5).grid(row=0, column=5, sticky=tk.W, pady=5, padx=5)
 
         self.transcode_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(options_frame, text="下载后转码", variable=self.transcode_var).grid(row=0, column=6, sticky=tk.W, pady=5, padx=5)
         self.transcode_format = tk.StringVar(value="mp4")
         ttk.Combobox(options_frame, textvariable=self.transcode_format, values=["mp4", "mkv", "avi", "mov", "webm"], width=10).grid(row=0, column=7, sticky=tk.W, pady=5, padx=5)
 
+        # 第三行：边下边转（下载的数据直接送入ffmpeg）及是否保留原文件
+        stream_frame = ttk.Frame(options_frame)
+        stream_frame.grid(row=2, column=0, columnspan=8, sticky=tk.W, pady=5)
+
+        self.stream_transcode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stream_frame, text="边下边转", variable=self.stream_transcode_var).pack(side=tk.LEFT)
+        self.keep_original_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(stream_frame, text="保留原文件", variable=self.keep_original_var).pack(side=tk.LEFT, padx=(15, 0))
+        self.skip_downloaded_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(stream_frame, text="跳过已下载", variable=self.skip_downloaded_var).pack(side=tk.LEFT, padx=(15, 0))
+        self.delete_partial_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stream_frame, text="取消时删除未完成文件", variable=self.delete_partial_var).pack(side=tk.LEFT, padx=(15, 0))
+        self.playlist_mode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stream_frame, text="播放列表/频道模式（展开全部视频）", variable=self.playlist_mode_var).pack(side=tk.LEFT, padx=(15, 0))
+        # 预检需要先解析全部地址，默认关闭，与命令行的--preflight一致
+        self.preflight_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stream_frame, text="下载前预检（大小、空间、用时）", variable=self.preflight_var).pack(side=tk.LEFT, padx=(15, 0))
+
+        # 第四行：格式选择的限制条件（查询格式时推荐，勾选后每个视频下载前自动选择）
+        constraint_frame = ttk.Frame(options_frame)
+        constraint_frame.grid(row=3, column=0, columnspan=8, sticky=tk.W, pady=5)
+
+        self.auto_format_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(constraint_frame, text="按限制自动选择格式", variable=self.auto_format_var).pack(side=tk.LEFT)
+        ttk.Label(constraint_frame, text="最高分辨率:").pack(side=tk.LEFT, padx=(15, 0))
+        self.max_height_var = tk.StringVar(value="不限")
+        ttk.Combobox(constraint_frame, textvariable=self.max_height_var, values=["不限", "2160", "1440", "1080", "720", "480", "360"], width=6).pack(side=tk.LEFT, padx=5)
+        ttk.Label(constraint_frame, text="最大(MiB):").pack(side=tk.LEFT, padx=(15, 0))
+        self.max_size_var = tk.StringVar(value="")
+        ttk.Entry(constraint_frame, textvariable=self.max_size_var, width=8).pack(side=tk.LEFT, padx=5)
+        ttk.Label(constraint_frame, text="时限(分钟):").pack(side=tk.LEFT, padx=(15, 0))
+        self.deadline_var = tk.StringVar(value="")
+        ttk.Entry(constraint_frame, textvariable=self.deadline_var, width=6).pack(side=tk.LEFT, padx=5)
+        ttk.Label(constraint_frame, text="首选编码:").pack(side=tk.LEFT, padx=(15, 0))
+        self.vcodec_var = tk.StringVar(value="不限")
+        ttk.Combobox(constraint_frame, textvariable=self.vcodec_var, values=["不限", "h264", "vp9", "av1", "hevc"], width=6).pack(side=tk.LEFT, padx=5)
+
         # 按钮
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=10)
@@ -180,10 +258,37 @@ class YouTubeDownloaderApp:
         self.progress_bar = ttk.Progressbar(progress_frame, orient='horizontal', mode='determinate', maximum=100)
         self.progress_bar.pack(fill=tk.X, pady=5)
 
+        self.queue_status_var = tk.StringVar(value="队列: 0  运行: 0/0  利用率: 0%")
+        ttk.Label(progress_frame, textvariable=self.queue_status_var).pack(anchor=tk.W, pady=2)
+
+        # 各任务的最新进度（每个任务一行）
+        self.task_progress_var = tk.StringVar(value="")
+        ttk.Label(progress_frame, textvariable=self.task_progress_var, foreground="blue", justify=tk.LEFT).pack(anchor=tk.W, pady=2)
+
+        # 任务列表：可单独取消选中的任务
+        task_frame = ttk.Frame(progress_frame)
+        task_frame.pack(fill=tk.X, pady=2)
+        self.task_tree = ttk.Treeview(task_frame, columns=("status", "progress", "rate", "title"), height=4)
+        self.task_tree.heading("#0", text="任务")
+        self.task_tree.heading("status", text="状态")
+        self.task_tree.heading("progress", text="进度")
+        self.task_tree.heading("rate", text="速度 / 限速")
+        self.task_tree.heading("title", text="标题 / 链接")
+        self.task_tree.column("#0", width=80, stretch=False)
+        self.task_tree.column("status", width=70, stretch=False)
+        self.task_tree.column("progress", width=70, stretch=False)
+        self.task_tree.column("rate", width=120, stretch=False)
+        self.task_tree.column("title", width=500)
+        self.task_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(task_frame, text="取消选中任务", command=self.cancel_selected_tasks).pack(side=tk.LEFT, padx=5)
+
         # 信息窗口日志
         log_frame = ttk.LabelFrame(main_frame, text="信息窗口日志", padding=10)
         log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
 
+        self.log_file_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(log_frame, text=f"同时保存完整日志到文件 ({LogView.LOG_FILE})", variable=self.log_file_var, command=self.toggle_log_file).pack(anchor=tk.W)
+
         self.log_text = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, height=10)
         self.log_text.pack(fill=tk.BOTH, expand=True)
         self.log_text.config(state=tk.DISABLED)
@@ -191,7 +296,9 @@ class YouTubeDownloaderApp:
         self.log_text.tag_configure("error", foreground="red")
         self.log_text.tag_configure("success", foreground="green")
         self.log_text.tag_configure("info", foreground="black")
-        self.log_text.tag_configure("progress", foreground="blue")
+
+        # 日志区域只保留最近的若干行，长时间运行时内存保持平稳
+        self.log_view = LogView(self.log_text)
 
     def browse_save_path(self):
         """浏览并选择保存路径"""
@@ -219,42 +326,35 @@ class YouTubeDownloaderApp:
 
         def _fetch():
             try:
-                ydl_opts = {
-                    'socket_timeout': 10,
-                    'proxy': proxy,
-                    'quiet': True
-                }
-
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info_dict = ydl.extract_info(url, download=False)
-
-                    title = info_dict.get('title', '未知标题')
-                    duration = info_dict.get('duration', 0)
-                    views = info_dict.get('view_count', 0)
-                    uploader = info_dict.get('uploader', '未知上传者')
-
-                    # 格式化时长
-                    duration_str = "未知"
-                    if duration:
-                        hours, remainder = divmod(int(duration), 3600)
-                        minutes, seconds = divmod(remainder, 60)
-                        if hours > 0:
-                            duration_str = f"{hours}小时{minutes}分{seconds}秒"
-                        else:
-                            duration_str = f"{minutes}分{seconds}秒"
-
-                    # 格式化观看次数
-                    views_str = f"{views:,}"
-
+                info_dict = self.engine.extract_info_cached(url, proxy)
+                title = info_dict.get('title', '未知标题')
+                duration = info_dict.get('duration', 0)
+                views = info_dict.get('view_count', 0)
+                uploader = info_dict.get('uploader', '未知上传者')
+
+                # 格式化时长
+                duration_str = "未知"
+                if duration:
+                    hours, remainder = divmod(int(duration), 3600)
+                    minutes, seconds = divmod(remainder, 60)
+                    if hours > 0:
+                        duration_str = f"{hours}小时{minutes}分{seconds}秒"
+                    else:
+                        duration_str = f"{minutes}分{seconds}秒"
+
+                # 格式化观看次数
+                views_str = f"{views:,}"
+
+                def show_preview():
                     self.title_var.set(f"标题: {title}")
                     self.duration_var.set(f"时长: {duration_str}")
                     self.views_var.set(f"观看次数: {views_str}")
                     self.uploader_var.set(f"上传者: {uploader}")
 
-                    # 保存视频信息
-                    self.video_info[url] = info_dict
+                # Tk控件只能在主线程中更新
+                self.result_queue.put(("call", show_preview))
 
-                    self.result_queue.put(("success", f"成功获取视频信息: {title}"))
+                self.result_queue.put(("success", f"成功获取视频信息: {title}"))
             except Exception as e:
                 self.result_queue.put(("error", f"获取视频信息失败: {str(e)}"))
 
@@ -270,58 +370,40 @@ class YouTubeDownloaderApp:
             messagebox.showerror("错误", "请输入有效的 YouTube 链接")
             return
 
+        try:
+            constraints = self.build_format_constraints()
+        except ValueError:
+            messagebox.showerror("错误", "格式限制必须是数字")
+            return
+
         self.logger.info(f"查询视频格式: {url}")
 
         def _query():
             try:
-                ydl_opts = {
-                    'socket_timeout': 10,
-                    'proxy': proxy,
-                    'quiet': True
-                }
-
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info_dict = ydl.extract_info(url, download=False)
-                    formats = info_dict.get('formats', [info_dict])
-
-                    # 生成格式信息
-                    formats_info = f"\n可用格式 for: {info_dict.get('title')}\n"
-                    for f in formats:
-                        format_id = f['format_id']
-                        ext = f['ext']
-                        resolution = f['resolution'] if 'resolution' in f else f.get('height', '?') or 'audio only'
-                        acodec = f.get('acodec', '?')
-                        vcodec = f.get('vcodec', '?')
-                        filesize = f.get('filesize', 'N/A')
-                        fps = f.get('fps', '?')
-
-                        formats_info += f"ID: {format_id}, 格式: {ext}, 分辨率: {resolution}, 帧率: {fps}fps, 音频: {acodec}, 视频: {vcodec}, 大小: {filesize}\n"
-
-                    self.result_queue.put(("info", formats_info))
-
-                    # 推荐格式ID：优先选择有大小的最高质量，避免N/A
-                    best_video = None
-                    best_audio = None
-
-                    for f in formats:
-                        # 视频格式
-                        if f.get('vcodec') != 'none' and f.get('acodec') == 'none':
-                            height = f.get('height')
-                            if height is not None and f.get('filesize') is not None:
-                                if best_video is None or height > best_video.get('height', 0):
-                                    best_video = f
-
-                        # 音频格式
-                        if f.get('acodec') != 'none' and f.get('vcodec') == 'none':
-                            abr = f.get('abr')
-                            if abr is not None and f.get('filesize') is not None:
-                                if best_audio is None or abr > best_audio.get('abr', 0):
-                                    best_audio = f
-
-                    if best_video and best_audio:
-                        recommended_format = f"{best_video['format_id']}+{best_audio['format_id']}"
-                        self.root.after(0, lambda: self.format_id_var.set(recommended_format))
-                        self.root.after(0, lambda: self.result_queue.put(("info", f"推荐格式ID: {recommended_format} (最佳视频+最佳音频)")))
+                info_dict = self.engine.extract_info_cached(url, proxy)
+                formats = info_dict.get('formats', [info_dict])
+
+                # 生成格式信息
+                formats_info = f"\n可用格式 for: {info_dict.get('title')}\n"
+                for f in formats:
+                    format_id = f['format_id']
+                    ext = f['ext']
+                    resolution = f['resolution'] if 'resolution' in f else f.get('height', '?') or 'audio only'
+                    acodec = f.get('acodec', '?')
+                    vcodec = f.get('vcodec', '?')
+                    size, estimated = estimate_size(f, info_dict.get('duration'))
+                    filesize = f"{'~' if estimated else ''}{size / 1024 / 1024:.1f}MiB" if size else 'N/A'
+                    fps = f.get('fps', '?')
+
+                    formats_info += f"ID: {format_id}, 格式: {ext}, 分辨率: {resolution}, 帧率: {fps}fps, 音频: {acodec}, 视频: {vcodec}, 大小: {filesize}\n"
+
+                self.result_queue.put(("info", formats_info))
+
+                # 按界面上的限制条件推荐格式（没有文件大小的格式按近似大小或码率估算）
+                choice = select_format(info_dict, constraints, throughput=self.engine.expected_throughput((urlparse(url).hostname or "").lower()))
+                if choice is not None:
+                    self.result_queue.put(("call", lambda: self.format_id_var.set(choice.spec)))
+                    self.result_queue.put(("info", f"推荐格式ID: {choice.describe()}"))
             
             except Exception as e:
                 self.result_queue.put(("error", f"查询格式失败: {str(e)}"))
@@ -331,29 +413,14 @@ class YouTubeDownloaderApp:
 
     def start_download(self):
         """开始下载视频或音频"""
-        urls = []
         single_url = self.url_entry.get().strip()
         multi_urls = self.urls_text.get(1.0, tk.END).strip().split('\n')
-
-        if single_url and self.validate_url(single_url):
-            urls.append(single_url)
-
-        for url in multi_urls:
-            url = url.strip()
-            if url and self.validate_url(url) and url not in urls:
-                urls.append(url)
+        urls = [url.strip() for url in [single_url] + multi_urls if url.strip() and self.validate_url(url.strip())]
 
         if not urls:
             messagebox.showerror("错误", "请输入有效的 YouTube 链接")
             return
 
-        proxy = self.proxy_entry.get().strip() or None
-        save_path = self.save_path_var.get()
-        download_subtitles = self.subtitle_var.get()
-        thread_count = int(self.threads_var.get())
-        transcode = self.transcode_var.get()
-        transcode_format = self.transcode_format.get()
-
         # 获取用户输入的格式ID
         format_id = self.format_id_var.get().strip()
 
@@ -361,483 +428,679 @@ class YouTubeDownloaderApp:
             messagebox.showerror("错误", "请输入有效的格式ID")
             return
 
-        # 准备下载任务
-        self.download_tasks = urls.copy()
-        self.current_task_index = 0
-        self.total_tasks = len(urls)
-        self.abort_all_tasks = False
-        self.update_progress(0, "准备下载...")
-
-        # 创建下载队列
-        self.download_queue = queue.Queue()
-        for url in urls:
-            self.logger.info(f"添加下载任务: {url} (格式: {format_id})")
-            self.download_queue.put(("download", url, proxy, save_path, format_id, download_subtitles, thread_count, transcode, transcode_format))
+        try:
+            constraints = self.build_format_constraints() if self.auto_format_var.get() else None
+        except ValueError:
+            messagebox.showerror("错误", "格式限制必须是数字")
+            return
 
-    def stop_download(self):
-        """终止正在进行的下载"""
-        if not self.is_downloading:
-            messagebox.showinfo("提示", "当前没有正在进行的下载")
+        options = {
+            "proxy": self.proxy_entry.get().strip() or None,
+            "save_path": self.save_path_var.get(),
+            "format_id": format_id,
+            "format_constraints": constraints.to_dict() if constraints else None,
+            "download_subtitles": self.subtitle_var.get(),
+            "thread_count": "auto" if self.threads_var.get() == "自动" else int(self.threads_var.get()),
+            "transcode": self.transcode_var.get(),
+            "transcode_format": self.transcode_format.get(),
+            "stream_transcode": self.stream_transcode_var.get(),
+            "keep_original": self.keep_original_var.get(),
+            "skip_downloaded": self.skip_downloaded_var.get(),
+            "delete_partial_on_cancel": self.delete_partial_var.get(),
+            "process_isolation": self.process_isolation_var.get(),
+        }
+
+        self.apply_concurrency_limits()
+        # 勾选预检时先估算总大小、磁盘空间和用时（播放列表的条目在下载过程中陆续展开，不做预检）
+        if self.preflight_var.get() and not self.playlist_mode_var.get():
+            self.engine.update_progress(0, f"正在预检 {len(urls)} 个地址...")
+            threading.Thread(target=self._preflight, args=(urls, options), daemon=True).start()
             return
-            
-        self.abort_all_tasks = True
-        self.logger.info("正在终止所有下载任务...")
-        self.result_queue.put(("info", "正在终止所有下载任务..."))
-        
-        # 终止当前下载
-        if self.ydl_instance:
-            self.ydl_instance._download_retcode = -1  # 设置退出码强制终止
-        
-        # 等待所有线程结束
-        for task_id, thread in list(self.download_threads.items()):
-            if thread.is_alive():
-                self.logger.info(f"等待任务 {task_id} 终止...")
-                thread.join(timeout=1.0)
-        
-        self.is_downloading = False
-        self.ydl_instance = None
-        self.download_threads = {}
-        self.update_progress(0, "所有下载已终止")
-        self.logger.info("所有下载任务已终止")
-        self.result_queue.put(("info", "所有下载任务已终止"))
-
-    def update_progress(self, percent, message):
-        """更新进度条和进度信息"""
-        self.progress_bar['value'] = percent
-        self.progress_label.config(text=message)
-        self.root.update_idletasks()
-
-    def process_queue(self):
-        """处理下载队列"""
-        while True:
-            try:
-                if self.abort_all_tasks:
-                    # 清空队列
-                    while not self.download_queue.empty():
-                        self.download_queue.get()
-                        self.download_queue.task_done()
-                    continue
-                
-                task = self.download_queue.get(timeout=1)
-                if task[0] == "download":
-                    self.current_task_index += 1
-                    self.update_progress(
-                        (self.current_task_index-1) / self.total_tasks * 100, 
-                        f"准备下载 {self.current_task_index}/{self.total_tasks}"
-                    )
-                    
-                    # 为每个下载任务创建唯一ID
-                    task_id = f"task_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-
-                    # 在单独的线程中执行下载，以便可以独立控制每个任务
-                    thread = threading.Thread(
-                        target=self._download, 
-                        args=(task_id, task[1], task[2], task[3], task[4], task[5], task[6], task[7], task[8]),
-                        daemon=True
-                    )
-                    self.download_threads[task_id] = thread
-                    thread.start()
-                self.download_queue.task_done()
-            except queue.Empty:
-                continue
-            except Exception as e:
-                self.logger.error(f"处理任务时出错: {str(e)}")
+        # 地址按规范视频ID去重，youtu.be、shorts、带时间参数等不同形式视为同一视频
+        self.engine.submit(urls, options, playlist=self.playlist_mode_var.get())
 
-    def _download(self, task_id, url, proxy, save_path, format_id, download_subtitles, thread_count, transcode, transcode_format):
-        """下载视频或音频的实际处理函数"""
-        self.is_downloading = True
-        
+    def _preflight(self, urls, options):
+        """在后台线程中预检，完成后回到界面线程确认"""
         try:
-            # 检查是否需要提取音频
-            is_audio = format_id.lower().startswith('audio') or format_id == 'bestaudio'
-
-            # 设置yt-dlp选项
-            # 检查ffmpeg是否可用（如果需要合并格式或提取音频）
-            needs_ffmpeg = (
-                '+' in format_id or  # 格式包含+表示需要合并
-                (format_id.lower().startswith('audio') or format_id == 'bestaudio')  # 音频提取需要ffmpeg
-            )
-
-            if needs_ffmpeg and not self.check_ffmpeg():
-                raise RuntimeError("需要ffmpeg来合并格式或提取音频，但未找到ffmpeg。请安装ffmpeg并确保其在系统PATH中。")
-
-            ydl_opts = {
-                'format': format_id,
-                'outtmpl': f"{save_path}/%(title)s.%(ext)s",
-                'noplaylist': True,
-                'continuedl': True,
-                'quiet': True,
-                'no_warnings': True,
-                'socket_timeout': 10,
-                'proxy': proxy,
-                'concurrent_fragments': thread_count,
-                'progress_hooks': [self._download_hook],
-                'logger': self.logger,
-                'writesubtitles': download_subtitles,
-                'writeautomaticsub': download_subtitles,
-                'subtitleslangs': ['en', 'zh-Hans', 'zh-Hant'],  # 下载多种语言字幕
-            }
-
-            # 如果是音频下载，添加音频处理选项
-            if is_audio:
-                ydl_opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3' if format_id == 'bestaudio' else 'best',
-                    'preferredquality': '192',
-                }]
-
-            self.logger.info(f"开始下载到: {save_path}")
-
-            # 更新进度条
-            self.update_progress(
-                (self.current_task_index-1) / self.total_tasks * 100, 
-                f"下载中 {self.current_task_index}/{self.total_tasks}"
+            report = self.engine.preflight(urls, options)
+        except Exception as e:
+            self.result_queue.put(("error", f"预检失败，直接开始下载: {str(e)}"))
+            self.result_queue.put(("call", lambda: self.engine.submit(urls, options)))
+            return
+        self.result_queue.put(("call", lambda: self.confirm_preflight(report, urls, options)))
+
+    def confirm_preflight(self, report, urls, options):
+        """根据预检结果决定是否开始：空间不足时可以只下载放得下的视频，用时过长时先确认"""
+        summary = report.summary()
+        self.result_queue.put(("info", f"预检: {summary}"))
+        if not report.enough_space:
+            fitting = report.fitting_urls()
+            answer = messagebox.askyesnocancel(
+                "磁盘空间不足",
+                f"{summary}\n\n是：只下载放得下的 {len(fitting)} 个视频（小的优先）\n否：仍然全部下载\n取消：不下载"
             )
-
-            # 保存ydl实例用于终止下载
-            self.ydl_instance = yt_dlp.YoutubeDL(ydl_opts)
-
-            # 开始下载
-            info_dict = self.ydl_instance.extract_info(url, download=True)
-
-            if self.abort_all_tasks:
-                self.result_queue.put(("info", f"下载已取消: {info_dict.get('title')}"))
+            if answer is None:
+                self.engine.update_progress(0, "已取消：磁盘空间不足")
+                return
+            if answer:
+                urls = fitting
+        elif report.seconds is not None and report.seconds > self.PREFLIGHT_CONFIRM_SECONDS:
+            if not messagebox.askokcancel("确认下载", f"{summary}\n\n是否开始下载？"):
+                self.engine.update_progress(0, "已取消")
                 return
+        self.engine.submit(urls, options)
+
+    def build_format_constraints(self):
+        """根据界面上的限制条件创建FormatConstraints，数值无效时抛出ValueError"""
+        max_height = self.max_height_var.get().strip()
+        max_size = self.max_size_var.get().strip()
+        deadline = self.deadline_var.get().strip()
+        vcodec = self.vcodec_var.get().strip()
+        return FormatConstraints(
+            max_bytes=int(float(max_size) * 1024 * 1024) if max_size else None,
+            max_height=int(max_height) if max_height and max_height != "不限" else None,
+            vcodecs=[vcodec] if vcodec and vcodec != "不限" else None,
+            # 下载后转码时优先选择可直接封装到目标容器的编码，转码时只需复制流
+            container=self.transcode_format.get() if self.transcode_var.get() else None,
+            deadline=float(deadline) * 60 if deadline else None,
+        )
+
+    def apply_concurrency_limits(self, event=None):
+        """将界面上的并发设置应用到调度器，对运行中的批次立即生效"""
+        try:
+            max_workers = int(self.concurrency_var.get())
+            per_host_limit = int(self.per_host_var.get())
+        except ValueError:
+            messagebox.showerror("错误", "并发数必须是整数")
+            return
+        self.engine.set_limits(max_workers, per_host_limit)
 
-            self.logger.info(f"下载完成: {info_dict.get('title')}")
-            self.update_progress(100, "下载完成")
-            self.result_queue.put(("success", f"下载完成: {info_dict.get('title')}"))
-            self.update_progress(
-                self.current_task_index / self.total_tasks * 100, 
-                f"完成 {self.current_task_index}/{self.total_tasks}"
+    def apply_bandwidth_cap(self, event=None):
+        """将总带宽上限应用到引擎，正在下载的任务立即按新的份额限速"""
+        value = self.bandwidth_var.get().strip()
+        if value in ("", "不限", "0"):
+            self.engine.set_bandwidth_cap(None)
+            return
+        try:
+            cap = float(value)
+        except ValueError:
+            messagebox.showerror("错误", "总带宽必须是数字（MiB/s）")
+            return
+        self.engine.set_bandwidth_cap(int(cap * 1024 * 1024))
+
+    def refresh_queue_status(self):
+        """定期刷新队列深度和工作线程利用率"""
+        m = self.engine.scheduler.metrics()
+        self.queue_status_var.set(
+            f"队列: {m['queue_depth']}  运行: {m['running']}/{m['max_workers']}  "
+            f"利用率: {m['utilization']:.0%} (平均 {m['avg_utilization']:.0%})  "
+            f"完成: {m['completed']}  失败: {m['failed']}"
+        )
+        t = self.engine.transcode_pool.metrics()
+        if t['running'] or t['pending']:
+            self.queue_status_var.set(
+                self.queue_status_var.get()
+                + f"  |  转码: {t['running']}/{t['workers']} 等待: {t['pending']}"
             )
-
-            # 保存下载历史
-            self.save_download_history(url, info_dict.get('title'), format_id, save_path)
-
-            # 如果启用了转码，执行转码
-            if transcode:
-                original_file = f"{save_path}/{info_dict.get('title', 'video')}.{info_dict.get('ext', 'mp4')}"
-                transcoded_file = f"{save_path}/{info_dict.get('title', 'video')}.{transcode_format}"
-                
-                self.result_queue.put(("info", f"开始转码: {original_file} -> {transcoded_file}"))
-                self.transcode_file(original_file, transcoded_file)
-
-        except Exception as e:
-            self.logger.error(f"下载失败: {str(e)}")
-            self.update_progress(0, "下载失败")
-            error_msg = str(e)
-            if "ffmpeg" in error_msg.lower() or "FFmpeg" in error_msg:
-                self.result_queue.put(("error", f"下载失败: 需要ffmpeg但未安装。请安装ffmpeg并确保其在系统PATH中。"))
-            elif 'yt_dlp.utils.DownloadError' in str(type(e)) or 'Network' in error_msg or '403' in error_msg:
-                self.result_queue.put(("error", "连接 YouTube 失败，可能是网络限制或无代理所致。"))
+        cap = self.engine.bandwidth.current_cap()
+        if cap:
+            rate = sum(task.rate for task in self.engine.scheduler.running_tasks())
+            self.queue_status_var.set(
+                self.queue_status_var.get()
+                + f"  |  带宽: {rate / 1048576:.1f}/{cap / 1048576:.1f} MiB/s"
+            )
+        self.refresh_task_list()
+        self.root.after(500, self.refresh_queue_status)
+
+    def refresh_task_list(self):
+        """刷新任务列表，只显示可取消的任务（运行中的和队列前端的等待任务）"""
+        scheduler = self.engine.scheduler
+        tasks = scheduler.running_tasks() + scheduler.pending_tasks(self.TASK_LIST_PENDING)
+        status_names = {"pending": "等待", "running": "下载中", "cancelling": "正在取消"}
+        shown = set()
+        for index, task in enumerate(tasks):
+            values = (status_names.get(task.status, task.status), f"{task.progress:.0f}%",
+                      self.format_rate(task), task.title or task.url)
+            shown.add(task.task_id)
+            if self.task_tree.exists(task.task_id):
+                self.task_tree.item(task.task_id, values=values)
+                self.task_tree.move(task.task_id, "", index)
             else:
-                self.result_queue.put(("error", f"下载失败: {error_msg}"))
-        finally:
-            self.is_downloading = False
-            self.ydl_instance = None
-            if task_id in self.download_threads:
-                del self.download_threads[task_id]
-
-    def _download_hook(self, d):
-        """下载进度回调函数"""
-        if self.abort_all_tasks:
+                self.task_tree.insert("", index, iid=task.task_id, text=task.task_id, values=values)
+        for iid in self.task_tree.get_children():
+            if iid not in shown:
+                self.task_tree.delete(iid)
+
+    def format_rate(self, task):
+        """任务的实际速度和分配到的限速"""
+        if task.status != "running":
+            return ""
+        text = f"{task.rate / 1048576:.2f}"
+        if task.rate_limit:
+            text += f" / {task.rate_limit / 1048576:.2f}"
+        return text + " MiB/s"
+
+    def cancel_selected_tasks(self):
+        """取消选中的任务，不影响其他任务，也不等待任务结束"""
+        selection = self.task_tree.selection()
+        if not selection:
+            messagebox.showinfo("提示", "请先在任务列表中选择要取消的任务")
+            return
+        for task_id in selection:
+            if self.engine.cancel(task_id, delete_partial=self.delete_partial_var.get()):
+                self.result_queue.put(("info", f"正在取消任务: {task_id}"))
+
+    def stop_download(self):
+        """终止正在进行的下载"""
+        if not self.is_downloading:
+            messagebox.showinfo("提示", "当前没有正在进行的下载")
             return
             
-        if d['status'] == 'downloading':
-            percent = d.get('_percent_str', '?')
-            speed = d.get('_speed_str', '?')
-            eta = d.get('_eta_str', '?')
-            self.result_queue.put(("progress", f"下载中: {percent} 速度: {speed} 剩余时间: {eta}"))
-
-            # 更新进度条
-            if '%' in percent:
-                try:
-                    progress = float(percent.strip('%'))
-                    overall_progress = (self.current_task_index-1 + progress/100) / self.total_tasks * 100
-                    self.update_progress(overall_progress, f"下载中 {self.current_task_index}/{self.total_tasks}: {percent}")
-                except:
-                    pass
-        elif d['status'] == 'finished':
-            self.result_queue.put(("info", "正在处理文件..."))
+        self.engine.stop_all(delete_partial=self.delete_partial_var.get())
 
     def process_results(self):
-        """处理结果队列"""
+        """按固定帧率处理事件总线：日志批量写入，进度只显示最新状态"""
         try:
-            while not self.result_queue.empty():
-                result = self.result_queue.get()
-                if result[0] == "info":
-                    self._append_log(result[1], "info")
-                elif result[0] == "error":
-                    self._append_log(f"错误: {result[1]}", "error")
-                elif result[0] == "success":
-                    self._append_log(f"成功: {result[1]}", "success")
-                elif result[0] == "progress":
-                    self._update_progress(result[1])
+            lines, progress, overall, calls, dropped = self.result_queue.drain()
+            for call in calls:
+                call()
+            if dropped:
+                lines.insert(0, ("info", f"（界面繁忙，省略了 {dropped} 条日志）"))
+            if lines:
+                self._append_logs(lines)
+            if progress:
+                self._update_task_progress(progress)
+            if overall is not None:
+                percent, message = overall
+                self.progress_label.config(text=message)
+                if percent is not None:
+                    self.progress_bar['value'] = percent
+            if self.engine.download_tasks and not self.engine.abort_all_tasks and (overall is None or overall[0] is None):
+                self.progress_bar['value'] = self.engine.overall_progress()
         except Exception as e:
             self._append_log(f"处理结果时出错: {str(e)}", "error")
 
-        # 每隔100毫秒检查一次结果队列
-        self.root.after(100, self.process_results)
+        self.root.after(self.UI_FRAME_MS, self.process_results)
+
+    def _append_logs(self, lines):
+        """一次插入多条日志，每个刷新周期只操作一次文本控件"""
+        prefixes = {"error": "错误: ", "success": "成功: "}
+        self.log_view.append([(tag, prefixes.get(tag, "") + str(message)) for tag, message in lines])
 
     def _append_log(self, message, tag="info"):
         """向日志区域添加消息"""
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, message + "\n", tag)
-        self.log_text.config(state=tk.DISABLED)
-        self.log_text.see(tk.END)
+        self.log_view.append([(tag, message)])
+
+    def toggle_log_file(self):
+        """开启或关闭完整日志文件"""
+        if self.log_file_var.get():
+            try:
+                self.log_view.enable_file()
+            except OSError as e:
+                self.log_file_var.set(False)
+                messagebox.showerror("错误", f"无法打开日志文件: {str(e)}")
+        else:
+            self.log_view.disable_file()
     
-    def _update_progress(self, message):
-        """更新进度信息"""
-        self.log_text.config(state=tk.NORMAL)
-        # 清除最后一行（进度信息）
-        self.log_text.delete("end-2l", "end-1c")
-        self.log_text.insert(tk.END, message + "\n", "progress")
-        self.log_text.config(state=tk.DISABLED)
-        self.log_text.see(tk.END)
+    def _update_task_progress(self, progress):
+        """合并各任务的最新进度并刷新进度区域"""
+        for key, message in progress.items():
+            if message is None:
+                self._task_progress.pop(key, None)
+            else:
+                self._task_progress[key] = message
+        shown = list(self._task_progress.values())[:self.MAX_PROGRESS_LINES]
+        hidden = len(self._task_progress) - len(shown)
+        if hidden > 0:
+            shown.append(f"... 另有 {hidden} 个任务")
+        self.task_progress_var.set("\n".join(shown))
     
     def clear_logs(self):
         """清空日志区域"""
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.delete(1.0, tk.END)
-        self.log_text.config(state=tk.DISABLED)
-    
-    def load_download_history(self):
-        """加载下载历史"""
-        try:
-            if os.path.exists("download_history.json"):
-                with open("download_history.json", "r", encoding="utf-8") as f:
-                    self.download_history = json.load(f)
-            else:
-                self.download_history = []
-        except Exception as e:
-            self.download_history = []
-            self.logger.error(f"加载下载历史失败: {str(e)}")
-    
-    def save_download_history(self, url, title, format_id, save_path):
-        """保存下载历史"""
-        try:
-            history_entry = {
-                "url": url,
-                "title": title,
-                "format_id": format_id,
-                "save_path": save_path,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            self.download_history.append(history_entry)
-            
-            # 只保留最近100条记录
-            if len(self.download_history) > 100:
-                self.download_history = self.download_history[-100:]
-            
-            with open("download_history.json", "w", encoding="utf-8") as f:
-                json.dump(self.download_history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            self.logger.error(f"保存下载历史失败: {str(e)}")
+        self.log_view.clear()
     
     def show_history(self):
         """显示下载历史"""
-        if not self.download_history:
+        store = self.engine.load_download_history()
+        if store is None:
             messagebox.showinfo("下载历史", "暂无下载历史记录")
             return
-        
-        history_window = tk.Toplevel(self.root)
-        history_window.title("下载历史")
-        history_window.geometry("800x500")
-        history_window.minsize(700, 400)
-        
+
+        # 记录数与第一页一起在工作线程中查询，没有记录时由窗口显示提示
+        HistoryBrowser(self.root, store, self.result_queue)
+
+
+class LogView:
+    """有上限的日志视图
+
+    文本控件最多保留 MAX_LINES 行，超出 TRIM_LINES 行后一次性删除最旧的部分；
+    每次追加只调用一次insert。可选地把完整日志写入滚动日志文件。
+    """
+
+    MAX_LINES = 5000
+    TRIM_LINES = 500
+    LOG_FILE = "yt_downloader.log"
+    LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+    LOG_FILE_BACKUPS = 5
+
+    def __init__(self, text):
+        self.text = text
+        self.line_count = 0
+        self.file_handler = None
+
+    def append(self, lines):
+        """追加多条日志: [(tag, message), ...]"""
+        if not lines:
+            return
+        args = []
+        added = 0
+        for tag, message in lines:
+            args += [message + "\n", tag]
+            added += message.count("\n") + 1
+
+        # 用户向上翻看时不自动滚动到底部
+        at_bottom = self.text.yview()[1] >= 0.999
+        self.text.config(state=tk.NORMAL)
+        self.text.insert(tk.END, *args)
+        self.line_count += added
+        excess = self.line_count - self.MAX_LINES
+        if excess >= self.TRIM_LINES:
+            self.text.delete("1.0", f"{excess + 1}.0")
+            self.line_count -= excess
+        self.text.config(state=tk.DISABLED)
+        if at_bottom:
+            self.text.see(tk.END)
+
+        if self.file_handler is not None:
+            stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            text = "\n".join(f"{stamp} [{tag}] {message}" for tag, message in lines)
+            self.file_handler.emit(logging.makeLogRecord({"msg": text, "levelname": "INFO"}))
+
+    def clear(self):
+        self.text.config(state=tk.NORMAL)
+        self.text.delete(1.0, tk.END)
+        self.text.config(state=tk.DISABLED)
+        self.line_count = 0
+
+    def enable_file(self, path=None):
+        """把之后的日志完整写入滚动日志文件"""
+        if self.file_handler is None:
+            self.file_handler = logging.handlers.RotatingFileHandler(
+                path or self.LOG_FILE,
+                maxBytes=self.LOG_FILE_MAX_BYTES,
+                backupCount=self.LOG_FILE_BACKUPS,
+                encoding="utf-8"
+            )
+            self.file_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def disable_file(self):
+        if self.file_handler is not None:
+            self.file_handler.close()
+            self.file_handler = None
+
+
+class HistoryBrowser:
+    """下载历史窗口：滚动时分页读取，过滤和排序在数据库中完成，表格只保留有限的行
+
+    查询在工作线程中执行，结果通过事件队列交回界面线程，大量记录时搜索也不会卡住界面。
+    """
+
+    PAGE_SIZE = 200
+    MAX_ROWS = 1000
+
+    # (列标题, 排序字段, 列宽)
+    COLUMNS = (
+        ("序号", None, 60),
+        ("标题", "title", 200),
+        ("URL", "url", 300),
+        ("格式", "format_id", 80),
+        ("保存路径", "save_path", 150),
+        ("时间", "timestamp", 140),
+    )
+
+    def __init__(self, root, store, result_queue):
+        self.store = store
+        self.result_queue = result_queue
+        self.order_by = "timestamp"
+        self.descending = True
+        self.search = ""
+        self.total = 0
+        self.window_start = 0  # 表格第一行在查询结果中的偏移
+        self._loading = False
+        self._search_job = None
+        # 搜索或排序每变化一次加一，用于丢弃过期的查询结果
+        self._generation = 0
+
+        self.window = tk.Toplevel(root)
+        self.window.title("下载历史")
+        self.window.geometry("800x500")
+        self.window.minsize(700, 400)
+
+        # 搜索栏
+        search_frame = ttk.Frame(self.window, padding=5)
+        search_frame.pack(fill=tk.X)
+        ttk.Label(search_frame, text="搜索:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        ttk.Entry(search_frame, textvariable=self.search_var, width=40).pack(side=tk.LEFT, padx=5)
+        self.search_var.trace_add("write", self._on_search_changed)
+        self.status_var = tk.StringVar()
+        ttk.Label(search_frame, textvariable=self.status_var).pack(side=tk.RIGHT)
+
         # 创建表格
-        columns = ("序号", "标题", "URL", "格式", "保存路径", "时间")
-        tree = ttk.Treeview(history_window, columns=columns, show="headings")
-        
-        # 设置列宽和标题
-        for col in columns:
-            tree.heading(col, text=col)
-            if col == "标题":
-                tree.column(col, width=200)
-            elif col == "URL":
-                tree.column(col, width=300)
-            elif col == "保存路径":
-                tree.column(col, width=150)
+        self.tree = ttk.Treeview(self.window, columns=[c[0] for c in self.COLUMNS], show="headings")
+        for name, column, width in self.COLUMNS:
+            if column:
+                self.tree.heading(name, text=name, command=lambda c=column: self.sort_by(c))
             else:
-                tree.column(col, width=80)
-        
-        # 添加数据
-        for i, entry in enumerate(reversed(self.download_history), 1):
-            tree.insert("", "end", values=(
-                i,
-                entry["title"],
-                entry["url"],
-                entry["format_id"],
-                entry["save_path"],
-                entry["timestamp"]
-            ))
-        
+                self.tree.heading(name, text=name)
+            self.tree.column(name, width=width)
+
         # 添加滚动条
-        scrollbar = ttk.Scrollbar(history_window, orient="vertical", command=tree.yview)
-        tree.configure(yscroll=scrollbar.set)
-        
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        tree.pack(fill=tk.BOTH, expand=True)
-        
+        self.scrollbar = ttk.Scrollbar(self.window, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
         # 添加双击打开文件位置功能
-        def open_file_location(event):
-            item = tree.selection()[0]
-            values = tree.item(item, "values")
-            path = values[4]
-            
-            if platform.system() == "Windows":
-                os.startfile(path)
-            elif platform.system() == "Darwin":  # macOS
-                subprocess.run(["open", path])
-            else:  # Linux
-                subprocess.run(["xdg-open", path])
+        self.tree.bind("<Double-1>", self._open_file_location)
+
+        self._update_headings()
+        self.reload()
+
+    def reload(self):
+        """按当前的搜索和排序条件重新加载第一页"""
+        self._generation += 1
+        self._loading = True
+        self.status_var.set("查询中...")
+        search, order_by, descending = self.search or None, self.order_by, self.descending
+
+        def work():
+            return (self.store.count(search),
+                    self.store.query(search, order_by, descending, self.PAGE_SIZE, 0))
+
+        self._in_background(work, self._show_first_page)
+
+    def _show_first_page(self, result):
+        self.total, rows = result
+        self.tree.delete(*self.tree.get_children())
+        self.window_start = 0
+        for i, entry in enumerate(rows):
+            self.tree.insert("", "end", values=self._values(i, entry))
+        self.tree.yview_moveto(0)
+        self._loading = False
+        self._update_status()
+
+    def _in_background(self, work, apply):
+        """在工作线程中执行查询，结果交回界面线程；期间搜索或排序变化则丢弃结果"""
+        generation = self._generation
+
+        def deliver(result):
+            if generation != self._generation or not self.window.winfo_exists():
+                return
+            if isinstance(result, Exception):
+                self._loading = False
+                self.status_var.set(f"查询失败: {str(result)}")
+                return
+            apply(result)
+
+        def run():
+            try:
+                result = work()
+            except Exception as e:
+                result = e
+            self.result_queue.put(("call", lambda: deliver(result)))
+
+        threading.Thread(target=run, name="history-query", daemon=True).start()
+
+    def sort_by(self, column):
+        """点击列标题排序，再次点击切换升降序"""
+        if column == self.order_by:
+            self.descending = not self.descending
+        else:
+            self.order_by = column
+            self.descending = column == "timestamp"
+        self._update_headings()
+        self.reload()
+
+    def _update_headings(self):
+        for name, column, _ in self.COLUMNS:
+            text = name
+            if column == self.order_by:
+                text += " ▼" if self.descending else " ▲"
+            self.tree.heading(name, text=text)
+
+    def _update_status(self):
+        shown = len(self.tree.get_children())
+        if shown:
+            self.status_var.set(f"第 {self.window_start + 1}-{self.window_start + shown} 条 / 共 {self.total} 条")
+        elif not self.search:
+            self.status_var.set("暂无下载历史记录")
+        else:
+            self.status_var.set(f"共 {self.total} 条")
+
+    def _on_search_changed(self, *args):
+        # 输入停顿后再查询，避免每个按键都访问数据库
+        if self._search_job is not None:
+            self.window.after_cancel(self._search_job)
+        self._search_job = self.window.after(250, self._apply_search)
+
+    def _apply_search(self):
+        self._search_job = None
+        self.search = self.search_var.get().strip()
+        self.reload()
+
+    def _fetch(self, offset, limit, apply):
+        search, order_by, descending = self.search or None, self.order_by, self.descending
+        self._loading = True
+        self._in_background(lambda: self.store.query(search, order_by, descending, limit, offset),
+                            lambda rows: apply(offset, rows))
+
+    def _values(self, index, entry):
+        return (
+            index + 1,
+            entry["title"],
+            entry["url"],
+            entry["format_id"],
+            entry["save_path"],
+            entry["timestamp"]
+        )
+
+    def _append_page(self):
+        """在表格底部追加下一页"""
+        offset = self.window_start + len(self.tree.get_children())
+        if offset < self.total:
+            self._fetch(offset, self.PAGE_SIZE, self._insert_bottom)
+
+    def _insert_bottom(self, offset, rows):
+        # 超出行数上限时从顶部批量移除
+        for i, entry in enumerate(rows):
+            self.tree.insert("", "end", values=self._values(offset + i, entry))
+
+        children = self.tree.get_children()
+        overflow = len(children) - self.MAX_ROWS
+        if overflow > 0:
+            top_row = self.tree.yview()[0] * len(children)
+            self.tree.delete(*children[:overflow])
+            self.window_start += overflow
+            self.tree.yview_moveto(max(0, top_row - overflow) / (len(children) - overflow))
+        self._loading = False
+        self._update_status()
+
+    def _prepend_page(self):
+        """在表格顶部插入上一页"""
+        if self.window_start > 0:
+            offset = max(0, self.window_start - self.PAGE_SIZE)
+            self._fetch(offset, self.window_start - offset, self._insert_top)
+
+    def _insert_top(self, offset, rows):
+        # 超出行数上限时从底部批量移除
+        children = self.tree.get_children()
+        top_row = self.tree.yview()[0] * len(children)
+        for i, entry in enumerate(rows):
+            self.tree.insert("", i, values=self._values(offset + i, entry))
+        self.window_start = offset
+
+        children = self.tree.get_children()
+        overflow = len(children) - self.MAX_ROWS
+        if overflow > 0:
+            self.tree.delete(*children[-overflow:])
+        self.tree.yview_moveto((top_row + len(rows)) / len(self.tree.get_children()))
+        self._loading = False
+        self._update_status()
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._loading:
+            return
+        if float(last) > 0.9:
+            self._append_page()
+        elif float(first) < 0.1:
+            self._prepend_page()
+
+    def _open_file_location(self, event):
+        selection = self.tree.selection()
+        if not selection:
+            return
+        path = self.tree.item(selection[0], "values")[4]
         
-        tree.bind("<Double-1>", open_file_location)
-    
-    def transcode_file(self, input_file, output_file):
-        """转码文件"""
-        try:
-            # 检查ffmpeg是否存在
+        if platform.system() == "Windows":
+            os.startfile(path)
+        elif platform.system() == "Darwin":  # macOS
+            subprocess.run(["open", path])
+        else:  # Linux
+            subprocess.run(["xdg-open", path])
+
+
+class StartupWarmup:
+    """启动预热：在后台线程中依次执行预热步骤，并记录真实进度"""
+
+    def __init__(self, steps, logger=None):
+        self.steps = steps
+        self.logger = logger
+        self.completed = 0
+        self.current = steps[0][0] if steps else "准备就绪"
+        self.done = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="startup-warmup", daemon=True).start()
+
+    def _run(self):
+        for label, step in self.steps:
+            self.current = label
             try:
-                subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            except (subprocess.SubprocessError, FileNotFoundError):
-                self.result_queue.put(("error", "转码失败: 未找到ffmpeg。请确保ffmpeg已安装并添加到系统PATH中。"))
-                return
-            
-            # 构建ffmpeg命令
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-c:v", "libx264",  # 使用x264编码
-                "-preset", "medium",  # 编码速度预设
-                "-crf", "23",        # 质量控制
-                "-c:a", "aac",       # 音频编码
-                "-strict", "experimental",
-                "-y",                # 覆盖已存在文件
-                output_file
-            ]
-            
-            # 执行转码
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            
-            # 监控转码进度
-            while True:
-                output = process.stderr.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    # 可以在这里解析输出以获取进度信息
-                    pass
-            
-            return_code = process.wait()
-            
-            if return_code == 0:
-                self.result_queue.put(("success", f"转码完成: {output_file}"))
-                # 删除原始文件（可选）
-                # os.remove(input_file)
+                step()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"启动预热失败 ({label}): {str(e)}")
+            self.completed += 1
+        self.current = "准备就绪"
+        self.done.set()
+
+
+class SplashScreen:
+    """启动画面：显示真实的加载进度，主界面就绪后立即关闭"""
+
+    POLL_MS = 30
+
+    def __init__(self, root):
+        self.root = root
+        self.splash = tk.Toplevel(root)
+        self.splash.title("加载中...")
+        self.splash.overrideredirect(True)
+        self.splash.attributes('-topmost', True)
+
+        screen_width = self.splash.winfo_screenwidth()
+        screen_height = self.splash.winfo_screenheight()
+        x = (screen_width - 400) // 2
+        y = (screen_height - 300) // 2
+        self.splash.geometry(f"400x300+{x}+{y}")
+
+        label = tk.Label(self.splash, text="YouTube 下载器", font=('SimHei', 18, 'bold'), fg="red")
+        label.pack(pady=20)
+
+        self.progress = ttk.Progressbar(self.splash, orient='horizontal', mode='determinate', maximum=100, length=300)
+        self.progress.pack(pady=20)
+
+        self.status_label = tk.Label(self.splash, text="正在构建主界面...", font=('SimHei', 12))
+        self.status_label.pack()
+
+        # 立即绘制启动画面，避免构建主界面期间出现空白
+        self.splash.update()
+
+    def follow(self, warmup, on_close, max_wait_ms=2000):
+        """跟踪预热进度，预热完成或等待超时后关闭启动画面；未完成的预热在后台继续"""
+        start = time.perf_counter()
+        total = len(warmup.steps) + 1  # 构建主界面算作第一步
+
+        def poll():
+            self.progress['value'] = (warmup.completed + 1) / total * 100
+            self.status_label.config(text=warmup.current)
+            waited_ms = (time.perf_counter() - start) * 1000
+            if warmup.done.is_set() or waited_ms >= max_wait_ms:
+                self.splash.destroy()
+                on_close()
             else:
-                self.result_queue.put(("error", f"转码失败，返回代码: {return_code}"))
-        
-        except Exception as e:
-            self.result_queue.put(("error", f"转码过程中出错: {str(e)}"))
-    
-    def check_ffmpeg(self):
-        """检查系统中是否安装了ffmpeg"""
-        try:
-            subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            return True
-        except (subprocess.SubprocessError, FileNotFoundError):
-            return False
-def draw_frame(stage):
-    fig, ax = plt.subplots(figsize=(3, 3))
-    ax.set_xlim(0, 10)
-    ax.set_ylim(0, 10)
-    ax.axis('off')
-
-    if stage == 0:
-        # 彩色3x3格子
-        colors = ['#F8B400', '#00C9A7', '#FF6363', '#00B8D4', '#E8EAF6', '#FFA726', '#FF7043', '#4DB6AC', '#29B6F6']
-        idx = 0
-        for i in range(3):
-            for j in range(3):
-                ax.add_patch(plt.Rectangle((1 + j*2, 6 - i*2), 1.5, 1.5, color=colors[idx]))
-                idx += 1
-
-    elif stage == 1:
-        # 蓝色菱形
-        ax.fill([[5, 7, 5, 3]], [[3, 5, 7, 5]], color='#00BCD4')
-
-    elif stage == 2:
-        # 黄色方块
-        ax.add_patch(plt.Rectangle((3, 3), 4, 4, color='#FBC02D'))
-
-    elif stage == 3:
-        # 黄色3x3方格
-        for i in range(3):
-            for j in range(3):
-                ax.add_patch(plt.Rectangle((3 + j*1, 6 - i*1), 0.8, 0.8, color='#FFB300'))
-
-    elif stage == 4:
-        # 小点
-        ax.plot(5, 5, 's', markersize=6, color='#263238')
-
-    fig.canvas.draw()
-    image = np.frombuffer(fig.canvas.tostring_rgb(), dtype='uint8')
-    image = image.reshape(fig.canvas.get_width_height()[::-1] + (3,))
-    plt.close(fig)
-    return Image.fromarray(image)
-
-# 生成帧并保存成GIF
-frames = []
-for i in range(5):
-    frames.append(draw_frame(i))
-
-frames[0].save("loading_custom.gif", save_all=True, append_images=frames[1:], duration=300, loop=0)            
-
-def show_splash_screen(root):
-    splash = tk.Toplevel(root)
-    splash.title("加载中...")
-    splash.geometry("400x300")
-    splash.overrideredirect(True)
-    splash.attributes('-topmost', True)
-
-    screen_width = splash.winfo_screenwidth()
-    screen_height = splash.winfo_screenheight()
-    x = (screen_width - 400) // 2
-    y = (screen_height - 300) // 2
-    splash.geometry(f"400x300+{x}+{y}")
-
-    label = tk.Label(splash, text="YouTube 下载器", font=('SimHei', 18, 'bold'), fg="red")
-    label.pack(pady=20)
-
-    progress = ttk.Progressbar(splash, orient='horizontal', mode='indeterminate', length=300)
-    progress.pack(pady=20)
-    progress.start(10)
-
-    status_label = tk.Label(splash, text="加载中...", font=('SimHei', 12))
-    status_label.pack()
-
-    def close_splash():
-        progress.stop()
-        splash.destroy()
+                self.root.after(self.POLL_MS, poll)
+
+        poll()
+
+
+def launch(root, on_ready=None):
+    """显示启动画面并构建主界面，预热完成后显示主窗口"""
+    root.withdraw()
+    splash = SplashScreen(root)
+    app = YouTubeDownloaderApp(root)
+    warmup = StartupWarmup(app.warmup_steps(), logger=app.logger)
+    warmup.start()
+
+    def ready():
         root.deiconify()
+        if on_ready:
+            on_ready(app, warmup)
+
+    splash.follow(warmup, ready)
+    return app
+
+
+def run_startup_benchmark(budget_ms=None):
+    """测量从模块导入到主窗口可交互的耗时，超出预算时返回非零退出码"""
+    root = tk.Tk()
+    result = {}
+
+    def ready(app, warmup):
+        root.update()
+        tti_ms = (time.perf_counter() - _STARTUP_T0) * 1000
+        result.update({
+            "time_to_interactive_ms": round(tti_ms, 1),
+            "budget_ms": budget_ms,
+            "warmup_completed": f"{warmup.completed}/{len(warmup.steps)}",
+            "heavy_modules_loaded": [m for m in ("yt_dlp", "matplotlib", "numpy", "PIL") if m in sys.modules],
+        })
+        print(json.dumps(result))
+        app.engine.shutdown()
+        root.after(0, root.destroy)
+
+    launch(root, ready)
+    root.mainloop()
+    tti_ms = result.get("time_to_interactive_ms")
+    return 1 if budget_ms is not None and (tti_ms is None or tti_ms > budget_ms) else 0
 
-    root.after(3000, close_splash)
 
 def main():
     """程序入口点"""
+    # 打包后的程序启动下载子进程时需要
+    multiprocessing.freeze_support()
+    if "--bench-startup" in sys.argv:
+        budget_ms = None
+        if "--budget-ms" in sys.argv:
+            budget_ms = float(sys.argv[sys.argv.index("--budget-ms") + 1])
+        sys.exit(run_startup_benchmark(budget_ms))
+
     root = tk.Tk()
-    root.withdraw()
-    show_splash_screen(root)
-    app = YouTubeDownloaderApp(root)
+    launch(root, on_ready=lambda app, warmup: app.offer_recovery())
     root.mainloop()
 
+
 if __name__ == '__main__':
     main()
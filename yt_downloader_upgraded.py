@@ -1,10 +1,21 @@
-import yt_dlp
+import argparse
+import json
+import os
 import sys
-import tkinter as tk
-from tkinter import filedialog, simpledialog, messagebox
+import threading
+import time
 
-def query_formats(url):
-    """查询视频的所有可用格式"""
+# yt_dlp和tkinter都在用到时才导入，命令行管道中启动更快
+
+def load_yt_dlp():
+    import yt_dlp
+    return yt_dlp
+
+def query_formats(url, proxy=None, constraints=None):
+    """查询视频的所有可用格式，并按限制条件推荐格式"""
+    from format_select import select_format
+
+    yt_dlp = load_yt_dlp()
     ydl_opts = {
         'socket_timeout': 10,
         'proxy': proxy,}
@@ -15,10 +26,14 @@ def query_formats(url):
         formats_info += f"\nAvailable formats for: {info_dict.get('title')}\n"
         for f in formats:
             formats_info += f"Format ID: {f['format_id']}, Ext: {f['ext']}, Resolution: {f.get('resolution', 'N/A')}, ACodec: {f.get('acodec')}, VCodec: {f.get('vcodec')}, Filesize: {f.get('filesize')}\n"
+        choice = select_format(info_dict, constraints)
+        if choice is not None:
+            formats_info += f"Recommended: {choice.describe()}\n"
     return formats_info
 
-def download_video(url, format_id=None):
+def download_video(url, format_id=None, proxy=None):
     """下载视频"""
+    yt_dlp = load_yt_dlp()
     ydl_opts = {
         'socket_timeout': 10,
         'proxy': proxy,
@@ -28,8 +43,9 @@ def download_video(url, format_id=None):
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         ydl.download([url])
 
-def download_audio(url):
+def download_audio(url, proxy=None):
     """下载音频 (mp3)"""
+    yt_dlp = load_yt_dlp()
     ydl_opts = {
         'socket_timeout': 10,
         'proxy': proxy,
@@ -45,45 +61,45 @@ def download_audio(url):
         ydl.download([url])
 
 def run_gui():
+    import tkinter as tk
+    from tkinter import simpledialog, messagebox
+
     root = tk.Tk()
     root.title("YouTube Downloader")
     root.geometry("500x300")
 
     def on_query():
-        global proxy
         proxy = entry_proxy.get().strip() or None
         url = entry_url.get()
         if not url:
             messagebox.showwarning("Warning", "请输入视频链接")
             return
-        result = query_formats(url)
+        result = query_formats(url, proxy)
         messagebox.showinfo("可用格式", result)
 
     def on_download_video():
-        global proxy
         proxy = entry_proxy.get().strip() or None
         url = entry_url.get()
         fmt = simpledialog.askstring("格式ID", "请输入Format ID（可留空自动选择最佳）")
         try:
-            download_video(url, fmt)
+            download_video(url, fmt, proxy)
             messagebox.showinfo("成功", "视频下载完成")
         except Exception as e:
-        if 'yt_dlp.utils.DownloadError' in str(type(e)) or 'Network' in str(e) or '403' in str(e):
-            messagebox.showerror("网络错误", "连接 YouTube 失败，可能是网络限制或无代理所致。")
-            return
+            if 'yt_dlp.utils.DownloadError' in str(type(e)) or 'Network' in str(e) or '403' in str(e):
+                messagebox.showerror("网络错误", "连接 YouTube 失败，可能是网络限制或无代理所致。")
+                return
             messagebox.showerror("错误", str(e))
 
     def on_download_audio():
-        global proxy
         proxy = entry_proxy.get().strip() or None
         url = entry_url.get()
         try:
-            download_audio(url)
+            download_audio(url, proxy)
             messagebox.showinfo("成功", "音频下载完成")
         except Exception as e:
-        if 'yt_dlp.utils.DownloadError' in str(type(e)) or 'Network' in str(e) or '403' in str(e):
-            messagebox.showerror("网络错误", "连接 YouTube 失败，可能是网络限制或无代理所致。")
-            return
+            if 'yt_dlp.utils.DownloadError' in str(type(e)) or 'Network' in str(e) or '403' in str(e):
+                messagebox.showerror("网络错误", "连接 YouTube 失败，可能是网络限制或无代理所致。")
+                return
             messagebox.showerror("错误", str(e))
 
     tk.Label(root, text="输入YouTube链接:").pack(pady=10)
@@ -102,9 +118,327 @@ def run_gui():
 
     root.mainloop()
 
+class JsonLinesWriter:
+    """线程安全地逐行输出JSON事件"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        record = {"event": event, "ts": round(time.time(), 3)}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+def read_batch_urls(source):
+    """从文件或标准输入（-）读取地址，忽略空行和#注释，按规范视频ID去重"""
+    from url_canon import canonical_key
+
+    stream = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+    try:
+        urls, seen = [], set()
+        for line in stream:
+            url = line.strip()
+            if not url or url.startswith("#"):
+                continue
+            key = canonical_key(url) or url
+            if key not in seen:
+                seen.add(key)
+                urls.append(url)
+        return urls
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def build_batch_options(args, progress_hook, fragments=None, postprocessor_hook=None):
+    ydl_opts = {
+        'socket_timeout': 10,
+        'proxy': args.proxy,
+        'outtmpl': f"{args.output}/%(title)s.%(ext)s",
+        'noplaylist': True,
+        'continuedl': True,
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'progress_hooks': [progress_hook],
+    }
+    if postprocessor_hook:
+        ydl_opts['postprocessor_hooks'] = [postprocessor_hook]
+    if fragments:
+        ydl_opts['concurrent_fragment_downloads'] = fragments
+    if args.mode == "audio":
+        ydl_opts['format'] = args.format or 'bestaudio/best'
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }]
+    else:
+        ydl_opts['format'] = args.format or 'best'
+    return ydl_opts
+
+def build_batch_constraints(args):
+    """命令行中的格式限制，未指定--format且给出了任一限制时返回FormatConstraints"""
+    from format_select import FormatConstraints
+
+    if args.format or not any((args.max_size, args.max_height, args.vcodec, args.container, args.deadline)):
+        return None
+    return FormatConstraints(
+        max_bytes=int(args.max_size * 1024 * 1024) if args.max_size else None,
+        max_height=args.max_height,
+        vcodecs=args.vcodec.split(",") if args.vcodec else None,
+        container=args.container,
+        deadline=args.deadline,
+        audio_only=args.mode == "audio",
+    )
+
+def run_batch_preflight(args, urls, constraints, throughput, writer):
+    """批量预检：并行解析全部地址，估算总大小、所需空间和用时
+
+    空间不足时按--on-low-space拒绝（抛出RuntimeError）或只保留放得下的地址。
+    返回 (要下载的地址, 已解析的视频信息)，下载时直接使用这些信息，不再重复提取。
+    """
+    from preflight import run_preflight
+
+    yt_dlp = load_yt_dlp()
+    infos = {}
+
+    def resolve(url):
+        with yt_dlp.YoutubeDL({'socket_timeout': 10, 'proxy': args.proxy, 'quiet': True, 'no_warnings': True}) as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False), remove_private_keys=True)
+        infos[url] = info
+        return info
+
+    format_id = args.format or ('bestaudio' if args.mode == "audio" else 'best')
+    report = run_preflight(urls, resolve, format_id, args.output, constraints=constraints,
+                           workers=args.jobs, throughput=throughput)
+    fields = report.to_dict()
+    del fields["items"]
+    writer.emit("preflight", summary=report.summary(), **fields)
+    if not report.enough_space:
+        if args.on_low_space == "refuse":
+            raise RuntimeError(f"磁盘空间不足: {report.summary()}")
+        if args.on_low_space == "fit":
+            urls = report.fitting_urls()
+            writer.emit("preflight_fit", kept=len(urls), dropped=len(report.pending) - len(urls))
+    return urls, infos
+
+def run_batch(args, writer):
+    """用有界工作线程池并行下载，每个任务事件输出一行JSON，返回失败的任务数"""
+    from scheduler import DownloadScheduler, DownloadTask
+    from fragment_tuner import FragmentTuner
+    from format_select import select_format
+    from preflight import ThroughputHistory
+    from metrics import MetricsRegistry, PhaseTimer
+
+    constraints = build_batch_constraints(args)
+    registry = MetricsRegistry()
+    tuner = FragmentTuner("fragment_tuning.json") if args.fragments == "auto" else None
+    history = ThroughputHistory("throughput_history.json")
+    throughput = history.estimate()
+    urls = read_batch_urls(args.source)
+    infos = {}
+    if args.preflight:
+        urls, infos = run_batch_preflight(args, urls, constraints, throughput, writer)
+    batch_start = time.monotonic()
+    writer.emit("batch_start", total=len(urls), jobs=args.jobs)
+
+    def worker(task):
+        yt_dlp = load_yt_dlp()
+        started = time.monotonic()
+        last_emit = [0.0]
+        writer.emit("start", task=task.task_id, url=task.url)
+        timer = PhaseTimer(registry, task.task_id)
+        timer.start("resolve")
+        fragments = tuner.concurrency_for(task.host, args.proxy) if tuner else (int(args.fragments) if args.fragments else None)
+        # 测量会话在第一次出现分片进度时才创建
+        tuning = None
+        ydl_holder = []
+
+        def progress_hook(d):
+            nonlocal tuning
+            timer.on_progress(d)
+            history.observe(task.host, d)
+            if tuning is None and tuner is not None and d.get('fragment_count'):
+                tuning = tuner.session(task.host, args.proxy, fragments)
+            if tuning is not None:
+                concurrency = tuning.observe(d)
+                if concurrency is not None and ydl_holder:
+                    ydl_holder[0].params['concurrent_fragment_downloads'] = concurrency
+            now = time.monotonic()
+            if d['status'] == 'downloading' and now - last_emit[0] >= args.progress_interval:
+                last_emit[0] = now
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                downloaded = d.get('downloaded_bytes') or 0
+                writer.emit(
+                    "progress", task=task.task_id,
+                    percent=round(downloaded / total * 100, 1) if total else None,
+                    downloaded_bytes=downloaded, total_bytes=total,
+                    speed=d.get('speed'), eta=d.get('eta')
+                )
+
+        try:
+            with yt_dlp.YoutubeDL(build_batch_options(args, progress_hook, fragments, timer.on_postprocess)) as ydl:
+                ydl_holder.append(ydl)
+                info = infos.get(task.url)
+                if constraints is not None or info is not None:
+                    # 先提取信息（预检时已提取的直接使用），按限制选择格式后再下载
+                    if info is None:
+                        info = ydl.extract_info(task.url, download=False)
+                    choice = select_format(info, constraints, throughput=throughput) if constraints is not None else None
+                    if choice is not None:
+                        ydl.params['format'] = choice.spec
+                        writer.emit("format", task=task.task_id, **choice.to_dict())
+                    info = ydl.process_ie_result(info, download=True)
+                else:
+                    info = ydl.extract_info(task.url, download=True)
+            task.title = info.get('title')
+            downloads = info.get('requested_downloads') or [{}]
+            timer.close("done")
+            writer.emit(
+                "done", task=task.task_id, url=task.url, title=task.title,
+                filename=downloads[0].get('filepath'), elapsed=round(time.monotonic() - started, 3),
+                phases=registry.task_spans(task.task_id)
+            )
+        except Exception as e:
+            task.status = "failed"
+            task.error = str(e)
+            timer.close("failed")
+            if tuning is not None and ('403' in str(e) or '429' in str(e)):
+                tuning.throttled()
+            writer.emit("error", task=task.task_id, url=task.url, error=str(e),
+                        elapsed=round(time.monotonic() - started, 3))
+
+    scheduler = DownloadScheduler(worker, max_workers=args.jobs, per_host_limit=args.per_host or args.jobs)
+    tasks = [scheduler.submit(DownloadTask(f"task_{i}", url, {})) for i, url in enumerate(urls, 1)]
+    while not scheduler.is_idle():
+        time.sleep(0.1)
+    scheduler.shutdown()
+
+    failed = sum(1 for task in tasks if task.status != "done")
+    if args.metrics_file:
+        registry.write_prometheus(args.metrics_file)
+    writer.emit(
+        "summary", total=len(tasks), done=len(tasks) - failed, failed=failed,
+        elapsed=round(time.monotonic() - batch_start, 3), phases=registry.snapshot()["phases"]
+    )
+    return failed
+
+def run_batch_remote(args, writer):
+    """通过守护进程执行批量任务，轮询状态并转换为同样的JSON事件"""
+    from daemon import DaemonClient
+
+    client = DaemonClient(args.daemon)
+    urls = read_batch_urls(args.source)
+    batch_start = time.monotonic()
+    options = {"proxy": args.proxy, "save_path": args.output, "format_id": args.format or ('bestaudio' if args.mode == "audio" else 'best')}
+    constraints = build_batch_constraints(args)
+    if constraints is not None:
+        options["format_constraints"] = constraints.to_dict()
+    if args.fragments:
+        options["thread_count"] = args.fragments if args.fragments == "auto" else int(args.fragments)
+    if args.preflight:
+        # 由守护进程解析和估算，可用空间按守护进程所在机器计算
+        report = client.preflight(urls, options)
+        fields = {key: value for key, value in report.items() if key not in ("items", "fitting")}
+        writer.emit("preflight", **fields)
+        if not report["enough_space"]:
+            if args.on_low_space == "refuse":
+                raise RuntimeError(f"磁盘空间不足: {report['summary']}")
+            if args.on_low_space == "fit":
+                pending = sum(1 for item in report["items"] if not item["skipped"] and not item["error"])
+                urls = report["fitting"]
+                writer.emit("preflight_fit", kept=len(urls), dropped=pending - len(urls))
+    jobs = client.submit(urls, options)["jobs"]
+    writer.emit("batch_start", total=len(jobs), daemon=args.daemon)
+
+    last = {}
+    finished = {}
+    while len(finished) < len(jobs):
+        # 每轮只请求一次任务列表，不逐个查询
+        statuses = {job["task_id"]: job for job in client.jobs()}
+        for job in jobs:
+            job_id = job["task_id"]
+            if job_id in finished:
+                continue
+            status = statuses.get(job_id)
+            if status is None:
+                # 任务已被守护进程清理
+                writer.emit("error", task=job_id, url=job["url"], error="任务不存在", elapsed=None)
+                finished[job_id] = "missing"
+                continue
+            previous = last.get(job_id, {})
+            if status["status"] == "running" and previous.get("status") != "running":
+                writer.emit("start", task=job_id, url=status["url"])
+            elif status["status"] == "running" and status["progress"] != previous.get("progress"):
+                writer.emit("progress", task=job_id, percent=status["progress"])
+            if status["status"] in ("done", "failed", "cancelled"):
+                elapsed = round((status["finished_at"] or time.time()) - (status["started_at"] or status["created_at"]), 3)
+                if status["status"] == "done":
+                    writer.emit("done", task=job_id, url=status["url"], title=status["title"], elapsed=elapsed)
+                else:
+                    writer.emit("error", task=job_id, url=status["url"], error=status["error"] or status["status"], elapsed=elapsed)
+                finished[job_id] = status["status"]
+            last[job_id] = status
+        time.sleep(args.progress_interval)
+
+    failed = sum(1 for status in finished.values() if status != "done")
+    # 阶段用时由守护进程统计（包含其他提交者的任务）
+    writer.emit(
+        "summary", total=len(jobs), done=len(jobs) - failed, failed=failed,
+        elapsed=round(time.monotonic() - batch_start, 3), phases=client.metrics().get("phases")
+    )
+    return failed
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="yt_downloader_upgraded.py batch",
+        description="批量下载：从文件或标准输入读取地址，并行执行，每个事件输出一行JSON"
+    )
+    parser.add_argument("source", nargs="?", default="-", help="地址列表文件，每行一个；- 表示标准输入")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="并发任务数（默认4）")
+    parser.add_argument("--per-host", type=int, default=None, help="单站点并发上限（默认与--jobs相同）")
+    parser.add_argument("--mode", choices=["video", "audio"], default="video", help="下载视频或音频(mp3)")
+    parser.add_argument("--format", "-f", default=None, help="格式ID")
+    parser.add_argument("--proxy", default=None, help="代理地址")
+    parser.add_argument("--output", "-o", default=".", help="保存目录")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="每个任务进度事件的最小间隔（秒）")
+    parser.add_argument("--max-size", type=float, default=None, help="单个视频的最大大小（MiB），未指定--format时按限制选择格式")
+    parser.add_argument("--max-height", type=int, default=None, help="最高分辨率（如1080）")
+    parser.add_argument("--vcodec", default=None, help="首选视频编码，逗号分隔，如 h264,vp9")
+    parser.add_argument("--container", default=None, help="目标容器（如mp4），编码兼容的格式优先")
+    parser.add_argument("--deadline", type=float, default=None, help="单个视频的下载时限（秒），需要配合带宽估计")
+    parser.add_argument("--preflight", action="store_true", help="开始前解析全部地址，估算总大小、磁盘空间和用时")
+    parser.add_argument("--on-low-space", choices=["refuse", "fit", "ignore"], default="refuse",
+                        help="预检发现空间不足时：拒绝执行、只下载放得下的（小的优先）或忽略")
+    parser.add_argument("--fragments", default=None, help="每个任务的分片并发数（只影响HLS/DASH分片格式），auto 表示按实测吞吐自动调整")
+    parser.add_argument("--daemon", default=None, help="提交到守护进程执行，例如 http://127.0.0.1:8765")
+    parser.add_argument("--metrics-file", default=None,
+                        help="结束时把各阶段用时以Prometheus文本格式写入该文件（守护进程模式请使用守护进程的--metrics-file）")
+    args = parser.parse_args(argv)
+    if args.daemon and (args.jobs is not None or args.per_host is not None):
+        parser.error("--jobs 和 --per-host 不能与 --daemon 一起使用，并发数由守护进程的 --workers 和 --per-host 决定")
+    args.jobs = 4 if args.jobs is None else max(1, args.jobs)
+    if args.fragments not in (None, "auto") and not args.fragments.isdigit():
+        parser.error("--fragments 必须是正整数或 auto")
+
+    writer = JsonLinesWriter()
+    try:
+        failed = run_batch_remote(args, writer) if args.daemon else run_batch(args, writer)
+    except (OSError, RuntimeError) as e:
+        writer.emit("fatal", error=str(e))
+        return 2
+    # 全部成功返回0，有失败的任务返回1
+    return 1 if failed else 0
+
 def main():
     if len(sys.argv) == 1:
         run_gui()
+    elif sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
     elif len(sys.argv) >= 3:
         command = sys.argv[1]
         url = sys.argv[2]
@@ -119,10 +453,12 @@ def main():
         else:
             print("Invalid command. Use 'query', 'video', or 'audio'.")
     else:
+        script = os.path.basename(sys.argv[0])
         print("Usage:")
-        print("  python yt_downloader.py query <url>")
-        print("  python yt_downloader.py video <url> [format_id]")
-        print("  python yt_downloader.py audio <url>")
+        print(f"  python {script} query <url>")
+        print(f"  python {script} video <url> [format_id]")
+        print(f"  python {script} audio <url>")
+        print(f"  python {script} batch [file|-] [--jobs N] [--mode video|audio] [--fragments N|auto] [--daemon URL]")
 
 if __name__ == '__main__':
     main()